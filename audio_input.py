@@ -0,0 +1,57 @@
+import os
+from typing import List, Optional
+
+# Формат входящего аудио от клиента: 16-bit PCM, little-endian, моно
+AUDIO_SAMPLE_RATE = int(os.getenv("LIVE_AUDIO_RATE", "16000"))
+AUDIO_MIME_TYPE = f"audio/pcm;rate={AUDIO_SAMPLE_RATE}"
+# Длительность кадра, отправляемого в модель (0 — пересылать чанки клиента как есть)
+AUDIO_FRAME_MS = int(os.getenv("LIVE_AUDIO_FRAME_MS", "40"))
+
+
+def frame_size(frame_ms: int = AUDIO_FRAME_MS, sample_rate: int = AUDIO_SAMPLE_RATE) -> int:
+    """Размер кадра в байтах для 16-bit моно PCM"""
+    return sample_rate * 2 * frame_ms // 1000
+
+
+class AudioFramer:
+    """
+    Собирает бинарные PCM-чанки клиента в кадры фиксированного размера
+
+    Полные кадры нарезаются срезами memoryview прямо из входящего буфера без копирования;
+    в промежуточный bytearray попадает только хвост, не дотянувший до целого кадра.
+    """
+
+    def __init__(self, frame_bytes: int = None):
+        self.frame_bytes = frame_size() if frame_bytes is None else frame_bytes
+        self._buffer = bytearray()
+
+    def feed(self, chunk: bytes) -> List[memoryview]:
+        view = memoryview(chunk)
+        if self.frame_bytes <= 0:
+            return [view] if len(view) else []
+
+        frames = []
+        if self._buffer:
+            need = self.frame_bytes - len(self._buffer)
+            self._buffer += view[:need]
+            view = view[need:]
+            if len(self._buffer) < self.frame_bytes:
+                return frames
+            frames.append(memoryview(self._buffer))
+            self._buffer = bytearray()
+
+        while len(view) >= self.frame_bytes:
+            frames.append(view[:self.frame_bytes])
+            view = view[self.frame_bytes:]
+
+        if len(view):
+            self._buffer += view
+        return frames
+
+    def flush(self) -> Optional[memoryview]:
+        """Возвращает недособранный хвост (например, в конце реплики)"""
+        if not self._buffer:
+            return None
+        tail = memoryview(self._buffer)
+        self._buffer = bytearray()
+        return tail
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк локального поиска (knowledge_index) на синтетическом корпусе
+
+Пример:
+    python benchmarks/knowledge_bench.py --docs 100000 --queries 1000
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from knowledge_index import KnowledgeIndex  # noqa: E402
+
+SYLLABLES = ["ма", "ка", "ро", "ти", "на", "ле", "по", "ви", "за", "ду", "ми", "се", "та", "ko", "ra", "li", "po"]
+
+
+def make_vocabulary(size: int, rng: random.Random) -> list:
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def make_corpus(docs: int, words_per_doc: int, vocabulary: list, rng: random.Random) -> list:
+    # Распределение слов близко к Ципфу, как в реальных текстах
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    corpus = []
+    for doc_id in range(1, docs + 1):
+        words = rng.choices(vocabulary, weights=weights, k=words_per_doc)
+        corpus.append({
+            "id": doc_id,
+            "title": " ".join(words[:6]),
+            "content": " ".join(words),
+        })
+    return corpus
+
+
+def percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=100_000)
+    parser.add_argument("--words", type=int, default=120, help="слов в документе")
+    parser.add_argument("--vocabulary", type=int, default=20_000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--limit", type=int, default=3)
+    parser.add_argument("--updates", type=int, default=10, help="документов для инкрементальной переиндексации")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="сохранить результат в JSON-файл")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix="knowledge_bench_")
+    try:
+        vocabulary = make_vocabulary(args.vocabulary, rng)
+        corpus = make_corpus(args.docs, args.words, vocabulary, rng)
+        documents_path = os.path.join(workdir, "documents.json")
+        with open(documents_path, "w", encoding="utf-8") as f:
+            json.dump(corpus, f, ensure_ascii=False)
+
+        knowledge = KnowledgeIndex(os.path.join(workdir, "index"), documents_path, check_interval=-1)
+        started = time.perf_counter()
+        knowledge.open()
+        build_s = time.perf_counter() - started
+
+        started = time.perf_counter()
+        knowledge.close()
+        knowledge.open()
+        reopen_s = time.perf_counter() - started
+
+        # Запросы из 1–3 слов средней частотности
+        pool = vocabulary[50:5000]
+        latencies = []
+        for _ in range(args.queries):
+            query = " ".join(rng.sample(pool, rng.randint(1, 3)))
+            started = time.perf_counter()
+            knowledge.search(query, args.limit)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        for doc in rng.sample(corpus, args.updates):
+            doc["content"] += " " + " ".join(rng.sample(vocabulary, 10))
+        with open(documents_path, "w", encoding="utf-8") as f:
+            json.dump(corpus, f, ensure_ascii=False)
+        started = time.perf_counter()
+        knowledge._sync()
+        update_s = time.perf_counter() - started
+        knowledge.close()
+
+        report = {
+            "docs": args.docs,
+            "words_per_doc": args.words,
+            "queries": args.queries,
+            "build_s": round(build_s, 3),
+            "reopen_s": round(reopen_s, 3),
+            "incremental_update_s": round(update_s, 3),
+            "updated_docs": args.updates,
+            "search_ms": {
+                "mean": round(statistics.mean(latencies), 3),
+                "p50": round(percentile(latencies, 0.50), 3),
+                "p95": round(percentile(latencies, 0.95), 3),
+                "p99": round(percentile(latencies, 0.99), 3),
+                "max": round(max(latencies), 3),
+            },
+        }
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
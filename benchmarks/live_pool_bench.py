@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк пула тёплых Live-сессий (live_pool) на локальном mock Live-клиенте
+
+Клиенты приходят с интервалом --interval-ms, каждый со случайной из --configs
+конфигураций, и держат сессию --hold-ms. Меряется время от прихода конфига до
+получения открытой сессии — без пула и с пулом размера --pool-size.
+
+Пример:
+    python benchmarks/live_pool_bench.py --clients 200 --handshake-ms 400 --pool-size 2
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from live_pool import LiveSessionPool  # noqa: E402
+from mock_live import MockLiveClient  # noqa: E402
+
+
+def percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def summarize(latencies: list) -> dict:
+    return {
+        "mean": round(statistics.mean(latencies), 2),
+        "p50": round(percentile(latencies, 0.50), 2),
+        "p95": round(percentile(latencies, 0.95), 2),
+        "p99": round(percentile(latencies, 0.99), 2),
+        "max": round(max(latencies), 2),
+    }
+
+
+async def run(args, pool_size: int) -> dict:
+    client = MockLiveClient(handshake_ms=args.handshake_ms, jitter_ms=args.jitter_ms, seed=args.seed)
+    configs = [(f"system prompt {i}", "Orus") for i in range(args.configs)]
+    pool = LiveSessionPool(
+        connect=lambda key: client.live.connect(model="mock", config=key),
+        size=pool_size,
+        max_keys=args.configs,
+        idle_ttl=3600,
+        check_interval=1,
+    )
+    await pool.start(configs if args.prewarm else [])
+    if args.prewarm and pool_size:
+        # Даём пулу открыть сессии до прихода первых клиентов
+        await asyncio.sleep((args.handshake_ms + args.jitter_ms) / 1000 + 0.05)
+
+    rng = random.Random(args.seed)
+    latencies = []
+
+    async def one_client():
+        key = rng.choice(configs)
+        started = time.perf_counter()
+        async with pool.session(key):
+            latencies.append((time.perf_counter() - started) * 1000)
+            await asyncio.sleep(args.hold_ms / 1000)
+
+    tasks = []
+    for _ in range(args.clients):
+        tasks.append(asyncio.create_task(one_client()))
+        await asyncio.sleep(args.interval_ms / 1000)
+    await asyncio.gather(*tasks)
+    stats = pool.stats()
+    await pool.close()
+    return {
+        "pool_size": pool_size,
+        "connect_ms": summarize(latencies),
+        "hits": stats["hits"],
+        "misses": stats["misses"],
+        "upstream_connects": client.live.connects,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--configs", type=int, default=3, help="разных (system_prompt, voice_name)")
+    parser.add_argument("--interval-ms", type=float, default=50, help="пауза между приходом клиентов")
+    parser.add_argument("--hold-ms", type=float, default=500, help="сколько клиент держит сессию")
+    parser.add_argument("--handshake-ms", type=float, default=400, help="задержка подключения к Live API")
+    parser.add_argument("--jitter-ms", type=float, default=100)
+    parser.add_argument("--pool-size", type=int, default=2)
+    parser.add_argument("--prewarm", action="store_true", help="прогреть все конфигурации до прихода клиентов")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="сохранить результат в JSON-файл")
+    args = parser.parse_args()
+
+    report = {
+        "clients": args.clients,
+        "configs": args.configs,
+        "interval_ms": args.interval_ms,
+        "handshake_ms": args.handshake_ms,
+        "runs": [asyncio.run(run(args, 0)), asyncio.run(run(args, args.pool_size))],
+    }
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест сервера целиком: N WebSocket-клиентов против server.py с mock Live API
+
+Сервер запускается отдельным процессом (uvicorn) с MockLiveClient вместо genai.Client:
+модель отвечает аудио-чанками по сценарию и каждые --tool-every реплик вызывает функции
+по очереди из --tools. Функции ходят в локальные mock DuckDuckGo и Wolfram
+(benchmarks/mock_services.py), поэтому тест не зависит от сети.
+
+Меряется:
+    * на клиенте — задержка реплики (от отправки текста до последнего аудио-чанка)
+      и время до первого аудио;
+    * на сервере (из /metrics) — длительность вызовов функций и ожидание в очереди,
+      время до первого аудио, задержка event loop;
+    * RSS процесса сервера (из /proc).
+
+Результат — JSON (--output); --compare сравнивает его с результатом прошлого запуска.
+
+Пример:
+    python benchmarks/load_test.py --clients 50 --turns 5 --output results/load.json
+    python benchmarks/load_test.py --clients 50 --turns 5 --compare results/load.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Функции, которые mock-модель вызывает по умолчанию; {turn} и {session} делают запросы уникальными
+DEFAULT_TOOLS = [
+    ["web_search", {"query": "новости сессии {session} реплика {turn}"}],
+    ["wolfram", {"query": "integrate x^{turn} dx, session {session}"}],
+    ["text_display", {"text": "Важный текст {turn}"}],
+]
+
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)$')
+LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def summarize(values: list) -> dict:
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": round(statistics.mean(values), 2),
+        "p50": round(percentile(values, 0.50), 2),
+        "p95": round(percentile(values, 0.95), 2),
+        "p99": round(percentile(values, 0.99), 2),
+        "max": round(max(values), 2),
+    }
+
+
+def parse_metrics(text: str) -> dict:
+    """Текст Prometheus -> {имя: [(метки, значение), ...]}"""
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        match = SAMPLE.match(line)
+        if match is None:
+            continue
+        name, labels, value = match.groups()
+        samples.setdefault(name, []).append((dict(LABEL.findall(labels or "")), float(value)))
+    return samples
+
+
+def histogram_quantile(buckets: list, q: float) -> float:
+    """Квантиль по кумулятивным корзинам [(граница, count)] с линейной интерполяцией, как в PromQL"""
+    total = buckets[-1][1]
+    if not total:
+        return 0.0
+    rank = q * total
+    lower, below = 0.0, 0
+    for bound, count in buckets:
+        if count >= rank:
+            if bound == float("inf"):
+                return lower
+            return lower + (bound - lower) * (rank - below) / max(count - below, 1)
+        lower, below = bound, count
+    return lower
+
+
+def histogram_summary(samples: dict, name: str, group_by: tuple = (), scale: float = 1000) -> dict:
+    """Сводка гистограммы (секунды * scale, по умолчанию мс): count, mean, p50/p95/p99 (по корзинам)"""
+    groups = {}
+    for labels, value in samples.get(f"{name}_bucket", []):
+        key = tuple(labels.get(label, "") for label in group_by)
+        bound = float("inf") if labels["le"] == "+Inf" else float(labels["le"])
+        buckets = groups.setdefault(key, {})
+        buckets[bound] = buckets.get(bound, 0) + value
+    sums = {}
+    for labels, value in samples.get(f"{name}_sum", []):
+        key = tuple(labels.get(label, "") for label in group_by)
+        sums[key] = sums.get(key, 0) + value
+
+    result = {}
+    for key, buckets in groups.items():
+        ordered = sorted(buckets.items())
+        count = ordered[-1][1]
+        result["/".join(key) or "all"] = {
+            "count": int(count),
+            "mean": round(sums.get(key, 0) / count * scale, 2) if count else 0,
+            "p50": round(histogram_quantile(ordered, 0.50) * scale, 2),
+            "p95": round(histogram_quantile(ordered, 0.95) * scale, 2),
+            "p99": round(histogram_quantile(ordered, 0.99) * scale, 2),
+        }
+    return result if group_by else result.get("all", {"count": 0})
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def read_rss_mb(pid: int) -> float:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def serve(args):
+    """Процесс сервера: server.app с mock Live API вместо Gemini"""
+    import uvicorn
+    import server
+    from mock_live import MockLiveClient
+
+    server.client = MockLiveClient(
+        handshake_ms=args.handshake_ms,
+        jitter_ms=args.jitter_ms,
+        audio_chunks=args.audio_chunks,
+        chunk_bytes=args.chunk_bytes,
+        chunk_interval_ms=args.chunk_interval_ms,
+        first_byte_ms=args.first_byte_ms,
+        tool_call_every=args.tool_every,
+        tool_script=json.loads(args.tools),
+    )
+    uvicorn.run(server.app, host="127.0.0.1", port=args.port, log_level="warning", ws_max_size=2 ** 24)
+
+
+class ClientResult:
+    def __init__(self):
+        self.turn_ms = []
+        self.ttfa_ms = []
+        self.instructions = 0
+        self.errors = []
+
+
+async def run_client(args, url: str, index: int, result: ClientResult):
+    import websockets
+
+    await asyncio.sleep(args.ramp_s * index / max(args.clients, 1))
+    try:
+        async with websockets.connect(url, max_size=None) as ws:
+            await ws.send(json.dumps({"system_prompt": f"Ты Спарк. Нагрузочный тест {index % args.configs}.",
+                                      "voice_name": "Orus"}))
+            for turn in range(args.turns):
+                started = time.perf_counter()
+                await ws.send(f"Вопрос {turn} от клиента {index}")
+                chunks = 0
+                while chunks < args.audio_chunks:
+                    message = await asyncio.wait_for(ws.recv(), args.turn_timeout)
+                    if isinstance(message, bytes):
+                        if not chunks:
+                            result.ttfa_ms.append((time.perf_counter() - started) * 1000)
+                        chunks += 1
+                    else:
+                        result.instructions += 1
+                result.turn_ms.append((time.perf_counter() - started) * 1000)
+                await asyncio.sleep(args.think_ms * random.uniform(0.5, 1.5) / 1000)
+            await ws.send("exit")
+    except Exception as e:
+        result.errors.append(f"{type(e).__name__}: {e}")
+
+
+async def sample_rss(pid: int, samples: list, interval: float = 0.25):
+    while True:
+        samples.append(read_rss_mb(pid))
+        await asyncio.sleep(interval)
+
+
+async def wait_ready(session, base_url: str, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Сервер завершился с кодом {process.returncode}")
+        try:
+            async with session.get(f"{base_url}/sessions") as response:
+                if response.status == 200:
+                    return
+        except Exception:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("Сервер не поднялся за отведённое время")
+
+
+async def run(args) -> dict:
+    import aiohttp
+    from aiohttp import web
+    from mock_services import create_app
+
+    random.seed(args.seed)
+    mocks = web.AppRunner(create_app(args.search_ms, args.page_ms, args.wolfram_ms, args.page_kb, seed=args.seed))
+    await mocks.setup()
+    mock_port = free_port()
+    await web.TCPSite(mocks, "127.0.0.1", mock_port).start()
+    mock_url = f"http://127.0.0.1:{mock_port}"
+
+    port = free_port()
+    env = dict(
+        os.environ,
+        GENAI_API_KEY=os.getenv("GENAI_API_KEY", "load-test"),
+        WEB_SEARCH_DDG_URL=f"{mock_url}/html/",
+        WOLFRAM_API_URL=f"{mock_url}/api/v1/llm-api",
+        METRICS_LOOP_LAG_INTERVAL=str(args.lag_interval),
+        LIVE_DUPLEX="1" if args.duplex else "0",
+    )
+    command = [
+        sys.executable, os.path.abspath(__file__), "--serve", "--port", str(port),
+        "--handshake-ms", str(args.handshake_ms), "--jitter-ms", str(args.jitter_ms),
+        "--audio-chunks", str(args.audio_chunks), "--chunk-bytes", str(args.chunk_bytes),
+        "--chunk-interval-ms", str(args.chunk_interval_ms), "--first-byte-ms", str(args.first_byte_ms),
+        "--tool-every", str(args.tool_every), "--tools", args.tools,
+    ]
+    log = open(args.server_log, "w") if args.server_log else subprocess.DEVNULL
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{port}"
+    rss = []
+    sampler = None
+    try:
+        async with aiohttp.ClientSession() as http:
+            await wait_ready(http, base_url, process)
+            rss_start = read_rss_mb(process.pid)
+            sampler = asyncio.create_task(sample_rss(process.pid, rss))
+
+            results = [ClientResult() for _ in range(args.clients)]
+            started = time.perf_counter()
+            await asyncio.gather(*(
+                run_client(args, f"ws://127.0.0.1:{port}/ws", i, results[i]) for i in range(args.clients)
+            ))
+            elapsed = time.perf_counter() - started
+            # Даём серверу закрыть сессии и досчитать метрики
+            await asyncio.sleep(0.5)
+
+            async with http.get(f"{base_url}/metrics") as response:
+                samples = parse_metrics(await response.text())
+            async with http.get(f"{base_url}/governor") as response:
+                governor_stats = await response.json()
+            async with http.get(f"{mock_url}/stats") as response:
+                mock_stats = await response.json()
+    finally:
+        if sampler is not None:
+            sampler.cancel()
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        if log is not subprocess.DEVNULL:
+            log.close()
+        await mocks.cleanup()
+
+    turn_ms = [v for r in results for v in r.turn_ms]
+    errors = [e for r in results for e in r.errors]
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {key: value for key, value in vars(args).items()
+                   if key not in ("serve", "port", "output", "compare", "server_log")},
+        "elapsed_s": round(elapsed, 2),
+        "turns": len(turn_ms),
+        "turns_per_s": round(len(turn_ms) / elapsed, 2) if elapsed else 0,
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "client": {
+            "turn_ms": summarize(turn_ms),
+            "ttfa_ms": summarize([v for r in results for v in r.ttfa_ms]),
+            "instructions": sum(r.instructions for r in results),
+        },
+        "server": {
+            "ttfa_ms": histogram_summary(samples, "sparkai_time_to_first_audio_seconds"),
+            "tool_call_ms": histogram_summary(samples, "sparkai_tool_call_duration_seconds", ("function", "status")),
+            "tool_queue_wait_ms": histogram_summary(samples, "sparkai_tool_queue_wait_seconds", ("function",)),
+            "event_loop_lag_ms": histogram_summary(samples, "sparkai_event_loop_lag_seconds"),
+            "tool_output_chars": histogram_summary(samples, "sparkai_tool_output_chars", ("function", "stage"), scale=1),
+        },
+        "rss_mb": {
+            "start": round(rss_start, 1),
+            "peak": round(max(rss, default=rss_start), 1),
+            "end": round(rss[-1] if rss else rss_start, 1),
+        },
+        # Отказы лимитов и предохранителей: при большой нагрузке ослабьте их через GOVERNOR_LIMITS
+        "governor": {name: {"state": b["state"], "calls": b["calls"], "rejected": b["rejected"]}
+                     for name, b in governor_stats.items()},
+        "mock_services": mock_stats,
+    }
+
+
+# Что сравнивать с прошлым запуском: путь в отчёте -> подпись
+COMPARED = {
+    ("client", "turn_ms", "p50"): "turn p50, ms",
+    ("client", "turn_ms", "p95"): "turn p95, ms",
+    ("client", "ttfa_ms", "p50"): "TTFA p50, ms",
+    ("client", "ttfa_ms", "p95"): "TTFA p95, ms",
+    ("server", "event_loop_lag_ms", "p99"): "loop lag p99, ms",
+    ("rss_mb", "peak"): "RSS peak, MB",
+    ("turns_per_s",): "turns/s",
+}
+
+
+def compare(report: dict, baseline: dict) -> list:
+    lines = [f"{'':20} {baseline.get('commit') or 'baseline':>12} {report.get('commit') or 'current':>12} {'change':>9}"]
+    for path, title in COMPARED.items():
+        old, new = baseline, report
+        for key in path:
+            old = old.get(key, {}) if isinstance(old, dict) else {}
+            new = new.get(key, {}) if isinstance(new, dict) else {}
+        if not isinstance(old, (int, float)) or not isinstance(new, (int, float)):
+            continue
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+        lines.append(f"{title:20} {old:>12} {new:>12} {change:>9}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=5, help="реплик на клиента")
+    parser.add_argument("--configs", type=int, default=3, help="разных системных промптов у клиентов")
+    parser.add_argument("--ramp-s", type=float, default=2, help="за сколько секунд подключаются все клиенты")
+    parser.add_argument("--think-ms", type=float, default=200, help="пауза между репликами клиента")
+    parser.add_argument("--turn-timeout", type=float, default=30)
+    parser.add_argument("--duplex", action="store_true", help="запустить сервер с LIVE_DUPLEX=1")
+    parser.add_argument("--seed", type=int, default=42)
+    # mock Live API
+    parser.add_argument("--handshake-ms", type=float, default=300)
+    parser.add_argument("--jitter-ms", type=float, default=100)
+    parser.add_argument("--audio-chunks", type=int, default=10)
+    parser.add_argument("--chunk-bytes", type=int, default=3200)
+    parser.add_argument("--chunk-interval-ms", type=float, default=20)
+    parser.add_argument("--first-byte-ms", type=float, default=150)
+    parser.add_argument("--tool-every", type=int, default=2, help="каждая N-я реплика вызывает функцию (0 — никогда)")
+    parser.add_argument("--tools", default=json.dumps(DEFAULT_TOOLS, ensure_ascii=False),
+                        help="JSON-список [имя, аргументы] для вызовов по очереди")
+    # mock внешних сервисов
+    parser.add_argument("--search-ms", type=float, default=150)
+    parser.add_argument("--page-ms", type=float, default=80)
+    parser.add_argument("--wolfram-ms", type=float, default=300)
+    parser.add_argument("--page-kb", type=int, default=40)
+    parser.add_argument("--lag-interval", type=float, default=0.1, help="период замера задержки event loop")
+    parser.add_argument("--server-log", help="куда писать вывод сервера")
+    parser.add_argument("--output", help="сохранить результат в JSON-файл")
+    parser.add_argument("--compare", help="JSON прошлого запуска для сравнения")
+    # внутренний режим: процесс сервера
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=8000, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    report = asyncio.run(run(args))
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print("\n".join(compare(report, json.load(f))))
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
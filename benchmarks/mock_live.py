@@ -0,0 +1,147 @@
+"""
+Локальная замена client.aio.live из google-genai для бенчмарков
+
+MockLiveClient().aio.live.connect(model=..., config=...) ведёт себя как настоящий:
+это асинхронный контекстный менеджер с задержкой рукопожатия, а сессия
+принимает send_client_content / send_realtime_input / send_tool_response и отдаёт
+ответы модели через receive().
+"""
+import asyncio
+import itertools
+import random
+import types as pytypes
+from contextlib import asynccontextmanager
+from typing import Any, List, Optional, Tuple
+
+
+class MockWebSocket:
+    def __init__(self, ping_ms: float):
+        self.ping_ms = ping_ms
+        self.closed = False
+
+    async def ping(self):
+        pong = asyncio.get_running_loop().create_future()
+        if not self.closed:
+            asyncio.get_running_loop().call_later(self.ping_ms / 1000, pong.set_result, None)
+        return pong
+
+    async def close(self):
+        self.closed = True
+
+
+def _message(data: Optional[bytes] = None, tool_call: Any = None, turn_complete: bool = False):
+    server_content = pytypes.SimpleNamespace(turn_complete=turn_complete, interrupted=False, model_turn=None)
+    return pytypes.SimpleNamespace(
+        data=data,
+        tool_call=tool_call,
+        tool_call_cancellation=None,
+        server_content=server_content,
+        session_resumption_update=None,
+        go_away=None,
+    )
+
+
+class MockLiveSession:
+    """
+    Сессия, которая на каждую реплику отвечает audio_chunks аудио-чанками
+
+    Если задан tool_call_every, каждая такая по счёту реплика сначала вызывает
+    функцию tool_name и ждёт send_tool_response. tool_script — список пар
+    (имя, аргументы), которые вызываются по очереди вместо tool_name; строковые
+    аргументы форматируются с {turn} и {session}, чтобы запросы не попадали в кэш.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, audio_chunks: int = 10, chunk_bytes: int = 3200, chunk_interval_ms: float = 20,
+                 first_byte_ms: float = 150, tool_name: str = None, tool_args: dict = None,
+                 tool_call_every: int = 0, tool_script: List[Tuple[str, dict]] = None, ping_ms: float = 1):
+        self.audio_chunks = audio_chunks
+        self.chunk_bytes = chunk_bytes
+        self.chunk_interval_ms = chunk_interval_ms
+        self.first_byte_ms = first_byte_ms
+        self.tool_script = list(tool_script or ([(tool_name, tool_args or {})] if tool_name else []))
+        self.tool_call_every = tool_call_every
+        self.session_number = next(self._ids)
+        self.tool_calls = 0
+        self._ws = MockWebSocket(ping_ms)
+        self._turns: asyncio.Queue = asyncio.Queue()
+        self._tool_responses: asyncio.Queue = asyncio.Queue()
+        self.turns = 0
+        self.realtime_bytes = 0
+        self.tool_responses: List[Any] = []
+
+    async def send_client_content(self, turns=None, turn_complete: bool = True):
+        # Без turn_complete (прерывание клиентом) модель новый ответ не начинает
+        if turn_complete:
+            await self._turns.put(turns)
+
+    async def send_realtime_input(self, audio=None, audio_stream_end: bool = None, **kwargs):
+        if audio is not None:
+            self.realtime_bytes += len(audio.data)
+        if audio_stream_end:
+            await self._turns.put("audio")
+
+    async def send_tool_response(self, function_responses=None):
+        self.tool_responses.append(function_responses)
+        await self._tool_responses.put(function_responses)
+
+    async def receive(self):
+        await self._turns.get()
+        self.turns += 1
+        if self.tool_script and self.tool_call_every and self.turns % self.tool_call_every == 0:
+            yield _message(tool_call=pytypes.SimpleNamespace(function_calls=[self._next_call()]))
+            await self._tool_responses.get()
+        await asyncio.sleep(self.first_byte_ms / 1000)
+        for _ in range(self.audio_chunks):
+            yield _message(data=b"\x00" * self.chunk_bytes)
+            await asyncio.sleep(self.chunk_interval_ms / 1000)
+        yield _message(turn_complete=True)
+
+    def _next_call(self):
+        name, args = self.tool_script[self.tool_calls % len(self.tool_script)]
+        self.tool_calls += 1
+        args = {
+            key: value.format(turn=self.turns, session=self.session_number) if isinstance(value, str) else value
+            for key, value in args.items()
+        }
+        return pytypes.SimpleNamespace(id=f"call-{self.session_number}-{self.turns}", name=name, args=args)
+
+    async def close(self):
+        await self._ws.close()
+
+
+class MockLive:
+    def __init__(self, handshake_ms: float, jitter_ms: float, session_options: dict, rng: random.Random):
+        self.handshake_ms = handshake_ms
+        self.jitter_ms = jitter_ms
+        self.session_options = session_options
+        self.rng = rng
+        self.connects = 0
+        self.open_sessions = 0
+
+    @asynccontextmanager
+    async def connect(self, *, model: str, config: Any = None):
+        delay = self.handshake_ms + self.rng.uniform(0, self.jitter_ms)
+        await asyncio.sleep(delay / 1000)
+        self.connects += 1
+        self.open_sessions += 1
+        session = MockLiveSession(**self.session_options)
+        try:
+            yield session
+        finally:
+            self.open_sessions -= 1
+            await session.close()
+
+
+class MockLiveClient:
+    """Замена genai.Client: используется только client.aio.live.connect"""
+
+    def __init__(self, handshake_ms: float = 400, jitter_ms: float = 100, seed: int = 42, **session_options):
+        self.aio = pytypes.SimpleNamespace(
+            live=MockLive(handshake_ms, jitter_ms, session_options, random.Random(seed))
+        )
+
+    @property
+    def live(self) -> MockLive:
+        return self.aio.live
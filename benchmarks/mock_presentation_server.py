@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Локальная замена сервера генерации презентаций (по умолчанию на порту 3000)
+
+Повторяет API, которым пользуется functions/generate_presentation.py:
+create-session, generate-content, refine-content, approve-content, generate-code,
+refine-code, get-result. Содержание и HTML отдаются потоком: каждый слайд
+«генерируется» --slide-ms миллисекунд и приходит несколькими чанками, как от LLM.
+
+Пример:
+    python benchmarks/mock_presentation_server.py --slides 8 --slide-ms 800
+    PRESENTATION_SERVER_URL=http://localhost:3000 uvicorn server:app
+"""
+import argparse
+import asyncio
+import uuid
+
+from aiohttp import web
+
+# Сколько чанков приходится на один слайд
+CHUNKS_PER_SLIDE = 4
+
+
+def slide_markdown(topic: str, index: int) -> str:
+    return (f"## Слайд {index + 1}: {topic} — часть {index + 1}\n"
+            f"- Первый тезис о «{topic}»\n"
+            f"- Второй тезис с пояснением для аудитории\n"
+            f"- Вывод слайда {index + 1}\n\n")
+
+
+def slide_html(topic: str, index: int) -> str:
+    return (f"<section class=\"slide\">\n"
+            f"  <h2>Слайд {index + 1}: {topic}</h2>\n"
+            f"  <ul><li>Первый тезис</li><li>Второй тезис</li><li>Вывод</li></ul>\n"
+            f"</section>\n")
+
+
+def split(text: str, parts: int) -> list:
+    size = max(1, -(-len(text) // parts))
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class PresentationState:
+    def __init__(self, topic: str, audience: str, style: str, ultra_mode: bool):
+        self.topic = topic
+        self.audience = audience
+        self.style = style
+        self.ultra_mode = ultra_mode
+        self.content = ""
+        self.approved = False
+        self.code = ""
+
+
+def create_app(slides: int, slide_ms: float) -> web.Application:
+    sessions = {}
+
+    def state_of(request: web.Request) -> PresentationState:
+        state = sessions.get(request.match_info["session_id"])
+        if state is None:
+            raise web.HTTPNotFound(text="session not found")
+        return state
+
+    async def stream(request: web.Request, pieces: list):
+        response = web.StreamResponse(headers={"Content-Type": "text/plain; charset=utf-8"})
+        await response.prepare(request)
+        collected = []
+        for piece in pieces:
+            for chunk in split(piece, CHUNKS_PER_SLIDE):
+                await asyncio.sleep(slide_ms / 1000 / CHUNKS_PER_SLIDE)
+                collected.append(chunk)
+                await response.write(chunk.encode("utf-8"))
+        await response.write_eof()
+        return response, "".join(collected)
+
+    def deck_size(state: PresentationState) -> int:
+        return slides * 2 if state.ultra_mode else slides
+
+    async def create_session(request: web.Request):
+        data = await request.json()
+        if not data.get("topic") or not data.get("audience"):
+            raise web.HTTPBadRequest(text="topic and audience are required")
+        session_id = uuid.uuid4().hex
+        sessions[session_id] = PresentationState(
+            data["topic"], data["audience"], data.get("style", "modern"), bool(data.get("ultraMode")))
+        return web.json_response({"sessionId": session_id})
+
+    async def generate_content(request: web.Request):
+        state = state_of(request)
+        pieces = [f"# {state.topic}\n\n"] + [slide_markdown(state.topic, i) for i in range(deck_size(state))]
+        response, state.content = await stream(request, pieces)
+        return response
+
+    async def refine_content(request: web.Request):
+        state = state_of(request)
+        feedback = (await request.json()).get("feedback", "")
+        pieces = [f"# {state.topic}\n\n> Учтено: {feedback}\n\n"]
+        pieces += [slide_markdown(state.topic, i) for i in range(deck_size(state))]
+        response, state.content = await stream(request, pieces)
+        return response
+
+    async def approve_content(request: web.Request):
+        state = state_of(request)
+        if not state.content:
+            raise web.HTTPBadRequest(text="content is not generated yet")
+        state.approved = True
+        return web.json_response({"ok": True})
+
+    async def generate_code(request: web.Request):
+        state = state_of(request)
+        if not state.approved:
+            raise web.HTTPBadRequest(text="content is not approved")
+        pieces = [f"<!DOCTYPE html>\n<html><head><title>{state.topic}</title></head><body class=\"{state.style}\">\n"]
+        pieces += [slide_html(state.topic, i) for i in range(deck_size(state))]
+        pieces += ["</body></html>\n"]
+        response, state.code = await stream(request, pieces)
+        return response
+
+    async def refine_code(request: web.Request):
+        return await generate_code(request)
+
+    async def get_result(request: web.Request):
+        state = state_of(request)
+        return web.json_response({"content": state.content, "code": state.code})
+
+    app = web.Application()
+    app.router.add_post("/api/create-session", create_session)
+    app.router.add_post("/api/generate-content/{session_id}", generate_content)
+    app.router.add_post("/api/refine-content/{session_id}", refine_content)
+    app.router.add_post("/api/approve-content/{session_id}", approve_content)
+    app.router.add_post("/api/generate-code/{session_id}", generate_code)
+    app.router.add_post("/api/refine-code/{session_id}", refine_code)
+    app.router.add_get("/api/get-result/{session_id}", get_result)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=3000)
+    parser.add_argument("--slides", type=int, default=8)
+    parser.add_argument("--slide-ms", type=float, default=800, help="время генерации одного слайда")
+    args = parser.parse_args()
+    web.run_app(create_app(args.slides, args.slide_ms), port=args.port)
+
+
+if __name__ == "__main__":
+    main()
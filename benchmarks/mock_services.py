@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Локальные заменители внешних HTTP-сервисов функций агентов для бенчмарков
+
+    /html/?q=...          — выдача DuckDuckGo (разметка, которую разбирает web_search)
+    /page/{n}             — страницы результатов со статьёй размером --page-kb
+    /api/v1/llm-api       — Wolfram|Alpha LLM API (текстовый ответ)
+
+Функции направляются сюда переменными окружения:
+    WEB_SEARCH_DDG_URL=http://127.0.0.1:8900/html/
+    WOLFRAM_API_URL=http://127.0.0.1:8900/api/v1/llm-api
+
+Пример:
+    python benchmarks/mock_services.py --port 8900 --search-ms 150 --page-ms 80
+"""
+import argparse
+import asyncio
+import html
+import random
+
+from aiohttp import web
+
+# Сколько результатов отдаёт выдача
+SEARCH_RESULTS = 6
+
+WORDS = ("поиск", "сервер", "модель", "ответ", "данные", "история", "наука", "город", "погода", "задача",
+         "голос", "система", "функция", "запрос", "страница", "статья", "время", "пример", "вопрос", "факт")
+
+
+def paragraph(rng: random.Random, words: int = 60) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def search_page(base_url: str, query: str) -> str:
+    results = []
+    for n in range(SEARCH_RESULTS):
+        link = f"{base_url}/page/{n}?q={html.escape(query)}"
+        results.append(
+            f'<div class="result results_links web-result">'
+            f'<h2 class="result__title"><a class="result__a" href="{link}">{html.escape(query)} — результат {n + 1}</a></h2>'
+            f'<a class="result__url" href="{link}">{link}</a>'
+            f'<a class="result__snippet">Краткое описание результата {n + 1} по запросу {html.escape(query)}</a>'
+            f'</div>'
+        )
+    return f"<html><body><div id=\"links\">{''.join(results)}</div></body></html>"
+
+
+def article_page(title: str, size_kb: int, seed: int) -> str:
+    rng = random.Random(seed)
+    paragraphs = []
+    size = 0
+    while size < size_kb * 1024:
+        text = paragraph(rng)
+        paragraphs.append(f"<p>{text}</p>")
+        size += len(text.encode("utf-8"))
+    return (f"<html><head><title>{html.escape(title)}</title></head><body>"
+            f"<nav><a href=\"/\">Главная</a> <a href=\"/about\">О сайте</a></nav>"
+            f"<article><h1>{html.escape(title)}</h1>{''.join(paragraphs)}</article>"
+            f"<footer>© mock</footer></body></html>")
+
+
+def create_app(search_ms: float = 150, page_ms: float = 80, wolfram_ms: float = 300,
+               page_kb: int = 40, jitter: float = 0.3, seed: int = 42) -> web.Application:
+    rng = random.Random(seed)
+    stats = {"search": 0, "page": 0, "wolfram": 0}
+
+    async def delay(ms: float):
+        await asyncio.sleep(ms * (1 + rng.uniform(-jitter, jitter)) / 1000)
+
+    async def search(request: web.Request):
+        stats["search"] += 1
+        await delay(search_ms)
+        base_url = f"{request.scheme}://{request.host}"
+        return web.Response(text=search_page(base_url, request.query.get("q", "")), content_type="text/html")
+
+    async def page(request: web.Request):
+        stats["page"] += 1
+        await delay(page_ms)
+        n = int(request.match_info["n"])
+        title = f"{request.query.get('q', '')} — страница {n + 1}"
+        return web.Response(text=article_page(title, page_kb, n), content_type="text/html")
+
+    async def wolfram(request: web.Request):
+        stats["wolfram"] += 1
+        await delay(wolfram_ms)
+        query = request.query.get("input", "")
+        return web.Response(text=f'Query:\n"{query}"\n\nResult:\n42\n\nWolfram|Alpha website result for "{query}":\n'
+                                 f"https://www.wolframalpha.com/input?i=42")
+
+    async def get_stats(request: web.Request):
+        return web.json_response(stats)
+
+    app = web.Application()
+    app["stats"] = stats
+    app.router.add_get("/html/", search)
+    app.router.add_get("/page/{n}", page)
+    app.router.add_get("/api/v1/llm-api", wolfram)
+    app.router.add_get("/stats", get_stats)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--search-ms", type=float, default=150)
+    parser.add_argument("--page-ms", type=float, default=80)
+    parser.add_argument("--wolfram-ms", type=float, default=300)
+    parser.add_argument("--page-kb", type=int, default=40)
+    args = parser.parse_args()
+    web.run_app(create_app(args.search_ms, args.page_ms, args.wolfram_ms, args.page_kb), port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,279 @@
+import asyncio
+import inspect
 import json
-from typing import Dict, Callable, List, Any
+import logging
+import os
+import time
+import uuid
+from collections import deque
+from typing import Deque, Dict, Callable, List, Any, Optional
 from fastapi import WebSocket
+from session_bus import SessionBus, create_bus, request_key, session_key
+from single_flight import current_flight
+
+logger = logging.getLogger("connection_manager")
+
+# Сколько инструкций может ждать отправки одному клиенту
+OUTBOUND_QUEUE_SIZE = int(os.getenv("OUTBOUND_QUEUE_SIZE", "64"))
+# Сколько инструкций упаковывать в один кадр {"type": "BATCH", ...} (1 — без пакетов)
+OUTBOUND_BATCH_MAX = int(os.getenv("OUTBOUND_BATCH_MAX", "1"))
+# Что делать с медленным клиентом при переполнении очереди: "drop" — отбросить
+# самую старую инструкцию, "disconnect" — закрыть соединение
+OUTBOUND_SLOW_POLICY = os.getenv("OUTBOUND_SLOW_POLICY", "drop")
+# Сколько секунд ждать отправки одного кадра, прежде чем считать клиента зависшим
+OUTBOUND_SEND_TIMEOUT = float(os.getenv("OUTBOUND_SEND_TIMEOUT", "10"))
+# Код закрытия WebSocket для зависших клиентов (1013 — Try Again Later)
+SLOW_CONSUMER_CLOSE_CODE = 1013
+# Сколько секунд по умолчанию ждать function_response на инструкцию с ожиданием ответа
+CLIENT_RPC_TIMEOUT = float(os.getenv("CLIENT_RPC_TIMEOUT", "30"))
+
+
+class ClientDisconnected(ConnectionError):
+    """Клиент отключился, не ответив на инструкцию"""
+
+
+class PendingRequest:
+    """Инструкция, ответ на которую (function_response с тем же requestId) ещё не пришёл"""
+
+    def __init__(self, request_id: str, session_id: str, future: asyncio.Future, timer: asyncio.TimerHandle):
+        self.request_id = request_id
+        self.session_id = session_id
+        self.future = future
+        self.timer = timer
+        # Клиент подключён к другому процессу: ответ придёт через шину
+        self.remote = False
+
+
+class OutboundChannel:
+    """
+    Очередь инструкций для одного клиента и задача, которая их отправляет
+
+    send_instruction только кладёт инструкцию в очередь и не ждёт сети, поэтому
+    медленный клиент не блокирует функции агентов. Несколько SET для одной функции,
+    ещё не ушедших клиенту, схлопываются в последний. При переполнении очереди
+    или зависшей отправке срабатывает политика policy: drop — отбросить самую старую
+    инструкцию (или зависший кадр) и продолжить, disconnect — закрыть соединение.
+    """
+
+    def __init__(
+        self,
+        session: "Session",
+        max_size: int = OUTBOUND_QUEUE_SIZE,
+        batch_max: int = OUTBOUND_BATCH_MAX,
+        policy: str = OUTBOUND_SLOW_POLICY,
+        send_timeout: float = OUTBOUND_SEND_TIMEOUT,
+    ):
+        self.session = session
+        self.max_size = max_size
+        self.batch_max = max(1, batch_max)
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self._items: Deque[Dict[str, Any]] = deque()
+        # function -> ещё не отправленный SET этой функции (для схлопывания)
+        self._pending_set: Dict[str, Dict[str, Any]] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.closed = False
+        self.max_depth = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name=f"{self.session.session_id}:outbound")
+
+    def put(self, payload: Dict[str, Any]) -> bool:
+        """Ставит инструкцию в очередь; False, если она не будет доставлена"""
+        if self.closed:
+            return False
+        function = payload.get("function")
+        # Инструкции с requestId ждут ответа клиента, их схлопывать нельзя
+        coalescable = payload.get("type") == "SET" and "requestId" not in payload
+        if coalescable:
+            queued = self._pending_set.get(function)
+            if queued is not None:
+                # Клиенту важно только последнее состояние: обновляем инструкцию на её месте в очереди
+                queued.clear()
+                queued.update(payload)
+                self.session.incr("instructions_coalesced")
+                return True
+
+        if len(self._items) >= self.max_size:
+            if self.policy == "disconnect":
+                self._slow_consumer("очередь переполнена")
+                return False
+            dropped = self._items.popleft()
+            self._forget(dropped)
+            self.session.incr("instructions_dropped")
+            if "requestId" in dropped:
+                manager.fail_request(dropped["requestId"], ConnectionError("Инструкция отброшена: клиент не успевает"))
+
+        self._items.append(payload)
+        if coalescable:
+            self._pending_set[function] = payload
+        self.max_depth = max(self.max_depth, len(self._items))
+        self._wakeup.set()
+        return True
+
+    def _forget(self, payload: Dict[str, Any]):
+        if self._pending_set.get(payload.get("function")) is payload:
+            del self._pending_set[payload.get("function")]
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._items:
+                batch = []
+                while self._items and len(batch) < self.batch_max:
+                    payload = self._items.popleft()
+                    self._forget(payload)
+                    batch.append(payload)
+                if len(batch) == 1:
+                    frame = json.dumps(batch[0])
+                else:
+                    frame = json.dumps({"type": "BATCH", "instructions": batch})
+                try:
+                    await asyncio.wait_for(self.session.websocket.send_text(frame), self.send_timeout)
+                except asyncio.TimeoutError:
+                    if self.policy == "disconnect":
+                        self._slow_consumer(f"отправка дольше {self.send_timeout:g} с")
+                        return
+                    logger.warning(f"[{self.session.session_id}] отправка дольше {self.send_timeout:g} с, "
+                                   f"инструкций отброшено: {len(batch)}")
+                    self.session.incr("instructions_dropped", len(batch))
+                    for payload in batch:
+                        if "requestId" in payload:
+                            manager.fail_request(payload["requestId"], ConnectionError("Инструкция отброшена: клиент не успевает"))
+                    continue
+                except Exception as e:
+                    logger.warning(f"[{self.session.session_id}] не удалось отправить инструкции: {str(e)}")
+                    self.close()
+                    return
+                self.session.incr("instructions_sent", len(batch))
+                self.session.incr("outbound_frames")
+
+    def _slow_consumer(self, reason: str):
+        logger.warning(f"[{self.session.session_id}] медленный клиент ({reason}), закрываем соединение")
+        self.session.incr("slow_consumer_disconnects")
+        self.close()
+        asyncio.create_task(self._close_websocket())
+
+    async def _close_websocket(self):
+        try:
+            await asyncio.wait_for(
+                self.session.websocket.close(code=SLOW_CONSUMER_CLOSE_CODE), self.send_timeout
+            )
+        except Exception:
+            pass
+
+    def depth(self) -> int:
+        return len(self._items)
+
+    def close(self):
+        """Останавливает отправку; неотправленные инструкции отбрасываются"""
+        self.closed = True
+        self._items.clear()
+        self._pending_set.clear()
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"queued": len(self._items), "max_queued": self.max_depth, "capacity": self.max_size}
+
+
+class Session:
+    """Состояние одного клиентского подключения"""
+
+    def __init__(self, session_id: str, websocket: WebSocket):
+        self.session_id = session_id
+        self.websocket = websocket
+        self.created_at = time.time()
+        self.last_activity = self.created_at
+        self.counters: Dict[str, int] = {
+            "messages_received": 0,
+            "turns": 0,
+            "audio_chunks_sent": 0,
+            "audio_bytes_sent": 0,
+            "function_calls": 0,
+            "instructions_sent": 0,
+            "instructions_coalesced": 0,
+            "instructions_dropped": 0,
+            "outbound_frames": 0,
+        }
+        self.outbox = OutboundChannel(self)
+        # requestId инструкций этой сессии, ожидающих ответа клиента
+        self.pending_requests = set()
+
+    def incr(self, counter: str, value: int = 1):
+        self.counters[counter] = self.counters.get(counter, 0) + value
+        self.last_activity = time.time()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "created_at": self.created_at,
+            "last_activity": self.last_activity,
+            "uptime": time.time() - self.created_at,
+            "counters": dict(self.counters),
+            "outbound": self.outbox.stats(),
+            "pending_requests": len(self.pending_requests),
+        }
+
 
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
+        self.sessions: Dict[str, Session] = {}
         self.event_subscribers: Dict[str, List[Callable[[Any, str], None]]] = {}
+        # requestId -> ожидающая ответа инструкция
+        self._pending: Dict[str, PendingRequest] = {}
+        # Шина между процессами: инструкции для сессий, чей WebSocket открыт в другом воркере
+        self.bus: SessionBus = create_bus()
+
+    async def start(self):
+        await self.bus.start(self._deliver)
+
+    async def close(self):
+        await self.bus.close()
+
+    @property
+    def active_connections(self) -> Dict[str, WebSocket]:
+        return {session_id: s.websocket for session_id, s in self.sessions.items()}
 
-    async def connect(self, session_id: str, websocket: WebSocket):
+    @staticmethod
+    def new_session_id() -> str:
+        return uuid.uuid4().hex
+
+    async def connect(self, session_id: str, websocket: WebSocket) -> Session:
         await websocket.accept()
-        self.active_connections[session_id] = websocket
+        session = Session(session_id, websocket)
+        session.outbox.start()
+        self.sessions[session_id] = session
+        self.bus.register(session_key(session_id))
+        return session
 
     def disconnect(self, session_id: str):
-        self.active_connections.pop(session_id, None)
+        session = self.sessions.pop(session_id, None)
+        if session:
+            self.bus.unregister(session_key(session_id))
+            session.outbox.close()
+            for request_id in list(session.pending_requests):
+                self.fail_request(request_id, ClientDisconnected(f"Клиент {session_id} отключился"))
+
+    def get_session(self, session_id: str) -> Optional[Session]:
+        return self.sessions.get(session_id)
+
+    def incr(self, session_id: str, counter: str, value: int = 1):
+        session = self.sessions.get(session_id)
+        if session:
+            session.incr(counter, value)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active_sessions": len(self.sessions),
+            "outbound_queued": sum(s.outbox.depth() for s in self.sessions.values()),
+            "pending_requests": len(self._pending),
+            "bus": self.bus.stats(),
+            "sessions": [s.to_dict() for s in self.sessions.values()],
+        }
 
     async def send_instruction(
         self,
@@ -20,33 +281,163 @@ class ConnectionManager:
         instruction_type: str,
         function_name: str,
         args: dict = None,
-        request_id: str = None
-    ):
+        request_id: str = None,
+        expect_response: bool = False,
+        timeout: float = CLIENT_RPC_TIMEOUT,
+    ) -> Optional[asyncio.Future]:
+        """
+        Ставит инструкцию в очередь отправки клиенту
+
+        С expect_response=True инструкция получает requestId (если он не задан), а метод
+        возвращает future, который разрешится function_response клиента с тем же
+        requestId. Если ответа нет за timeout секунд, future завершится TimeoutError,
+        если клиент отключится — ClientDisconnected.
+        """
         payload = {
             "type": instruction_type,
             "function": function_name,
             "args": args or {},
         }
+        if expect_response and not request_id:
+            request_id = uuid.uuid4().hex
         if request_id:
             payload["requestId"] = request_id
 
-        ws = self.active_connections.get(session_id)
-        if ws:
-            await ws.send_text(json.dumps(payload))
+        flight = current_flight.get()
+        if flight is not None and session_id == flight.origin and not expect_response:
+            # Одно выполнение функции обслуживает вызовы нескольких сессий (single-flight):
+            # каждая получает свою копию — очередь клиента изменяет инструкции при схлопывании
+            flight.remember(payload)
+            for target in list(flight.sessions):
+                self._enqueue(target, dict(payload))
+            return None
+
+        future = self._register_request(session_id, request_id, timeout) if expect_response else None
+        delivered = self._enqueue(session_id, payload)
+        if future is not None:
+            if delivered == "remote":
+                self._pending[request_id].remote = True
+                self.bus.register(request_key(request_id))
+            elif not delivered and session_id in self.sessions:
+                self.fail_request(request_id, ClientDisconnected(f"Клиент {session_id} не принимает инструкции"))
+            elif not delivered:
+                self.fail_request(request_id, ClientDisconnected(f"Сессия {session_id} не найдена"))
+        return future
+
+    def _enqueue(self, session_id: str, payload: Dict[str, Any]):
+        """Ставит инструкцию в очередь клиента: True / "remote" (другой воркер) / False, если доставить некуда"""
+        # Инструкция только ставится в очередь клиента, отправляет её задача OutboundChannel
+        session = self.sessions.get(session_id)
+        if session:
+            return session.outbox.put(payload)
+        if self.bus.publish(session_key(session_id), {"payload": payload}):
+            # WebSocket клиента открыт в другом воркере — брокер доставит инструкцию туда
+            return "remote"
+        return False
+
+    async def request(
+        self,
+        session_id: str,
+        instruction_type: str,
+        function_name: str,
+        args: dict = None,
+        timeout: float = CLIENT_RPC_TIMEOUT,
+    ) -> Dict[str, Any]:
+        """Отправляет инструкцию и ждёт function_response клиента (весь JSON ответа)"""
+        future = await self.send_instruction(
+            session_id, instruction_type, function_name, args, expect_response=True, timeout=timeout
+        )
+        return await future
+
+    def _register_request(self, session_id: str, request_id: str, timeout: float) -> asyncio.Future:
+        if request_id in self._pending:
+            raise ValueError(f"requestId {request_id} уже ожидает ответа")
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        timer = loop.call_later(
+            timeout, self.fail_request, request_id,
+            asyncio.TimeoutError(f"Клиент не ответил на {request_id} за {timeout:g} с"),
+        )
+        self._pending[request_id] = PendingRequest(request_id, session_id, future, timer)
+        session = self.sessions.get(session_id)
+        if session:
+            session.pending_requests.add(request_id)
+        return future
+
+    def _pop_request(self, request_id: str) -> Optional[PendingRequest]:
+        pending = self._pending.pop(request_id, None)
+        if pending is None:
+            return None
+        pending.timer.cancel()
+        if pending.remote:
+            self.bus.unregister(request_key(request_id))
+        session = self.sessions.get(pending.session_id)
+        if session:
+            session.pending_requests.discard(request_id)
+        return pending
+
+    def fail_request(self, request_id: str, error: BaseException):
+        pending = self._pop_request(request_id)
+        if pending is not None and not pending.future.done():
+            pending.future.set_exception(error)
+            # Исключение не должно попадать в лог "never retrieved", если future никто не ждёт
+            pending.future.exception()
+
+    def resolve_request(self, request_id: str, session_id: str, data: Any) -> bool:
+        """Разрешает ожидающую инструкцию ответом клиента; False, если такой нет"""
+        pending = self._pending.get(request_id)
+        # Ответ принимается только от той же сессии, которой была отправлена инструкция
+        if pending is None or pending.session_id != session_id:
+            return False
+        self._pop_request(request_id)
+        if not pending.future.done():
+            pending.future.set_result(data)
+        return True
 
     def subscribe_to_event(self, event_name: str, callback: Callable[[Any, str], None]):
         if event_name not in self.event_subscribers:
             self.event_subscribers[event_name] = []
         self.event_subscribers[event_name].append(callback)
 
+    def unsubscribe_from_event(self, event_name: str, callback: Callable[[Any, str], None]):
+        callbacks = self.event_subscribers.get(event_name)
+        if callbacks and callback in callbacks:
+            callbacks.remove(callback)
+            if not callbacks:
+                del self.event_subscribers[event_name]
+
     async def trigger_event(self, event_name: str, data: Any, session_id: str):
-        for callback in self.event_subscribers.get(event_name, []):
+        for callback in list(self.event_subscribers.get(event_name, [])):
             result = callback(data, session_id)
-            if callable(result):
+            if inspect.isawaitable(result):
                 await result  # in case it's async
 
     async def handle_function_response(self, data: Any, session_id: str):
+        request_id = data.get("requestId") if isinstance(data, dict) else None
+        if request_id is not None:
+            if self.resolve_request(str(request_id), session_id, data):
+                self.incr(session_id, "client_responses")
+            elif str(request_id) not in self._pending:
+                # Инструкцию могли отправить из другого воркера — ответ уходит туда
+                self.bus.publish(request_key(str(request_id)), {"session_id": session_id, "data": data})
         await self.trigger_event("function_response", data, session_id)
 
+    async def _deliver(self, key: str, message: Dict[str, Any]):
+        """Сообщение из шины для ключа, которым владеет этот процесс"""
+        kind, _, ident = key.partition(":")
+        if message.get("undeliverable"):
+            # Брокер не нашёл владельца: запрос к этой сессии не дождётся ответа
+            payload = (message.get("message") or {}).get("payload") or {}
+            request_id = payload.get("requestId")
+            if kind == "session" and request_id in self._pending:
+                self.fail_request(request_id, ClientDisconnected(f"Сессия {ident} не найдена"))
+            return
+        if kind == "session":
+            session = self.sessions.get(ident)
+            if session:
+                session.outbox.put(message["payload"])
+        elif kind == "request":
+            self.resolve_request(ident, message.get("session_id"), message.get("data"))
+
 # глобальный экземпляр
 manager = ConnectionManager()
@@ -0,0 +1,105 @@
+import os
+import re
+from typing import Any, Dict, List, Optional
+from executor_pool import executor_pool
+from knowledge_index import knowledge_index
+from result_cache import MISSING, normalize_query, result_cache
+
+# Подмешивать документы о пользователе в system_instruction при подключении
+PRELOAD_ENABLED = os.getenv("CONTEXT_PRELOAD", "0") == "1"
+# Бюджет контекста в токенах и сколько документов рассматривать
+PRELOAD_TOKEN_BUDGET = int(os.getenv("CONTEXT_PRELOAD_TOKENS", "1500"))
+PRELOAD_DOCS = int(os.getenv("CONTEXT_PRELOAD_DOCS", "3"))
+# Запрос по умолчанию, если клиент не прислал user/context_query
+PRELOAD_QUERY = os.getenv("CONTEXT_PRELOAD_QUERY", "пользователь")
+# Кэш живёт долго: ключ всё равно меняется вместе с версией документов
+PRELOAD_CACHE_TTL = float(os.getenv("CONTEXT_PRELOAD_CACHE_TTL", str(24 * 3600)))
+
+# Грубая оценка для смешанного русско-английского текста
+CHARS_PER_TOKEN = 3
+# Обрезанный документ меньше этого размера не добавляем
+MIN_PART_TOKENS = 64
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+|\n+")
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    """Обрезает текст по границе предложения, чтобы уложиться в max_tokens"""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    boundaries = [m.start() for m in _SENTENCE_END.finditer(cut)]
+    if boundaries and boundaries[-1] > max_chars // 2:
+        cut = cut[:boundaries[-1]]
+    return cut.rstrip() + " …"
+
+
+def pack_documents(documents: List[Dict[str, Any]], budget: int) -> str:
+    """
+    Упаковывает документы (в порядке релевантности) в бюджет токенов
+
+    Документы добавляются целиком, пока помещаются; следующий обрезается по предложениям,
+    если на него осталось хотя бы MIN_PART_TOKENS.
+    """
+    parts = []
+    remaining = budget
+    for doc in documents:
+        header = f"## {doc['title']}\n"
+        available = remaining - estimate_tokens(header)
+        if available < MIN_PART_TOKENS:
+            break
+        content = doc["content"]
+        if estimate_tokens(content) > available:
+            content = _truncate(content, available)
+        part = header + content
+        parts.append(part)
+        remaining -= estimate_tokens(part)
+    return "\n\n".join(parts)
+
+
+def _retrieve(query: str, limit: int) -> List[Dict[str, Any]]:
+    documents = []
+    for hit in knowledge_index.search(query, limit):
+        doc = knowledge_index.get(hit["id"])
+        if doc:
+            documents.append(doc)
+    return documents
+
+
+async def build_context(user: Optional[str] = None, query: Optional[str] = None,
+                        budget: int = PRELOAD_TOKEN_BUDGET) -> str:
+    """
+    Собирает контекст о пользователе из локальной базы документов
+
+    Результат кэшируется по пользователю, запросу, бюджету и версии документов,
+    поэтому повторное подключение не делает поиск заново.
+    """
+    query = query or (f"{user} {PRELOAD_QUERY}" if user else PRELOAD_QUERY)
+    # Сначала синхронизируем индекс: иначе попадание в кэш не заметит правку documents.json
+    version = await executor_pool.run_io(knowledge_index.refresh)
+    key = f"{version}:{budget}:{normalize_query(user or '')}:{normalize_query(query)}"
+    context = result_cache.get("context_preload", key)
+    if context is not MISSING:
+        return context
+
+    documents = await executor_pool.run_io(_retrieve, query, PRELOAD_DOCS)
+    context = pack_documents(documents, budget)
+    # Поиск мог переиндексировать базу — сохраняем под актуальной версией
+    key = f"{knowledge_index.version}:{budget}:{normalize_query(user or '')}:{normalize_query(query)}"
+    result_cache.set("context_preload", key, context, PRELOAD_CACHE_TTL)
+    return context
+
+
+def compose_system_prompt(system_prompt: str, context: str) -> str:
+    if not context:
+        return system_prompt
+    return (
+        f"{system_prompt}\n\n"
+        "# Что известно о пользователе (из локальной базы знаний)\n"
+        f"{context}"
+    )
@@ -2,12 +2,17 @@ import importlib.util
 import json
 import os
 import sys
-from typing import Any, Dict, Optional, Union
+from typing import Any, Dict, List, Optional, Union
 import inspect
+import time
 import traceback
 import logging
 from google.genai import types
 from connection_manager import manager
+from executor_pool import executor_pool
+from output_budget import OUTPUT_BUDGET, OUTPUT_FORMAT, fit
+from result_cache import MISSING, make_key, result_cache
+from single_flight import SINGLE_FLIGHT, Flight, single_flight
 
 # Настройка логирования
 logging.basicConfig(
@@ -16,6 +21,10 @@ logging.basicConfig(
 )
 logger = logging.getLogger("function_handler")
 
+FUNCTIONS_DIR = os.path.join(os.path.dirname(__file__), "functions")
+# Как часто (в секундах) проверять mtime файла функции для горячей перезагрузки; < 0 — никогда
+RELOAD_CHECK_INTERVAL = float(os.getenv("FUNCTIONS_RELOAD_INTERVAL", "1.0"))
+
 
 class FunctionResult:
     """Класс для представления результата выполнения функции"""
@@ -34,6 +43,139 @@ class FunctionResult:
         return result
 
 
+class FunctionEntry:
+    """Загруженный модуль функции вместе с закэшированным callable"""
+
+    def __init__(self, name: str, path: str, module: Any, mtime: float):
+        self.name = name
+        self.path = path
+        self.module = module
+        self.mtime = mtime
+        self.checked_at = time.monotonic()
+        self.function = getattr(module, name, None)
+        self.is_async = inspect.iscoroutinefunction(self.function)
+        # Метаданные модуля: EXECUTOR = "io" | "cpu" для синхронных функций, MAX_CONCURRENCY = N
+        self.executor = getattr(module, "EXECUTOR", "io")
+        self.max_concurrency = getattr(module, "MAX_CONCURRENCY", None)
+        # CACHE_RESULT_TTL = N: диспетчер кэширует весь результат функции по её аргументам.
+        # Только для функций без побочных эффектов на клиенте — при попадании в кэш функция не вызывается.
+        self.cache_result_ttl = getattr(module, "CACHE_RESULT_TTL", None)
+        # OUTPUT_BUDGET = N символов и OUTPUT_FORMAT = "text" | "json": как результат отдаётся модели
+        self.output_budget = getattr(module, "OUTPUT_BUDGET", OUTPUT_BUDGET)
+        self.output_format = getattr(module, "OUTPUT_FORMAT", OUTPUT_FORMAT)
+        # SINGLE_FLIGHT = True: одновременные одинаковые вызовы из разных сессий выполняются один раз.
+        # Только для функций, чей результат и инструкции клиенту не зависят от сессии
+        self.single_flight = SINGLE_FLIGHT and getattr(module, "SINGLE_FLIGHT", False)
+        # DECLARATION: описание и параметры функции для Gemini, name подставляется из имени модуля
+        self.declaration = self._build_declaration(getattr(module, "DECLARATION", None))
+
+    def _build_declaration(self, raw: Optional[Dict[str, Any]]) -> Optional[types.FunctionDeclaration]:
+        if raw is None or not callable(self.function):
+            return None
+        if raw.get("name", self.name) != self.name:
+            raise ImportError(f"Имя в DECLARATION ('{raw['name']}') не совпадает с именем модуля '{self.name}'")
+        return types.FunctionDeclaration(**{**raw, "name": self.name})
+
+
+class FunctionRegistry:
+    """
+    Реестр функций из директории functions/
+
+    Модули импортируются один раз (при scan() или первом вызове), дальше вызов функции —
+    это поиск в словаре. Модуль перезагружается, только если изменился mtime его файла.
+    """
+
+    def __init__(self, functions_dir: str = FUNCTIONS_DIR, check_interval: float = RELOAD_CHECK_INTERVAL):
+        self.functions_dir = functions_dir
+        self.check_interval = check_interval
+        self._entries: Dict[str, FunctionEntry] = {}
+        # Увеличивается при каждой (пере)загрузке модуля — ключ для кэшей деклараций
+        self.version = 0
+        self._tool: Optional[types.Tool] = None
+        self._tool_version = -1
+
+    def path_for(self, name: str) -> str:
+        return os.path.join(self.functions_dir, f"{name}.py")
+
+    def scan(self):
+        """Импортирует все модули из functions/ (ошибки отдельных модулей только логируются)"""
+        for file_name in sorted(os.listdir(self.functions_dir)):
+            name, ext = os.path.splitext(file_name)
+            if ext != ".py" or name.startswith("_") or not is_valid_function_name(name):
+                continue
+            try:
+                entry = self._load(name)
+            except Exception as e:
+                logger.error(f"Не удалось загрузить модуль функции {name}: {str(e)}")
+                continue
+            if not callable(entry.function):
+                logger.warning(f"В модуле '{name}' нет функции с тем же именем, пропускаем")
+        logger.info(f"Зарегистрировано функций: {len(self.names())}, деклараций: {len(self.tool().function_declarations)}")
+
+    def names(self) -> list:
+        return [name for name, entry in self._entries.items() if callable(entry.function)]
+
+    def tool(self) -> types.Tool:
+        """Собранный types.Tool со всеми декларациями (пересобирается только после перезагрузки модулей)"""
+        for name in list(self._entries):
+            try:
+                self.get(name)
+            except Exception as e:
+                # Остаётся последняя успешно загруженная версия модуля
+                logger.error(f"Не удалось перезагрузить модуль функции {name}: {str(e)}")
+        if self._tool_version != self.version:
+            declarations: List[types.FunctionDeclaration] = [
+                entry.declaration for _, entry in sorted(self._entries.items())
+                if entry.declaration is not None
+            ]
+            self._tool = types.Tool(function_declarations=declarations)
+            self._tool_version = self.version
+        return self._tool
+
+    def exists(self, name: str) -> bool:
+        return name in self._entries or os.path.exists(self.path_for(name))
+
+    def get(self, name: str) -> Optional[FunctionEntry]:
+        """
+        Возвращает запись функции, при необходимости (пере)загружая модуль
+
+        Returns:
+            FunctionEntry или None, если файла функции нет
+        """
+        entry = self._entries.get(name)
+        if entry is None:
+            if not os.path.exists(self.path_for(name)):
+                return None
+            return self._load(name)
+
+        if self.check_interval < 0:
+            return entry
+        now = time.monotonic()
+        if now - entry.checked_at < self.check_interval:
+            return entry
+        entry.checked_at = now
+
+        try:
+            mtime = os.stat(entry.path).st_mtime
+        except FileNotFoundError:
+            self._entries.pop(name, None)
+            self.version += 1
+            return None
+        if mtime != entry.mtime:
+            logger.info(f"Файл функции {name} изменился, перезагружаем модуль")
+            return self._load(name)
+        return entry
+
+    def _load(self, name: str) -> FunctionEntry:
+        path = self.path_for(name)
+        mtime = os.stat(path).st_mtime
+        module = import_module_from_file(path, f"functions.{name}")
+        entry = FunctionEntry(name, path, module, mtime)
+        self._entries[name] = entry
+        self.version += 1
+        return entry
+
+
 async def handle_function_call(fc: types.FunctionCall, session_id: str) -> Dict[str, Any]:
     """
     Обработка вызовов функций с динамической загрузкой модулей
@@ -92,14 +234,9 @@ async def load_and_execute_function(function_name: str, args: Dict[str, Any], se
 
     args.setdefault("session_id", session_id)
 
-    # Путь к файлу функции
-    function_path = os.path.join(os.path.dirname(__file__), "functions", f"{function_name}.py")
-
-    print("OS PATH: " + function_path)
-
-    # Проверка существования файла
-    if not os.path.exists(function_path):
-        print("Функция не найдена")
+    # Проверка существования функции
+    if not registry.exists(function_name):
+        logger.warning(f"Функция не найдена: {function_name}")
         return FunctionResult(
             success=False,
             error=f"Функция '{function_name}' не найдена"
@@ -110,21 +247,25 @@ async def load_and_execute_function(function_name: str, args: Dict[str, Any], se
             session_id=session_id,
             instruction_type="START",
             function_name=function_name,
-            args=args,
-            request_id="unique-request-id-123"
+            args=args
         )
-        # Загрузка модуля
-        module = import_module_from_file(function_path, function_name)
+        # Получение функции из реестра (модуль загружается только при первом вызове или изменении файла)
+        entry = registry.get(function_name)
+        if entry is None:
+            return FunctionResult(
+                success=False,
+                error=f"Функция '{function_name}' не найдена"
+            )
 
         # Проверка наличия функции в модуле
-        if not hasattr(module, function_name):
+        if entry.function is None:
             return FunctionResult(
                 success=False,
                 error=f"В модуле '{function_name}' не найдена функция с тем же именем"
             )
 
         # Получение функции из модуля
-        function = getattr(module, function_name)
+        function = entry.function
 
         # Проверка, что это действительно вызываемая функция
         if not callable(function):
@@ -133,16 +274,33 @@ async def load_and_execute_function(function_name: str, args: Dict[str, Any], se
                 error=f"'{function_name}' не является вызываемой функцией"
             )
 
-        # Проверка, является ли функция асинхронной
-        is_async = inspect.iscoroutinefunction(function)
-
-        # Выполнение функции
-        if is_async:
-            result = await function(args)
+        cache_key = None
+        if entry.cache_result_ttl:
+            cache_key = make_key(args)
+            cached_result = result_cache.get(function_name, cache_key)
+            if cached_result is not MISSING:
+                return FunctionResult(success=True, data=_fit(entry, cached_result, args))
+
+        async def execute():
+            # Выполнение функции: синхронные функции уходят в пул, чтобы не блокировать event loop
+            async with executor_pool.limit(function_name, entry.max_concurrency):
+                if entry.is_async:
+                    result = await function(args)
+                else:
+                    result = await executor_pool.run(entry.executor, function, args)
+
+            if cache_key is not None:
+                result_cache.set(function_name, cache_key, result, entry.cache_result_ttl)
+            return result
+
+        if entry.single_flight:
+            # Такой же вызов уже выполняется (другая сессия или тот же ход модели) — ждём его результат
+            result = await single_flight.run(function_name, cache_key or make_key(args), session_id,
+                                             execute, on_join=_show_progress)
         else:
-            result = function(args)
+            result = await execute()
 
-        return FunctionResult(success=True, data=result)
+        return FunctionResult(success=True, data=_fit(entry, result, args))
 
     except ImportError as e:
         logger.error(f"Ошибка импорта модуля {function_name}: {str(e)}")
@@ -159,6 +317,17 @@ async def load_and_execute_function(function_name: str, args: Dict[str, Any], se
         )
 
 
+async def _show_progress(flight: Flight, session_id: str):
+    # Присоединившийся вызов видит то же состояние UI, что уже показано остальным
+    for payload in flight.replay():
+        await manager.send_instruction(session_id, payload["type"], payload["function"], payload["args"])
+
+
+def _fit(entry: FunctionEntry, result: Any, args: Dict[str, Any]) -> Any:
+    # В кэше лежит полный результат: бюджет применяется при каждой отдаче модели
+    return fit(entry.name, result, args, entry.output_budget, entry.output_format)
+
+
 def import_module_from_file(file_path: str, module_name: str):
     """
     Импортирует модуль из файла
@@ -197,4 +366,8 @@ def is_valid_function_name(name: str) -> bool:
     """
     # Базовая проверка на допустимые символы в имени файла/функции
     import re
-    return bool(re.match(r'^[a-zA-Z0-9_]+$', name))
\ No newline at end of file
+    return bool(re.match(r'^[a-zA-Z0-9_]+$', name))
+
+
+# глобальный реестр функций
+registry = FunctionRegistry()
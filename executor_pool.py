@@ -0,0 +1,151 @@
+import asyncio
+import functools
+import logging
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger("executor_pool")
+
+# Пул потоков для синхронных функций и блокирующего I/O
+IO_WORKERS = int(os.getenv("TOOL_IO_WORKERS", "8"))
+# Пул для CPU-тяжёлой работы: процессы, если TOOL_CPU_PROCESSES > 0, иначе отдельный пул потоков
+CPU_PROCESSES = int(os.getenv("TOOL_CPU_PROCESSES", "0"))
+CPU_THREADS = int(os.getenv("TOOL_CPU_THREADS", "2"))
+# Лимит одновременных вызовов одной функции по умолчанию (0 — без лимита)
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("TOOL_MAX_CONCURRENCY", "0"))
+
+
+class _PoolStats:
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+
+    def to_dict(self) -> Dict[str, int]:
+        return {
+            "max_workers": self.max_workers,
+            "pending": self.pending,
+            "queue_depth": max(0, self.pending - self.max_workers),
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+
+class ExecutorPool:
+    """
+    Ограниченные пулы исполнителей для функций агентов
+
+    io  — синхронные функции и блокирующие библиотеки (requests и т.п.)
+    cpu — парсинг и прочая CPU-тяжёлая работа, которая не должна держать event loop
+
+    Плюс семафоры на каждую функцию, чтобы одна медленная функция не занимала весь пул.
+    """
+
+    def __init__(
+        self,
+        io_workers: int = IO_WORKERS,
+        cpu_processes: int = CPU_PROCESSES,
+        cpu_threads: int = CPU_THREADS,
+        default_max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    ):
+        self.io_workers = io_workers
+        self.cpu_processes = cpu_processes
+        self.cpu_threads = cpu_threads
+        self.default_max_concurrency = default_max_concurrency
+        self._executors: Dict[str, Executor] = {}
+        self._stats = {
+            "io": _PoolStats(io_workers),
+            "cpu": _PoolStats(cpu_processes or cpu_threads),
+        }
+        self._limits: Dict[str, Tuple[int, asyncio.Semaphore]] = {}
+        self._waiting: Dict[str, int] = {}
+        self._running: Dict[str, int] = {}
+
+    def _executor(self, kind: str) -> Executor:
+        executor = self._executors.get(kind)
+        if executor is None:
+            if kind == "cpu" and self.cpu_processes > 0:
+                executor = ProcessPoolExecutor(max_workers=self.cpu_processes)
+            elif kind == "cpu":
+                executor = ThreadPoolExecutor(max_workers=self.cpu_threads, thread_name_prefix="tool-cpu")
+            else:
+                executor = ThreadPoolExecutor(max_workers=self.io_workers, thread_name_prefix="tool-io")
+            self._executors[kind] = executor
+        return executor
+
+    async def run(self, kind: str, func: Callable, *args, **kwargs) -> Any:
+        """Выполняет func(*args, **kwargs) в пуле kind ('io' или 'cpu')"""
+        stats = self._stats[kind]
+        loop = asyncio.get_running_loop()
+        call = functools.partial(func, *args, **kwargs) if kwargs else func
+        stats.pending += 1
+        try:
+            if kwargs:
+                result = await loop.run_in_executor(self._executor(kind), call)
+            else:
+                result = await loop.run_in_executor(self._executor(kind), call, *args)
+        except BaseException:
+            stats.failed += 1
+            raise
+        finally:
+            stats.pending -= 1
+        stats.completed += 1
+        return result
+
+    async def run_io(self, func: Callable, *args, **kwargs) -> Any:
+        return await self.run("io", func, *args, **kwargs)
+
+    async def run_cpu(self, func: Callable, *args, **kwargs) -> Any:
+        return await self.run("cpu", func, *args, **kwargs)
+
+    @asynccontextmanager
+    async def limit(self, name: str, max_concurrency: Optional[int] = None):
+        """Ограничивает число одновременных вызовов функции name"""
+        if max_concurrency is None:
+            max_concurrency = self.default_max_concurrency
+        if not max_concurrency or max_concurrency <= 0:
+            self._running[name] = self._running.get(name, 0) + 1
+            try:
+                yield
+            finally:
+                self._running[name] -= 1
+            return
+
+        size, semaphore = self._limits.get(name, (None, None))
+        if size != max_concurrency:
+            # Лимит поменялся (перезагрузка модуля функции) — новые вызовы идут через новый семафор,
+            # уже запущенные отпускают старый
+            semaphore = asyncio.Semaphore(max_concurrency)
+            self._limits[name] = (max_concurrency, semaphore)
+        self._waiting[name] = self._waiting.get(name, 0) + 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self._waiting[name] -= 1
+        self._running[name] = self._running.get(name, 0) + 1
+        try:
+            yield
+        finally:
+            self._running[name] -= 1
+            semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pools": {kind: stats.to_dict() for kind, stats in self._stats.items()},
+            "functions": {
+                name: {"running": running, "waiting": self._waiting.get(name, 0)}
+                for name, running in self._running.items()
+            },
+        }
+
+    def shutdown(self):
+        for executor in self._executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+        self._executors.clear()
+
+
+# глобальный экземпляр
+executor_pool = ExecutorPool()
@@ -1,298 +1,264 @@
-#!/usr/bin/env python3
-import requests
-import json
-import sys
-from typing import Optional
-
-
-class PresentationClient:
-    def __init__(self, server_url: str = "http://localhost:3000"):
-        self.server_url = server_url
-        self.session_id: Optional[str] = None
-
-    def create_session(self, topic: str, audience: str, notes: str = "",
-                       style: str = "modern", ultra_mode: bool = False) -> bool:
-        """Создает новую сессию для генерации презентации"""
-        try:
-            response = requests.post(f"{self.server_url}/api/create-session",
-                                     json={
-                                         "topic": topic,
-                                         "audience": audience,
-                                         "notes": notes,
-                                         "style": style,
-                                         "ultraMode": ultra_mode
-                                     })
-
-            if response.status_code == 200:
-                data = response.json()
-                self.session_id = data["sessionId"]
-                print(f"✅ Сессия создана: {self.session_id}")
-                return True
-            else:
-                print(f"❌ Ошибка создания сессии: {response.text}")
-                return False
-        except requests.RequestException as e:
-            print(f"❌ Ошибка подключения: {e}")
-            return False
-
-    def generate_content(self) -> bool:
-        """Генерирует содержание презентации"""
-        if not self.session_id:
-            print("❌ Сессия не создана")
-            return False
-
-        try:
-            print("\n🔄 Генерация содержания презентации...")
-            response = requests.post(f"{self.server_url}/api/generate-content/{self.session_id}",
-                                     stream=True)
-
-            if response.status_code == 200:
-                print("\n📝 Содержание презентации:")
-                print("-" * 50)
-                for chunk in response.iter_content(chunk_size=1024):
-                    if chunk:
-                        print(chunk.decode('utf-8'), end='', flush=True)
-                print("\n" + "-" * 50)
-                return True
-            else:
-                print(f"❌ Ошибка генерации содержания: {response.text}")
-                return False
-        except requests.RequestException as e:
-            print(f"❌ Ошибка подключения: {e}")
-            return False
-
-    def refine_content(self, feedback: str) -> bool:
-        """Уточняет содержание презентации на основе обратной связи"""
-        if not self.session_id:
-            print("❌ Сессия не создана")
-            return False
-
-        try:
-            print(f"\n🔄 Уточнение содержания на основе отзыва: {feedback}")
-            response = requests.post(f"{self.server_url}/api/refine-content/{self.session_id}",
-                                     json={"feedback": feedback},
-                                     stream=True)
-
-            if response.status_code == 200:
-                print("\n📝 Обновленное содержание презентации:")
-                print("-" * 50)
-                for chunk in response.iter_content(chunk_size=1024, decode_unicode=True):
-                    if chunk:
-                        print(chunk, end='', flush=True)
-                print("\n" + "-" * 50)
-                return True
-            else:
-                print(f"❌ Ошибка уточнения содержания: {response.text}")
-                return False
-        except requests.RequestException as e:
-            print(f"❌ Ошибка подключения: {e}")
-            return False
-
-    def approve_content(self) -> bool:
-        """Одобряет содержание и переходит к генерации кода"""
-        if not self.session_id:
-            print("❌ Сессия не создана")
-            return False
-
-        try:
-            response = requests.post(f"{self.server_url}/api/approve-content/{self.session_id}")
-
-            if response.status_code == 200:
-                print("✅ Содержание одобрено, переходим к генерации кода")
-                return True
-            else:
-                print(f"❌ Ошибка одобрения содержания: {response.text}")
-                return False
-        except requests.RequestException as e:
-            print(f"❌ Ошибка подключения: {e}")
-            return False
-
-    def generate_code(self) -> bool:
-        """Генерирует код презентации"""
-        if not self.session_id:
-            print("❌ Сессия не создана")
-            return False
-
-        try:
-            print("\n🔄 Генерация кода презентации...")
-            response = requests.post(f"{self.server_url}/api/generate-code/{self.session_id}",
-                                     stream=True)
-
-            if response.status_code == 200:
-                print("\n💻 Код презентации:")
-                print("-" * 50)
-                for chunk in response.iter_content(chunk_size=1024, decode_unicode=True):
-                    if chunk:
-                        print(chunk, end='', flush=True)
-                print("\n" + "-" * 50)
-                return True
-            else:
-                print(f"❌ Ошибка генерации кода: {response.text}")
-                return False
-        except requests.RequestException as e:
-            print(f"❌ Ошибка подключения: {e}")
-            return False
-
-    def refine_code(self, feedback: str) -> bool:
-        """Уточняет код презентации на основе обратной связи"""
-        if not self.session_id:
-            print("❌ Сессия не создана")
-            return False
-
-        try:
-            print(f"\n🔄 Уточнение кода на основе отзыва: {feedback}")
-            response = requests.post(f"{self.server_url}/api/refine-code/{self.session_id}",
-                                     json={"feedback": feedback},
-                                     stream=True)
-
-            if response.status_code == 200:
-                print("\n💻 Обновленный код презентации:")
-                print("-" * 50)
-                for chunk in response.iter_content(chunk_size=1024, decode_unicode=True):
-                    if chunk:
-                        print(chunk, end='', flush=True)
-                print("\n" + "-" * 50)
-                return True
-            else:
-                print(f"❌ Ошибка уточнения кода: {response.text}")
-                return False
-        except requests.RequestException as e:
-            print(f"❌ Ошибка подключения: {e}")
-            return False
-
-    def get_final_result(self) -> Optional[dict]:
-        """Получает финальный результат"""
-        if not self.session_id:
-            print("❌ Сессия не создана")
-            return None
-
-        try:
-            response = requests.get(f"{self.server_url}/api/get-result/{self.session_id}")
-
-            if response.status_code == 200:
-                return response.json()
-            else:
-                print(f"❌ Ошибка получения результата: {response.text}")
-                return None
-        except requests.RequestException as e:
-            print(f"❌ Ошибка подключения: {e}")
-            return None
-
-    def save_presentation(self, filename: str = "presentation.html") -> bool:
-        """Сохраняет презентацию в HTML файл"""
-        result = self.get_final_result()
-        if not result or not result.get("code"):
-            print("❌ Нет кода для сохранения")
-            return False
-
-        try:
-            with open(filename, 'w', encoding='utf-8') as f:
-                f.write(result["code"])
-            print(f"✅ Презентация сохранена в файл: {filename}")
-            return True
-        except Exception as e:
-            print(f"❌ Ошибка сохранения файла: {e}")
-            return False
-
-
-def main():
-    client = PresentationClient()
-
-    print("🎯 Генератор презентаций")
-    print("=" * 40)
-
-    # Сбор параметров презентации
-    topic = input("📌 Введите тему презентации: ").strip()
-    if not topic:
-        print("❌ Тема презентации обязательна")
-        return
-
-    audience = input("👥 Введите описание целевой аудитории: ").strip()
-    if not audience:
-        print("❌ Описание аудитории обязательно")
-        return
-
-    notes = input("📝 Введите дополнительные примечания (необязательно): ").strip()
-
-    style = input("🎨 Введите стиль презентации (по умолчанию 'modern'): ").strip()
-    if not style:
-        style = "modern"
-
-    ultra_mode_input = input("⚡ Включить ультра режим? (y/N): ").strip().lower()
-    ultra_mode = ultra_mode_input in ['y', 'yes', 'да']
-
-    # Создание сессии
-    if not client.create_session(topic, audience, notes, style, ultra_mode):
-        return
-
-    # Генерация содержания
-    if not client.generate_content():
-        return
-
-    # Цикл уточнения содержания
-    while True:
-        action = input("\n🤔 Что делать с содержанием?\n"
-                       "1. Одобрить и перейти к коду\n"
-                       "2. Внести изменения\n"
-                       "3. Выйти\n"
-                       "Выберите (1-3): ").strip()
-
-        if action == "1":
-            if client.approve_content():
+import asyncio
+import codecs
+import os
+import re
+import time
+from typing import Awaitable, Callable, List, Optional
+import aiohttp
+from aiohttp import ClientTimeout
+from connection_manager import manager
+from governor import BackendError, BackendUnavailable, governor
+from http_pool import http_pool
+
+# Адрес сервера генерации презентаций
+SERVER_URL = os.getenv("PRESENTATION_SERVER_URL", "http://localhost:3000")
+# Генерация презентации — долгий вызов: не больше двух одновременно
+MAX_CONCURRENCY = 2
+# Дедлайн всего конвейера в секундах
+TIMEOUT = float(os.getenv("PRESENTATION_TIMEOUT", "300"))
+# Сколько секунд ждать очередного чанка потока, прежде чем считать сервер зависшим
+READ_TIMEOUT = float(os.getenv("PRESENTATION_READ_TIMEOUT", "60"))
+# Не чаще чем раз в столько секунд отправлять клиенту недописанный слайд
+PUSH_INTERVAL = float(os.getenv("PRESENTATION_PUSH_INTERVAL", "0.3"))
+
+# Декларация функции для Gemini (имя берётся из имени модуля)
+DECLARATION = {
+    "description": "Создаёт HTML-презентацию по теме и показывает её пользователю. Слайды появляются на экране по мере генерации, это занимает до нескольких минут — предупредите пользователя, что презентация создаётся. Вызывайте, когда пользователь просит сделать презентацию или слайды.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "topic": {
+                "type": "string",
+                "description": "Тема презентации"
+            },
+            "audience": {
+                "type": "string",
+                "description": "Целевая аудитория"
+            },
+            "notes": {
+                "type": "string",
+                "description": "Дополнительные пожелания пользователя"
+            },
+            "style": {
+                "type": "string",
+                "description": "Стиль оформления, по умолчанию modern"
+            },
+            "ultra_mode": {
+                "type": "boolean",
+                "description": "Расширенный режим: больше слайдов и деталей, но дольше"
+            }
+        },
+        "required": [
+            "topic",
+            "audience"
+        ]
+    }
+}
+
+# Начало нового слайда в содержании: разделитель --- или заголовок первого/второго уровня
+SLIDE_BOUNDARY = re.compile(r"^(?:-{3,}\s*$|#{1,2}\s)", re.MULTILINE)
+# Открывающий или закрывающий тег слайда в HTML (слайды reveal.js бывают вложенными)
+SECTION_TAG = re.compile(r"<(/?)section\b[^>]*>", re.IGNORECASE)
+
+
+# Сервер презентаций тяжёлый: не чаще раза в 10 секунд в среднем, и отказ сразу, если он лежит
+BACKEND = governor.backend("presentation", rate=0.1, burst=3, failure_threshold=2, reset_timeout=120, max_wait=0)
+
+
+class PresentationError(BackendError):
+    pass
+
+
+class SlideSplitter:
+    """Делит поток содержания на готовые слайды и недописанный хвост"""
+
+    def __init__(self):
+        self.text = ""
+        self.slides: List[str] = []
+        # Позиция начала недописанного слайда
+        self._start = 0
+
+    def feed(self, chunk: str) -> bool:
+        """Добавляет чанк; True, если появился новый законченный слайд"""
+        # Граница могла прийти разорванной между чанками — ищем с начала текущей строки
+        scan_from = self.text.rfind("\n", self._start) + 1
+        self.text += chunk
+        completed = False
+        for match in SLIDE_BOUNDARY.finditer(self.text, max(scan_from, self._start + 1)):
+            # Строка с границей ещё не дописана
+            if "\n" not in self.text[match.start():]:
                 break
+            completed |= self._close_slide(match.start())
+        return completed
+
+    def _close_slide(self, end: int) -> bool:
+        slide = self.text[self._start:end].strip().strip("-").strip()
+        self._start = end
+        if slide:
+            self.slides.append(slide)
+            return True
+        return False
+
+    @property
+    def draft(self) -> str:
+        return self.text[self._start:].strip()
+
+    def finish(self) -> List[str]:
+        self._close_slide(len(self.text))
+        return self.slides
+
+
+async def _stream(session: aiohttp.ClientSession, path: str, on_chunk: Callable[[str], Awaitable[None]],
+                  payload: Optional[dict] = None) -> str:
+    """POST с потоковым ответом: on_chunk вызывается на каждый пришедший кусок текста"""
+    timeout = ClientTimeout(total=None, sock_connect=10, sock_read=READ_TIMEOUT)
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    parts = []
+    async with session.post(f"{SERVER_URL}{path}", json=payload, timeout=timeout) as response:
+        if response.status >= 400:
+            raise PresentationError(f"{path}: {response.status} {await response.text()}")
+        # Чанки отдаются сразу, как пришли по сети, без буферизации ответа целиком
+        async for data in response.content.iter_any():
+            text = decoder.decode(data)
+            if text:
+                parts.append(text)
+                await on_chunk(text)
+        tail = decoder.decode(b"", final=True)
+        if tail:
+            parts.append(tail)
+            await on_chunk(tail)
+    return "".join(parts)
+
+
+async def _post_json(session: aiohttp.ClientSession, path: str, payload: Optional[dict] = None) -> dict:
+    async with session.post(f"{SERVER_URL}{path}", json=payload, timeout=ClientTimeout(total=30)) as response:
+        if response.status >= 400:
+            raise PresentationError(f"{path}: {response.status} {await response.text()}")
+        return await response.json(content_type=None)
+
+
+async def _get_result(session: aiohttp.ClientSession, presentation_id: str) -> dict:
+    async with session.get(f"{SERVER_URL}/api/get-result/{presentation_id}", timeout=ClientTimeout(total=30)) as response:
+        if response.status >= 400:
+            raise PresentationError(f"get-result: {response.status} {await response.text()}")
+        return await response.json(content_type=None)
+
+
+def _slide_title(slide: str) -> str:
+    first_line = slide.strip().splitlines()[0] if slide.strip() else ""
+    return first_line.lstrip("#").strip()[:80]
+
+
+async def generate_presentation(args):
+    session_id = args.get('session_id')
+    topic = args.get('topic', '')
+    session = http_pool.session()
+
+    async def show(state: dict):
+        # SET без requestId схлопывается в очереди клиента: медленный клиент получит только свежее состояние
+        await manager.send_instruction(
+            session_id=session_id,
+            instruction_type="SET",
+            function_name='generate_presentation',
+            args={'topic': topic, **state}
+        )
+
+    splitter = SlideSplitter()
+    last_push = 0.0
+
+    async def on_content(chunk: str):
+        nonlocal last_push
+        now = time.monotonic()
+        # Законченный слайд показываем сразу, недописанный — не чаще PUSH_INTERVAL
+        if splitter.feed(chunk) or now - last_push >= PUSH_INTERVAL:
+            last_push = now
+            await show({'stage': 'content', 'slides': list(splitter.slides), 'draft': splitter.draft, 'partial': True})
+
+    sections = 0
+    html_chars = 0
+    # Недоразобранный HTML: с начала текущего слайда верхнего уровня
+    pending = ""
+    scan_from = 0
+    section_start = 0
+    depth = 0
+
+    async def on_code(chunk: str):
+        # Каждый законченный слайд уходит клиенту один раз, своей инструкцией с requestId —
+        # такие не схлопываются. Растущий документ целиком не повторяется: это O(n²) байт
+        # через ограниченную очередь клиента; HTML целиком приходит на stage done
+        nonlocal last_push, sections, html_chars, pending, scan_from, section_start, depth
+        html_chars += len(chunk)
+        pending += chunk
+        completed = False
+        for match in SECTION_TAG.finditer(pending, scan_from):
+            scan_from = match.end()
+            if match.group(1):
+                depth = max(0, depth - 1)
+                if depth == 0:
+                    await manager.send_instruction(
+                        session_id=session_id,
+                        instruction_type="SET",
+                        function_name='generate_presentation',
+                        args={'topic': topic, 'stage': 'code', 'slide_index': sections,
+                              'slide_html': pending[section_start:match.end()], 'partial': True},
+                        request_id=f"{presentation_id}-slide-{sections}"
+                    )
+                    sections += 1
+                    completed = True
             else:
-                return
-        elif action == "2":
-            feedback = input("💬 Введите ваши замечания: ").strip()
-            if feedback:
-                client.refine_content(feedback)
-            else:
-                print("❌ Замечания не могут быть пустыми")
-        elif action == "3":
-            print("👋 До свидания!")
-            return
-        else:
-            print("❌ Неверный выбор, попробуйте снова")
-
-    # Генерация кода
-    if not client.generate_code():
-        return
-
-    # Цикл уточнения кода
-    while True:
-        action = input("\n🤔 Что делать с кодом?\n"
-                       "1. Принять и сохранить\n"
-                       "2. Внести изменения\n"
-                       "3. Выйти\n"
-                       "Выберите (1-3): ").strip()
-
-        if action == "1":
-            filename = input("💾 Введите имя файла (по умолчанию 'presentation.html'): ").strip()
-            if not filename:
-                filename = "presentation.html"
-            if not filename.endswith('.html'):
-                filename += '.html'
-
-            if client.save_presentation(filename):
-                print("🎉 Презентация готова!")
-            break
-        elif action == "2":
-            feedback = input("💬 Введите ваши замечания: ").strip()
-            if feedback:
-                client.refine_code(feedback)
-            else:
-                print("❌ Замечания не могут быть пустыми")
-        elif action == "3":
-            print("👋 До свидания!")
-            return
-        else:
-            print("❌ Неверный выбор, попробуйте снова")
-
+                if depth == 0:
+                    section_start = match.start()
+                depth += 1
+        # Тег мог разорваться между чанками — недописанный тег в конце просматриваем ещё раз
+        open_tag = pending.rfind("<", scan_from)
+        scan_from = open_tag if open_tag != -1 and ">" not in pending[open_tag:] else len(pending)
+        if depth == 0:
+            # Между слайдами хранить нечего
+            pending = pending[scan_from:]
+            scan_from = section_start = 0
+        now = time.monotonic()
+        if completed or now - last_push >= PUSH_INTERVAL:
+            last_push = now
+            await show({'stage': 'code', 'slides': list(splitter.slides), 'rendered_slides': sections,
+                        'html_chars': html_chars, 'partial': True})
 
-if __name__ == "__main__":
     try:
-        main()
-    except KeyboardInterrupt:
-        print("\n\n👋 Программа прервана пользователем")
-    except Exception as e:
-        print(f"\n❌ Произошла ошибка: {e}")
\ No newline at end of file
+        async with BACKEND.guard():
+            await show({'stage': 'starting', 'partial': True})
+            created = await _post_json(session, "/api/create-session", {
+                "topic": topic,
+                "audience": args.get('audience', ''),
+                "notes": args.get('notes', ''),
+                "style": args.get('style') or "modern",
+                "ultraMode": bool(args.get('ultra_mode', False)),
+            })
+            presentation_id = created["sessionId"]
+
+            await _stream(session, f"/api/generate-content/{presentation_id}", on_content)
+            slides = splitter.finish()
+            await show({'stage': 'content', 'slides': slides, 'draft': '', 'partial': True})
+
+            await _post_json(session, f"/api/approve-content/{presentation_id}")
+            last_push = 0.0
+            streamed_html = await _stream(session, f"/api/generate-code/{presentation_id}", on_code)
+
+            # Сервер может почистить код после генерации — итог берём из get-result
+            try:
+                html = (await _get_result(session, presentation_id)).get("code") or streamed_html
+            except (PresentationError, aiohttp.ClientError, asyncio.TimeoutError):
+                html = streamed_html
+        await show({'stage': 'done', 'slides': slides, 'html': html})
+    except BackendUnavailable as e:
+        await show({'stage': 'error', 'error': str(e)})
+        return str(e)
+    except (PresentationError, KeyError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+        reason = str(e) or type(e).__name__
+        print(f'Ошибка генерации презентации: {reason}')
+        await show({'stage': 'error', 'error': reason})
+        return f'Ошибка генерации презентации: {reason}'
+
+    # Модели — короткая сводка, сама презентация уже на экране пользователя
+    titles = "; ".join(filter(None, (_slide_title(slide) for slide in slides)))
+    return (f'Презентация "{topic}" готова и показана пользователю: {len(slides)} слайдов, '
+            f'{len(html)} символов HTML. Слайды: {titles}')
+
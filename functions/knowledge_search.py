@@ -0,0 +1,56 @@
+from executor_pool import executor_pool
+from knowledge_index import knowledge_index
+
+# Локальный поиск быстрый — не должен ждать за web_search в очереди сессии
+PRIORITY = 5
+TIMEOUT = 5
+# Ответ не зависит от сессии: одновременные одинаковые запросы выполняются один раз
+SINGLE_FLIGHT = True
+
+# Декларация функции для Gemini (имя берётся из имени модуля)
+DECLARATION = {
+    "description": "Быстрый поиск по локальной базе знаний о пользователе и его проектах (личная информация, предпочтения, заметки, мнения). Используйте его ПЕРВЫМ, когда вопрос касается пользователя, его жизни, планов или проектов, прежде чем искать в интернете. В query пишите ключевые слова на языке документов (обычно русский).",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "query": {
+                "type": "string"
+            },
+            "limit": {
+                "type": "integer"
+            }
+        },
+        "required": [
+            "query"
+        ]
+    }
+}
+
+
+def format_results_for_llm(results: list) -> str:
+    if not results:
+        return "В базе знаний ничего не найдено."
+    parts = ["KNOWLEDGE BASE:\n"]
+    for i, r in enumerate(results, 1):
+        parts.append(f"[{i}] {r['title']}\n{r['snippet']}\n")
+    return "\n".join(parts)
+
+
+async def knowledge_search(args):
+    """
+    Поиск по локальной базе знаний (data/documents.json)
+
+    Args:
+        args: Словарь с параметрами: 'query' — запрос, 'limit' — сколько документов вернуть
+
+    Returns:
+        Найденные фрагменты документов в текстовом виде
+    """
+    query = args.get('query', '')
+    limit = int(args.get('limit') or 3)
+    try:
+        results = await executor_pool.run_io(knowledge_index.search, query, limit)
+    except Exception as e:
+        print(f'Ошибка поиска по базе знаний: {e}')
+        return f'Ошибка поиска по базе знаний: {e}'
+    return format_results_for_llm(results)
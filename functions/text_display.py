@@ -1,3 +1,24 @@
+# UI-функция: выполняется раньше остальных в очереди сессии
+PRIORITY = 0
+TIMEOUT = 5
+
+# Декларация функции для Gemini (имя берётся из имени модуля)
+DECLARATION = {
+    "description": "Вы говорите с пользователем голосом, и всё, что вы скажете прозвучит только один раз, если вы не будите нарошно повторять. Для того, чтобы отметить какую-то ВАЖНУЮ ИНФОРМАЦИЮ, текстом, которую нужно читать несколько раз, используйте эту функцию. Например, вас просят сказать определение, рецепт, погоду, ответ в дз и т.п. Функция поддерживает markdown",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "text": {
+                "type": "string"
+            }
+        },
+        "required": [
+            "text"
+        ]
+    }
+}
+
+
 async def text_display(args):
 
     return f"ok"
\ No newline at end of file
@@ -1,10 +1,54 @@
 import asyncio
+import logging
+import os
+import time
 import aiohttp
 from aiohttp import ClientTimeout
-from readability import Document
-from bs4 import BeautifulSoup
 from urllib.parse import urlparse, urlencode
 from connection_manager import manager
+from executor_pool import executor_pool
+from governor import BackendError, BackendUnavailable, governor
+from http_pool import http_pool
+from result_cache import MISSING, normalize_query, result_cache
+from html_extract import MAX_PAGE_BYTES, extract_main_text, first_class, parse_html, read_capped, select_class, text_of
+
+logger = logging.getLogger("web_search")
+
+# Limit concurrent searches (each one fans out to several page fetches)
+MAX_CONCURRENCY = 4
+# Deadline for the whole search, in seconds
+TIMEOUT = 20
+# How long identical queries are answered from the result cache, in seconds
+CACHE_TTL = float(os.getenv("WEB_SEARCH_CACHE_TTL", "1800"))
+# Overall time budget for search + page extraction, in seconds
+SEARCH_DEADLINE = float(os.getenv("WEB_SEARCH_DEADLINE", "8"))
+# DuckDuckGo HTML endpoint (overridable to point benchmarks at a local mock)
+DUCKDUCKGO_URL = os.getenv("WEB_SEARCH_DDG_URL", "https://html.duckduckgo.com/html/")
+
+# Results do not depend on the session: identical concurrent searches run once
+SINGLE_FLIGHT = True
+
+# Throttle scraping of html.duckduckgo.com and fail fast while it keeps refusing us
+DUCKDUCKGO = governor.backend("duckduckgo", rate=1, burst=5, failure_threshold=3, reset_timeout=60)
+
+# Characters of search results sent to the model (the client still gets the full pages)
+OUTPUT_BUDGET = int(os.getenv("WEB_SEARCH_OUTPUT_BUDGET", "3000"))
+
+# Declaration for Gemini (the name is taken from the module name)
+DECLARATION = {
+    "description": "Асинхронно ищет по вашему запросу в “большом” интернете (через DuckDuckGo), извлекает заголовки и основной текст страниц.  **Когда использовать:**  * **Сложные или редкие запросы**, где ни Википедия, ни Wolfram Alpha, ни локальная БД не дают полного ответа. * **Неоднозначные темы** или глубокие статьи, которые могут отсутствовать в узкоспециализированных источниках. * **Проверка фактов** из разных сайтов, когда нужна свежая информация, не попавшая ещё в базы.  **Когда не использовать:**  * Если нужен **краткий факт** или формула — сначала обращайтесь к Wolfram Alpha. * Если вопрос охватывается **статьёй в Википедии** — используйте wikipedia\\_search. * Если информация строго **персональная** — берите из локальной БД пользователя.  **Поведение в диалоге:**  1. Голос ИИ: «Сейчас я поищу в интернете…» 2. Вызывается `web_search` и возвращаются заголовки + ключевые выдержки. 3. ИИ озвучивает и формирует ответ на основе свежих данных.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "query": {
+                "type": "string"
+            }
+        },
+        "required": [
+            "query"
+        ]
+    }
+}
 
 # Blacklist domains to skip
 BLACKLIST = {"facebook.com", "instagram.com", "tiktok.com"}
@@ -17,34 +61,50 @@ HEADERS = {
               'application/xml;q=0.9,image/webp,*/*;q=0.8'
 }
 
-async def fetch_html(session: aiohttp.ClientSession, url: str, timeout: int = 5) -> str:
+async def fetch_html(session: aiohttp.ClientSession, url: str, timeout: int = 5,
+                     max_bytes: int = MAX_PAGE_BYTES) -> tuple:
+    """Returns (body bytes capped at max_bytes, charset or None); empty body on failure."""
     try:
-        async with session.get(url, timeout=ClientTimeout(total=timeout)) as resp:
+        async with session.get(url, headers=HEADERS, timeout=ClientTimeout(total=timeout)) as resp:
             if resp.status == 200 and 'text/html' in resp.headers.get('Content-Type', ''):
-                return await resp.text()
+                return await read_capped(resp, max_bytes), resp.charset
     except Exception:
         pass
-    return ''
+    return b'', None
+
+class DuckDuckGoError(BackendError):
+    pass
 
 async def duckduckgo_search(session: aiohttp.ClientSession, query: str, max_results: int) -> list:
-    url = f"https://html.duckduckgo.com/html/?{urlencode({'q': query})}"
-    html = await fetch_html(session, url)
-    soup = BeautifulSoup(html, 'html.parser')
+    url = f"{DUCKDUCKGO_URL}?{urlencode({'q': query})}"
+    async with DUCKDUCKGO.guard():
+        async with session.get(url, headers=HEADERS, timeout=ClientTimeout(total=5)) as resp:
+            # DuckDuckGo answers throttled clients with 202 and a challenge page instead of results
+            if resp.status != 200:
+                raise DuckDuckGoError(f'{resp.status} {resp.reason}')
+            html, encoding = await read_capped(resp), resp.charset
+    return await executor_pool.run_cpu(parse_search_results, html, max_results, encoding)
+
+def parse_search_results(html, max_results: int, encoding: str = None) -> list:
+    root = parse_html(html, encoding)
+    if root is None:
+        return []
     results = []
-    for result in soup.select('.result'):
-        title_tag = result.select_one('.result__title a')
-        url_text = result.select_one('.result__url')
-        snippet_tag = result.select_one('.result__snippet')
-        if not title_tag:
+    for result in select_class(root, 'result'):
+        title_block = first_class(result, 'result__title')
+        title_tag = title_block.find('.//a') if title_block is not None else None
+        url_text = first_class(result, 'result__url')
+        snippet_tag = first_class(result, 'result__snippet')
+        if title_tag is None:
             continue
-        title = title_tag.get_text(strip=True)
+        title = text_of(title_tag)
         raw_href = title_tag.get('href', '')
-        href = url_text.get_text(strip=True) or raw_href
+        href = text_of(url_text) or raw_href
         if href.startswith('/l/?kh='):
             # DuckDuckGo redirect
-            href = session._connector._resolve_redirects  # fallback
+            href = raw_href
         source = href if href.startswith('http') else f"https://{href}"
-        snippet = snippet_tag.get_text(strip=True) if snippet_tag else ''
+        snippet = text_of(snippet_tag)
         results.append({'title': title, 'source': source, 'snippet': snippet})
         if len(results) >= max_results * 2:
             break
@@ -60,66 +120,126 @@ async def extract_content(session: aiohttp.ClientSession, url: str, timeout: int
     domain = domain_from_url(url)
     if any(block in domain for block in BLACKLIST):
         return ''
-    html = await fetch_html(session, url, timeout)
+    started = time.perf_counter()
+    html, encoding = await fetch_html(session, url, timeout)
+    fetch_ms = (time.perf_counter() - started) * 1000
     if not html:
         return ''
     try:
-        doc = Document(html)
-        content = doc.summary()
-        text = BeautifulSoup(content, 'html.parser').get_text(separator=' ', strip=True)
-        return text[:2000] + '...' if len(text) > 2000 else text
+        # Parsing is CPU-bound, keep it off the event loop
+        extraction = await executor_pool.run_cpu(extract_main_text, html, 2000, encoding)
     except Exception:
         return ''
+    timings = ' '.join(f'{name}={value:.1f}' for name, value in extraction.timings.items())
+    logger.debug(f'{url}: {len(html)} bytes, fetch_ms={fetch_ms:.1f} {timings}')
+    return extraction.text
+
+async def extract_result(session: aiohttp.ClientSession, rank: int, res: dict) -> dict:
+    content = await extract_content(session, res['source'])
+    if not content:
+        return {}
+    print(res['source'] + ' is ready!')
+    return {
+        'rank': rank,
+        'title': res['title'],
+        'url': res['source'],
+        'domain': domain_from_url(res['source']),
+        'favicon': f"https://www.google.com/s2/favicons?domain={domain_from_url(res['source'])}&sz=32",
+        'content': content,
+        'snippet': res['snippet']
+    }
+
+def _ordered(results: list) -> list:
+    # Keep search-engine order regardless of which page finished first
+    return [{k: v for k, v in r.items() if k != 'rank'} for r in sorted(results, key=lambda r: r['rank'])]
+
+async def enhanced_search(query: str, max_results: int = 3, on_result=None,
+                          deadline: float = SEARCH_DEADLINE) -> list:
+    """Performs a DuckDuckGo search and returns top results with extracted main content.
 
-async def enhanced_search(query: str, max_results: int = 3) -> list:
-    ":""Performs a DuckDuckGo search and returns top results with extracted main content."""
-    async with aiohttp.ClientSession(headers=HEADERS) as session:
-        search_results = await duckduckgo_search(session, query, max_results)
-        print('search results:' + str(search_results))
-        tasks = []
-        for res in search_results:
-            tasks.append(extract_content(session, res['source']))
-        # run up to max_results concurrently and gather
-        contents = await asyncio.gather(*tasks[:max_results], return_exceptions=True)
-        final = []
-        for idx, res in enumerate(search_results[:max_results]):
-            content = contents[idx] if isinstance(contents[idx], str) else ''
-            if content:
-                final.append({
-                    'title': res['title'],
-                    'url': res['source'],
-                    'domain': domain_from_url(res['source']),
-                    'favicon': f"https://www.google.com/s2/favicons?domain={domain_from_url(res['source'])}&sz=32",
-                    'content': content,
-                    'snippet': res['snippet']
-                })
-                print(res['source'] + ' is ready!')
-        return final
-
-
-def format_results_for_llm(results: list) -> str:
+    All candidates (up to max_results * 2) are fetched concurrently; the search returns
+    as soon as max_results pages were extracted or the deadline expires, and cancels the
+    rest. Failed fetches are replaced by the spare candidates. on_result, if given, is
+    awaited with the ordered partial results each time a new page is ready.
+    """
+    key = f"{max_results}:{normalize_query(query)}"
+    results = result_cache.get("web_search", key)
+    if results is not MISSING:
+        return results
+    results, complete = await _search(query, max_results, on_result, deadline)
+    # Only complete answers are cached: a result cut short by the deadline would otherwise
+    # be served for the whole CACHE_TTL
+    if results and complete:
+        result_cache.set("web_search", key, results, CACHE_TTL)
+    return results
+
+async def _search(query: str, max_results: int, on_result, deadline: float) -> tuple:
+    """Returns (results, complete): complete is False when the deadline cut the search short."""
+    loop = asyncio.get_running_loop()
+    deadline_at = loop.time() + deadline
+    # Shared app-wide session: keeps TCP/TLS connections and the DNS cache between searches
+    session = http_pool.session()
+    search_results = await duckduckgo_search(session, query, max_results)
+    print('search results:' + str(search_results))
+
+    pending = {
+        asyncio.create_task(extract_result(session, rank, res))
+        for rank, res in enumerate(search_results)
+    }
+    final = []
+    try:
+        while pending and len(final) < max_results:
+            timeout = deadline_at - loop.time()
+            if timeout <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            ready = [task.result() for task in done if not task.cancelled() and task.exception() is None]
+            ready = [r for r in ready if r][:max_results - len(final)]
+            if ready:
+                final.extend(ready)
+                if on_result is not None:
+                    await on_result(_ordered(final))
+        # Either enough pages, or every candidate was tried before the deadline
+        complete = len(final) >= max_results or not pending
+    finally:
+        # Cancel stragglers: the answer is already complete or out of time
+        for task in pending:
+            task.cancel()
+    return _ordered(final), complete
+
+
+def results_for_llm(results: list):
+    """Only the fields the model needs; the dispatcher renders and trims them to OUTPUT_BUDGET."""
     if not results:
         return "No relevant search results found."
-    text = "SEARCH RESULTS:\n\n"
-    for i, r in enumerate(results, 1):
-        text += f"[{i}] {r['title']}\n"
-        text += f"URL: {r['url']}\n"
-        text += f"CONTENT: {r['content']}\n\n"
-    return text
+    return [{'title': r['title'], 'url': r['url'], 'content': r['content']} for r in results]
 
 async def web_search(args):
+    session_id = args.get('session_id')
+
+    async def show_partial(results: list):
+        # Stream pages to the client while the remaining ones are still loading
+        await manager.send_instruction(
+            session_id=session_id,
+            instruction_type="SET",
+            function_name='web_search',
+            args={ 'results': results, 'partial': True }
+        )
+
     try:
-        results = await enhanced_search(args.get('query'), 3)
-        llm_results = format_results_for_llm(results)
-        print(llm_results)
+        results = await enhanced_search(args.get('query'), 3, on_result=show_partial)
+        llm_results = results_for_llm(results)
         await manager.send_instruction(
-            session_id=args.get('session_id'),
+            session_id=session_id,
             instruction_type="SET",
             function_name='web_search',
-            args={ 'results': results },
-            request_id="unique-request-id-123"
+            args={ 'results': results }
         )
         return llm_results
+    except BackendUnavailable as e:
+        # Fail fast so the model answers from what it knows instead of waiting for a timeout
+        print(f'DuckDuckGo unavailable: {e}')
+        return str(e)
     except Exception as e:
         print(f'Ошибка запроса: {e}')
         return f'Ошибка запроса: {e}'
\ No newline at end of file
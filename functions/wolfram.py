@@ -1,36 +1,98 @@
-import requests
+import asyncio
+import os
+import aiohttp
+from aiohttp import ClientTimeout
 from connection_manager import manager
+from governor import BackendError, BackendUnavailable, governor
+from http_pool import http_pool
+from result_cache import cached
 
 # Ваш AppID, полученный в Wolfram|Alpha Developer Portal
 APP_ID = 'LQR5EK-UL8EAEWKA2'
+# Несколько AppID через запятую: у каждого свой лимит, запросы расходятся по свободным
+APP_IDS = [key.strip() for key in os.getenv("WOLFRAM_APP_IDS", APP_ID).split(",") if key.strip()]
 
-# Базовый URL LLM API
-url = 'https://www.wolframalpha.com/api/v1/llm-api'
+# Базовый URL LLM API (переопределяется, чтобы направить бенчмарки на локальный mock)
+url = os.getenv("WOLFRAM_API_URL", 'https://www.wolframalpha.com/api/v1/llm-api')
 
-async def wolfram(args):
-    # Параметры запроса
-    params = {
-        'appid': APP_ID,  # обязательно для аутентификации :contentReference[oaicite:0]{index=0}
-        'input': args.get('query'),  # сам запрос, string :contentReference[oaicite:1]{index=1}
-        # 'maxchars': '500',    # опционально: ограничение длины ответа :contentReference[oaicite:2]{index=2}
+# Не больше стольких одновременных запросов к Wolfram
+MAX_CONCURRENCY = 4
+# Дедлайн вызова в секундах (сам запрос ограничен 10 с)
+TIMEOUT = 15
+# Сколько символов ответа отдавать модели (ответы LLM API бывают очень длинными)
+OUTPUT_BUDGET = int(os.getenv("WOLFRAM_OUTPUT_BUDGET", "2000"))
+# Сколько секунд помнить ответы на одинаковые запросы (погода и т.п. быстро устаревают)
+CACHE_TTL = float(os.getenv("WOLFRAM_CACHE_TTL", "600"))
+
+# Ответ не зависит от сессии: одновременные одинаковые запросы выполняются один раз
+SINGLE_FLIGHT = True
+
+# Лимит запросов на один AppID и предохранитель: после серии ошибок Wolfram сразу отвечает отказом
+BACKEND = governor.backend("wolfram", keys=APP_IDS, rate=1, burst=5, failure_threshold=3, reset_timeout=60)
+
+# Декларация функции для Gemini (имя берётся из имени модуля)
+DECLARATION = {
+    "description": "Это llm api Wolfram alpha. Используйте его для всего точного: как калькулятор сложных примеров (уравнений, химических уравнений и всё точное математическое), погоды, исторических фактов, праздников, всего. Например, когда У ВАС СПРАШИВАЮТ: \"Реши это квадратное уравнение\" или \"Какая погода завтра в краснодаре?\". В query пишите ЧЁТКИЕ ИНСТРУКЦИИ В ФОРМАТЕ WOLFRAM ALPHA НА АНГЛИЙСКОМ",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "query": {
+                "type": "string"
+            }
+        },
+        "required": [
+            "query"
+        ]
     }
+}
+
+
+class WolframHTTPError(Exception):
+    pass
+
+class WolframUnavailable(WolframHTTPError, BackendError):
+    """429, 5xx или отказ в доступе: проблема сервиса, а не запроса (501 — Wolfram не понял запрос)"""
+
+@cached("wolfram", ttl=CACHE_TTL)
+async def query_wolfram(query: str) -> str:
+    async with BACKEND.guard() as app_id:
+        # Параметры запроса
+        params = {
+            'appid': app_id,  # обязательно для аутентификации :contentReference[oaicite:0]{index=0}
+            'input': query,  # сам запрос, string :contentReference[oaicite:1]{index=1}
+            # 'maxchars': '500',    # опционально: ограничение длины ответа :contentReference[oaicite:2]{index=2}
+        }
+        # Общий пул соединений приложения: keep-alive и DNS-кэш между запросами
+        async with http_pool.session().get(url, params=params, timeout=ClientTimeout(total=10)) as response:
+            text = await response.text()
+        if response.status in (401, 403, 429) or (response.status >= 500 and response.status != 501):
+            raise WolframUnavailable(f'{response.status} {response.reason} — {text}')
+    if response.status >= 400:
+        raise WolframHTTPError(f'{response.status} {response.reason} — {text}')
+    return text
+
+async def wolfram(args):
     try:
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()  # бросит исключение при HTTP-ошибке
-        # Ответ возвращается в чистом текстовом виде, готовом для употребления LLM
-        print('Ответ от Wolfram|Alpha LLM API:')
-        print(response.text)
-        await manager.send_instruction(
-            session_id=args.get('session_id'),
-            instruction_type="SET",
-            function_name='wolfram',
-            args={ 'output': response.text },
-            request_id="unique-request-id-123"
-        )
-        return response.text
-    except requests.exceptions.HTTPError as errh:
-        print(f'HTTP ошибка: {errh} — {response.text}')
-        return f'HTTP ошибка: {errh} — {response.text}'
-    except requests.exceptions.RequestException as err:
-        print(f'Ошибка запроса: {err}')
-        return f'Ошибка запроса: {err}'
\ No newline at end of file
+        text = await query_wolfram(args.get('query'))
+    except BackendUnavailable as e:
+        # Быстрый отказ вместо 10-секундного таймаута: модель сразу ответит без Wolfram
+        print(f'Wolfram недоступен: {e}')
+        return str(e)
+    except WolframHTTPError as errh:
+        print(f'HTTP ошибка: {errh}')
+        return f'HTTP ошибка: {errh}'
+    except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+        reason = str(err) or type(err).__name__
+        print(f'Ошибка запроса: {reason}')
+        return f'Ошибка запроса: {reason}'
+
+    # Ответ возвращается в чистом текстовом виде, готовом для употребления LLM
+    print('Ответ от Wolfram|Alpha LLM API:')
+    print(text)
+    await manager.send_instruction(
+        session_id=args.get('session_id'),
+        instruction_type="SET",
+        function_name='wolfram',
+        args={ 'output': text }
+    )
+    return text
@@ -0,0 +1,253 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional, Sequence
+import aiohttp
+from metrics import BACKEND_CALLS, BACKEND_REJECTED
+
+logger = logging.getLogger("governor")
+
+# Переопределение лимитов бэкендов без правки модулей функций, JSON:
+# {"wolfram": {"rate": 1, "burst": 3, "failure_threshold": 3, "reset_timeout": 60}}
+GOVERNOR_LIMITS = os.getenv("GOVERNOR_LIMITS", "")
+# Сколько секунд вызов может ждать свободного токена, прежде чем получить отказ
+GOVERNOR_MAX_WAIT = float(os.getenv("GOVERNOR_MAX_WAIT", "1.0"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class BackendError(Exception):
+    """Сбой на стороне внешнего сервиса (5xx, 429, капча): считается ошибкой для предохранителя"""
+
+
+class BackendUnavailable(Exception):
+    """
+    Вызов отклонён без обращения к сервису: предохранитель разомкнут или исчерпан лимит
+
+    Текст исключения предназначен модели: функции возвращают его как результат,
+    чтобы модель сразу ответила без этого источника, а не ждала таймаута.
+    """
+
+    def __init__(self, backend: str, reason: str, retry_after: float):
+        self.backend = backend
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(
+            f"Сервис {backend} временно недоступен ({reason}). Не вызывайте его повторно раньше чем через "
+            f"{max(1, round(retry_after))} с — ответьте пользователю без него или используйте другой источник."
+        )
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не больше burst про запас"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self) -> float:
+        """Через сколько секунд освободится токен для нового вызова (0 — сейчас)"""
+        self._refill(time.monotonic())
+        # Токены могут уйти в минус: это уже зарезервированные ожидающими вызовы
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def reserve(self) -> float:
+        """Занимает токен и возвращает, сколько секунд ждать до его появления"""
+        wait = self.wait_time()
+        self.tokens -= 1
+        return wait
+
+
+class CircuitBreaker:
+    """
+    Предохранитель: после failure_threshold ошибок подряд размыкается на reset_timeout секунд
+
+    Затем переходит в half_open и пропускает не больше half_open_max пробных вызовов:
+    успех замыкает его, ошибка снова размыкает.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float, half_open_max: int):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max = half_open_max
+        self._state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+        self.last_error: Optional[str] = None
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self.probes = 0
+        return self._state
+
+    def retry_after(self) -> float:
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def allow(self) -> bool:
+        """Можно ли выполнить вызов; в half_open занимает слот пробного вызова"""
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and self.probes < self.half_open_max:
+            self.probes += 1
+            return True
+        return False
+
+    def release(self):
+        # Вызов не состоялся или отменён — результат ничего не говорит о сервисе
+        if self._state == HALF_OPEN and self.probes:
+            self.probes -= 1
+
+    def record_success(self):
+        self._state = CLOSED
+        self.failures = 0
+        self.probes = 0
+
+    def record_failure(self, error: BaseException):
+        self.failures += 1
+        self.last_error = str(error) or type(error).__name__
+        if self._state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self._state = OPEN
+            self.opened_at = time.monotonic()
+            self.probes = 0
+
+    def reset(self):
+        self.record_success()
+        self.last_error = None
+
+
+class Backend:
+    """Внешний сервис функции: лимит на каждый ключ доступа и общий предохранитель"""
+
+    # Ошибки, которые говорят о проблеме с сервисом, а не с запросом
+    FAILURES = (BackendError, aiohttp.ClientError, asyncio.TimeoutError)
+
+    def __init__(self, name: str, keys: Sequence[str] = ("default",), rate: float = 5, burst: float = 10,
+                 failure_threshold: int = 5, reset_timeout: float = 30, half_open_max: int = 1,
+                 max_wait: float = GOVERNOR_MAX_WAIT):
+        self.name = name
+        self.keys = list(keys) or ["default"]
+        self.buckets: Dict[str, TokenBucket] = {key: TokenBucket(rate, burst) for key in self.keys}
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout, half_open_max)
+        self.max_wait = max_wait
+        self.calls = 0
+        self.rejected = {"open": 0, "rate": 0}
+
+    def _reject(self, reason: str, retry_after: float):
+        self.rejected[reason] += 1
+        BACKEND_REJECTED.inc(self.name, reason)
+        raise BackendUnavailable(
+            self.name,
+            "слишком много ошибок подряд" if reason == "open" else "превышен лимит запросов",
+            retry_after,
+        )
+
+    async def _acquire(self) -> str:
+        # Ключ, токен которого освободится раньше всех (у свободных — сразу)
+        key = min(self.keys, key=lambda k: self.buckets[k].wait_time())
+        wait = self.buckets[key].wait_time()
+        if wait > self.max_wait:
+            self._reject("rate", wait)
+        await asyncio.sleep(self.buckets[key].reserve())
+        return key
+
+    @asynccontextmanager
+    async def guard(self) -> AsyncIterator[str]:
+        """
+        Оборачивает один запрос к сервису и отдаёт ключ доступа, с которым его делать
+
+        Сразу выбрасывает BackendUnavailable, если предохранитель разомкнут или токена
+        не дождаться за max_wait. Ошибки из FAILURES засчитываются предохранителю.
+        """
+        if not self.breaker.allow():
+            self._reject("open", self.breaker.retry_after())
+        try:
+            key = await self._acquire()
+        except BaseException:
+            self.breaker.release()
+            raise
+        self.calls += 1
+        try:
+            yield key
+        except self.FAILURES as e:
+            was_closed = self.breaker.state == CLOSED
+            self.breaker.record_failure(e)
+            BACKEND_CALLS.inc(self.name, "error")
+            if was_closed and self.breaker.state == OPEN:
+                logger.warning(f"Предохранитель {self.name} разомкнут на {self.breaker.reset_timeout:.0f} с: {str(e)}")
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+        else:
+            if self.breaker.state != CLOSED:
+                logger.info(f"Предохранитель {self.name} снова замкнут")
+            self.breaker.record_success()
+            BACKEND_CALLS.inc(self.name, "ok")
+
+    def stats(self) -> Dict[str, Any]:
+        breaker = self.breaker
+        state = breaker.state
+        return {
+            "state": state,
+            "failures": breaker.failures,
+            "retry_after": round(breaker.retry_after(), 1) if state == OPEN else 0,
+            "last_error": breaker.last_error,
+            "calls": self.calls,
+            "rejected": dict(self.rejected),
+            # Ключи доступа — секреты: показываем только начало
+            "keys": {
+                f"{key[:4]}…" if len(key) > 8 else key: round(max(bucket.tokens, 0), 2)
+                for key, bucket in self.buckets.items()
+            },
+        }
+
+
+class Governor:
+    """Реестр внешних сервисов функций агентов с их лимитами и предохранителями"""
+
+    def __init__(self, overrides: str = GOVERNOR_LIMITS):
+        self.backends: Dict[str, Backend] = {}
+        self.overrides: Dict[str, Dict[str, Any]] = {}
+        if overrides:
+            try:
+                self.overrides = json.loads(overrides)
+            except json.JSONDecodeError as e:
+                logger.error(f"Некорректный GOVERNOR_LIMITS: {str(e)}")
+
+    def backend(self, name: str, **limits) -> Backend:
+        """Возвращает сервис name (создаёт при первом обращении; GOVERNOR_LIMITS важнее limits)"""
+        backend = self.backends.get(name)
+        if backend is None:
+            # Модуль функции перезагружается при изменении файла — состояние сервиса при этом сохраняется
+            backend = self.backends[name] = Backend(name, **{**limits, **self.overrides.get(name, {})})
+        return backend
+
+    def reset(self, name: str) -> bool:
+        backend = self.backends.get(name)
+        if backend is None:
+            return False
+        backend.breaker.reset()
+        logger.info(f"Предохранитель {name} сброшен вручную")
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: backend.stats() for name, backend in self.backends.items()}
+
+
+# глобальный экземпляр
+governor = Governor()
@@ -0,0 +1,155 @@
+import os
+import re
+import time
+from typing import Dict, Optional, Union
+import aiohttp
+from lxml import etree, html as lxml_html
+
+# Сколько байт страницы читать максимум: основной текст почти всегда в начале документа
+MAX_PAGE_BYTES = int(os.getenv("HTML_MAX_PAGE_BYTES", str(512 * 1024)))
+READ_CHUNK_BYTES = 16 * 1024
+
+# Элементы, которые никогда не содержат основной текст
+_NOISE_TAGS = (
+    "script", "style", "noscript", "template", "svg", "canvas", "iframe", "form",
+    "nav", "header", "footer", "aside", "button", "select", "option",
+)
+# Классы и id служебных блоков; сравниваются целые токены, чтобы не задеть обёртки вроде has-sidebar
+_NOISE_HINTS = re.compile(
+    r"comments?|footer|sidebar|menu|nav|navbar|navigation|share|social|promo|banner|cookies?|related|adverts?",
+    re.I,
+)
+# Блоки, из которых собирается текст
+_TEXT_TAGS = {"p", "li", "h1", "h2", "h3", "h4", "pre", "blockquote", "td", "dd"}
+_MAIN_XPATH = "//article | //main | //*[@role='main'] | //*[@itemprop='articleBody']"
+_SPACES = re.compile(r"\s+")
+
+
+class Extraction:
+    """Результат извлечения основного текста страницы и время каждого шага (мс)"""
+
+    def __init__(self, text: str = "", timings: Dict[str, float] = None):
+        self.text = text
+        self.timings = timings or {}
+
+
+async def read_capped(response: aiohttp.ClientResponse, max_bytes: int = MAX_PAGE_BYTES) -> bytes:
+    """Читает тело ответа потоком, но не больше max_bytes"""
+    body = bytearray()
+    async for chunk in response.content.iter_chunked(READ_CHUNK_BYTES):
+        body += chunk
+        if len(body) >= max_bytes:
+            del body[max_bytes:]
+            break
+    return bytes(body)
+
+
+def parse_html(document: Union[bytes, str], encoding: Optional[str] = None) -> Optional[etree._Element]:
+    """Один проход lxml по документу (обрезанный по байтам HTML тоже допустим)"""
+    if not document:
+        return None
+    if isinstance(document, bytes) and encoding:
+        document = document.decode(encoding, errors="replace")
+    if isinstance(document, str):
+        # lxml не принимает str с объявлением кодировки в <?xml ...?>
+        document = document.encode("utf-8")
+        parser = lxml_html.HTMLParser(encoding="utf-8", remove_comments=True)
+    else:
+        parser = lxml_html.HTMLParser(remove_comments=True)
+    try:
+        return lxml_html.document_fromstring(document, parser=parser)
+    except (etree.ParserError, ValueError):
+        return None
+
+
+def _drop_noise(root: etree._Element):
+    for element in list(root.iter(*_NOISE_TAGS)):
+        element.drop_tree()
+    for element in root.xpath("//*[@class or @id]"):
+        tokens = f"{element.get('class', '')} {element.get('id', '')}".split()
+        if any(_NOISE_HINTS.fullmatch(token) for token in tokens) and element.tag not in ("html", "body", "article", "main"):
+            element.drop_tree()
+
+
+def _main_container(root: etree._Element) -> etree._Element:
+    candidates = root.xpath(_MAIN_XPATH)
+    if candidates:
+        return max(candidates, key=lambda el: len(el.text_content()))
+
+    # Нет семантической разметки — берём родителя с наибольшим объёмом текста в <p>
+    scores: Dict[etree._Element, int] = {}
+    for paragraph in root.iter("p"):
+        parent = paragraph.getparent()
+        if parent is not None:
+            scores[parent] = scores.get(parent, 0) + len(paragraph.text_content())
+    if scores:
+        return max(scores, key=scores.get)
+    body = root.find("body")
+    return body if body is not None else root
+
+
+def extract_main_text(document: Union[bytes, str], max_chars: int = 2000,
+                      encoding: Optional[str] = None) -> Extraction:
+    """
+    Извлекает основной текст страницы
+
+    Чистая функция без I/O, поэтому её можно выполнять в пуле процессов.
+    Сбор текста останавливается, как только набрано max_chars символов.
+
+    Args:
+        document: HTML страницы (bytes или str)
+        max_chars: Сколько символов текста нужно
+        encoding: Кодировка из заголовков ответа, если известна
+
+    Returns:
+        Extraction с текстом (обрезанным до max_chars, с '...' в конце) и временем шагов
+    """
+    timings = {}
+    started = time.perf_counter()
+    root = parse_html(document, encoding)
+    timings["parse_ms"] = (time.perf_counter() - started) * 1000
+    if root is None:
+        return Extraction("", timings)
+
+    started = time.perf_counter()
+    _drop_noise(root)
+    container = _main_container(root)
+
+    parts = []
+    collected = 0
+    for element in container.iter(*_TEXT_TAGS):
+        # Вложенные блоки (p внутри li и т.п.) уже учтены внешним блоком
+        if next(element.iterancestors(*_TEXT_TAGS), None) is not None:
+            continue
+        text = _SPACES.sub(" ", element.text_content()).strip()
+        if not text:
+            continue
+        parts.append(text)
+        collected += len(text) + 1
+        if collected > max_chars:
+            break
+    if not parts:
+        text = _SPACES.sub(" ", container.text_content()).strip()
+    else:
+        text = " ".join(parts)
+    timings["extract_ms"] = (time.perf_counter() - started) * 1000
+
+    if len(text) > max_chars:
+        text = text[:max_chars] + "..."
+    return Extraction(text, timings)
+
+
+def text_of(element: Optional[etree._Element]) -> str:
+    return _SPACES.sub(" ", element.text_content()).strip() if element is not None else ""
+
+
+def select_class(element: etree._Element, class_name: str, tag: str = "*") -> list:
+    """Аналог CSS-селектора tag.class_name на XPath (без зависимости от cssselect)"""
+    return element.xpath(
+        f".//{tag}[contains(concat(' ', normalize-space(@class), ' '), ' {class_name} ')]"
+    )
+
+
+def first_class(element: etree._Element, class_name: str, tag: str = "*") -> Optional[etree._Element]:
+    found = select_class(element, class_name, tag)
+    return found[0] if found else None
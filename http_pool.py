@@ -0,0 +1,95 @@
+import logging
+import os
+from typing import Any, Dict, Optional
+import aiohttp
+
+logger = logging.getLogger("http_pool")
+
+# Общий лимит соединений и лимит на один хост
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "10"))
+# Сколько секунд держать DNS-ответы в кэше коннектора
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))
+# Сколько секунд держать простаивающее keep-alive соединение
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "30"))
+
+
+class HttpPool:
+    """
+    Общий на всё приложение aiohttp.ClientSession для функций агентов
+
+    Соединения (TCP/TLS), keep-alive и DNS-кэш переиспользуются между вызовами
+    и сессиями пользователей. Запускается и закрывается в lifespan FastAPI.
+    """
+
+    def __init__(
+        self,
+        limit: int = HTTP_POOL_LIMIT,
+        limit_per_host: int = HTTP_POOL_LIMIT_PER_HOST,
+        dns_cache_ttl: int = HTTP_DNS_CACHE_TTL,
+        keepalive_timeout: float = HTTP_KEEPALIVE_TIMEOUT,
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.requests = 0
+
+    async def start(self):
+        self.session()
+
+    def session(self) -> aiohttp.ClientSession:
+        """Возвращает общую сессию (создаёт её при первом обращении; нужен запущенный event loop)"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_cache_ttl,
+                use_dns_cache=True,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                trace_configs=[self._trace_config()],
+            )
+            logger.info("HTTP пул запущен")
+        return self._session
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, context, params):
+            self.requests += 1
+
+        trace_config.on_request_start.append(on_request_start)
+        return trace_config
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info("HTTP пул остановлен")
+        self._session = None
+
+    def stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {
+            "started": self._session is not None and not self._session.closed,
+            "limit": self.limit,
+            "limit_per_host": self.limit_per_host,
+            "requests": self.requests,
+        }
+        if stats["started"]:
+            connector = self._session.connector
+            # aiohttp не даёт публичного API для этих счётчиков
+            acquired_per_host = getattr(connector, "_acquired_per_host", {})
+            idle = getattr(connector, "_conns", {})
+            stats["in_use"] = len(getattr(connector, "_acquired", ()))
+            stats["idle"] = sum(len(conns) for conns in idle.values())
+            stats["hosts"] = {
+                f"{key.host}:{key.port}": len(conns) for key, conns in acquired_per_host.items() if conns
+            }
+        return stats
+
+
+# глобальный экземпляр
+http_pool = HttpPool()
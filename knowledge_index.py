@@ -0,0 +1,207 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from whoosh import highlight, index, scoring
+from whoosh.analysis import LanguageAnalyzer
+from whoosh.fields import ID, TEXT, Schema
+from whoosh.qparser import MultifieldParser, OrGroup
+
+logger = logging.getLogger("knowledge_index")
+
+BASE_DIR = os.path.dirname(__file__)
+INDEX_DIR = os.getenv("KNOWLEDGE_INDEX_DIR", os.path.join(BASE_DIR, "indexdir"))
+DOCUMENTS_PATH = os.getenv("KNOWLEDGE_DOCUMENTS", os.path.join(BASE_DIR, "data", "documents.json"))
+# Как часто (в секундах) проверять mtime documents.json; < 0 — никогда
+SYNC_CHECK_INTERVAL = float(os.getenv("KNOWLEDGE_SYNC_INTERVAL", "5"))
+SNIPPET_CHARS = 300
+
+# Русский стеммер (Snowball): «пользователь» находит «пользователе»; латиница индексируется как есть
+ANALYZER = LanguageAnalyzer("ru")
+
+SCHEMA = Schema(
+    id=ID(stored=True, unique=True),
+    title=TEXT(stored=True, analyzer=ANALYZER),
+    content=TEXT(stored=True, analyzer=ANALYZER),
+)
+
+
+def _same_schema(schema: Schema, expected: Schema) -> bool:
+    # Schema.__eq__ не сравнивает анализаторы полей
+    return schema == expected and all(
+        getattr(schema[name], "analyzer", None) == getattr(expected[name], "analyzer", None)
+        for name in expected.names()
+    )
+
+
+class _PlainFormatter(highlight.Formatter):
+    """Фрагменты без разметки: модель читает snippet как обычный текст"""
+
+    between = " … "
+
+    def format_token(self, text, token, replace=False):
+        return highlight.get_text(text, token, replace)
+
+
+class KnowledgeIndex:
+    """
+    Полнотекстовый поиск (BM25F, Whoosh) по локальной базе документов
+
+    Индекс открывается один раз, searcher кэшируется и обновляется только после
+    переиндексации. Когда меняется documents.json, в индекс записываются лишь
+    добавленные, изменённые и удалённые документы.
+    """
+
+    def __init__(
+        self,
+        index_dir: str = INDEX_DIR,
+        documents_path: str = DOCUMENTS_PATH,
+        check_interval: float = SYNC_CHECK_INTERVAL,
+    ):
+        self.index_dir = index_dir
+        self.documents_path = documents_path
+        self.check_interval = check_interval
+        self._index = None
+        self._searcher = None
+        self._parser = None
+        self._documents_mtime: Optional[float] = None
+        # Хэши проиндексированных документов: повторные синхронизации не читают индекс
+        self._digests: Optional[Dict[str, int]] = None
+        self._checked_at = 0.0
+        # Searcher Whoosh не потокобезопасен, а поиск выполняется в пуле потоков
+        self._lock = threading.Lock()
+
+    def open(self):
+        with self._lock:
+            self._open()
+            self._sync()
+
+    def _open(self):
+        if self._index is not None:
+            return
+        if index.exists_in(self.index_dir):
+            self._index = index.open_dir(self.index_dir)
+        if self._index is not None and not _same_schema(self._index.schema, SCHEMA):
+            # Индекс собран с другой схемой (например, без стемминга) — пересобираем с нуля
+            logger.info(f"Схема индекса {self.index_dir} устарела, индекс будет пересобран")
+            self._index.close()
+            self._index = index.create_in(self.index_dir, SCHEMA)
+        elif self._index is None:
+            os.makedirs(self.index_dir, exist_ok=True)
+            self._index = index.create_in(self.index_dir, SCHEMA)
+        self._parser = MultifieldParser(["title", "content"], self._index.schema, group=OrGroup.factory(0.9))
+        self._searcher = self._index.searcher(weighting=scoring.BM25F())
+
+    def load_documents(self) -> List[Dict[str, Any]]:
+        if not os.path.exists(self.documents_path):
+            return []
+        with open(self.documents_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _sync(self):
+        """Переиндексирует изменившиеся документы, если изменился documents.json"""
+        self._checked_at = time.monotonic()
+        try:
+            mtime = os.stat(self.documents_path).st_mtime
+        except FileNotFoundError:
+            return
+        if mtime == self._documents_mtime:
+            return
+
+        documents = {
+            str(doc["id"]): {"title": doc.get("title", ""), "content": doc.get("content", "")}
+            for doc in self.load_documents()
+        }
+        digests = {doc_id: hash((doc["title"], doc["content"])) for doc_id, doc in documents.items()}
+        if self._digests is None:
+            self._digests = {
+                fields["id"]: hash((fields.get("title", ""), fields.get("content", "")))
+                for fields in self._searcher.all_stored_fields()
+            }
+
+        changed = [doc_id for doc_id, digest in digests.items() if self._digests.get(doc_id) != digest]
+        removed = [doc_id for doc_id in self._digests if doc_id not in digests]
+
+        if changed or removed:
+            # Больше памяти под буфер — меньше сегментов при массовой индексации
+            writer = self._index.writer(limitmb=256)
+            for doc_id in removed:
+                writer.delete_by_term("id", doc_id)
+            for doc_id in changed:
+                writer.update_document(id=doc_id, **documents[doc_id])
+            writer.commit()
+            self._searcher = self._searcher.refresh()
+            logger.info(f"Индекс обновлён: изменено {len(changed)}, удалено {len(removed)}")
+        self._digests = digests
+        self._documents_mtime = mtime
+
+    @property
+    def version(self) -> Optional[float]:
+        """Версия базы документов (mtime проиндексированного documents.json)"""
+        return self._documents_mtime
+
+    def refresh(self) -> Optional[float]:
+        """
+        Синхронизирует индекс с documents.json (не чаще check_interval) и возвращает версию
+
+        Синхронный метод (вызывайте через пул потоков из async-кода).
+        """
+        with self._lock:
+            self._open()
+            self._maybe_sync()
+            return self._documents_mtime
+
+    def _maybe_sync(self):
+        if self.check_interval < 0:
+            return
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            self._sync()
+
+    def search(self, query: str, limit: int = 3) -> List[Dict[str, Any]]:
+        """
+        Ищет документы по запросу
+
+        Синхронный метод (вызывайте через пул потоков из async-кода).
+
+        Returns:
+            Список словарей id, title, score, snippet — лучшие limit документов
+        """
+        if not query or not query.strip():
+            return []
+        with self._lock:
+            self._open()
+            self._maybe_sync()
+            parsed = self._parser.parse(query)
+            hits = self._searcher.search(parsed, limit=limit)
+            hits.fragmenter = highlight.ContextFragmenter(maxchars=SNIPPET_CHARS, surround=60)
+            hits.formatter = _PlainFormatter()
+            results = []
+            for hit in hits:
+                snippet = hit.highlights("content", top=2) or hit["content"][:SNIPPET_CHARS]
+                results.append({
+                    "id": hit["id"],
+                    "title": hit["title"],
+                    "score": round(hit.score, 3),
+                    "snippet": snippet,
+                })
+            return results
+
+    def get(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._open()
+            return self._searcher.document(id=str(doc_id))
+
+    def close(self):
+        with self._lock:
+            if self._searcher is not None:
+                self._searcher.close()
+            self._searcher = None
+            self._index = None
+            self._digests = None
+            self._documents_mtime = None
+
+
+# глобальный экземпляр
+knowledge_index = KnowledgeIndex()
@@ -0,0 +1,359 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Any, AsyncContextManager, Callable, Deque, Dict, List, Optional, Tuple
+from google.genai import types
+from websockets.exceptions import ConnectionClosed
+from connection_manager import manager
+from metrics import LIVE_RECONNECT
+
+logger = logging.getLogger("live_connection")
+
+# Сколько раз подряд пытаться переподключиться к Live API, прежде чем закрыть клиента
+RECONNECT_ATTEMPTS = int(os.getenv("LIVE_RECONNECT_ATTEMPTS", "5"))
+# Пауза перед первой повторной попыткой и максимальная пауза (секунды, растёт вдвое)
+RECONNECT_BACKOFF = float(os.getenv("LIVE_RECONNECT_BACKOFF", "0.5"))
+RECONNECT_MAX_BACKOFF = float(os.getenv("LIVE_RECONNECT_MAX_BACKOFF", "8"))
+# Размер журнала разговора: реплик и символов (для новой сессии, если возобновить старую нельзя)
+JOURNAL_MAX_ENTRIES = int(os.getenv("LIVE_JOURNAL_ENTRIES", "40"))
+JOURNAL_MAX_CHARS = int(os.getenv("LIVE_JOURNAL_CHARS", "6000"))
+# Сколько последних отправленных в модель не-аудио сообщений хранить для повторной отправки после возобновления
+REPLAY_BUFFER_SIZE = 32
+# Сколько ответов на выполненные вызовы функций помнить для повторных вызовов
+TOOL_RESULTS_KEPT = 64
+
+# Ошибки транспорта, после которых имеет смысл переподключиться
+RECONNECTABLE_ERRORS = (ConnectionClosed, OSError, asyncio.IncompleteReadError)
+
+OpenSession = Callable[[Optional[str]], AsyncContextManager[Any]]
+
+
+def _text_of(content: Any) -> str:
+    """Текст из turns в формате dict или types.Content"""
+    if isinstance(content, list):
+        return "\n".join(filter(None, (_text_of(item) for item in content)))
+    if isinstance(content, dict):
+        parts = content.get("parts") or []
+        return " ".join(part.get("text", "") for part in parts if isinstance(part, dict)).strip()
+    parts = getattr(content, "parts", None) or []
+    return " ".join(getattr(part, "text", None) or "" for part in parts).strip()
+
+
+class ConversationJournal:
+    """
+    Сжатый журнал разговора: реплики пользователя, текст модели и результаты функций
+
+    Нужен, когда Live-сессию не удаётся возобновить по handle: новая сессия получает
+    журнал одним сообщением как контекст. Хранит только последние записи в пределах
+    max_entries и max_chars.
+    """
+
+    def __init__(self, max_entries: int = JOURNAL_MAX_ENTRIES, max_chars: int = JOURNAL_MAX_CHARS):
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self._entries: Deque[Tuple[str, str]] = deque()
+        self._chars = 0
+
+    def add(self, role: str, text: str):
+        text = (text or "").strip()
+        if not text:
+            return
+        # Поток транскрипции приходит кусками — склеиваем подряд идущие записи одной роли
+        if self._entries and self._entries[-1][0] == role and role != "tool":
+            previous = self._entries.pop()[1]
+            self._chars -= len(previous)
+            text = f"{previous} {text}"
+        self._entries.append((role, text))
+        self._chars += len(text)
+        while len(self._entries) > self.max_entries or (self._chars > self.max_chars and len(self._entries) > 1):
+            self._chars -= len(self._entries.popleft()[1])
+
+    def add_tool_result(self, name: str, args: Dict[str, Any], response: Any, limit: int = 500):
+        args = {k: v for k, v in (args or {}).items() if k != "session_id"}
+        result = json.dumps(response, ensure_ascii=False, default=str)
+        if len(result) > limit:
+            result = result[:limit] + "..."
+        self.add("tool", f"{name}({json.dumps(args, ensure_ascii=False, default=str)}) -> {result}")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def awaiting_answer(self) -> bool:
+        return bool(self._entries) and self._entries[-1][0] == "user"
+
+    def to_content(self) -> Optional[types.Content]:
+        if not self._entries:
+            return None
+        labels = {"user": "Пользователь", "model": "Ассистент", "tool": "Функция"}
+        lines = [f"{labels.get(role, role)}: {text}" for role, text in self._entries]
+        text = (
+            "Соединение было восстановлено. Продолжай разговор с учётом его предыдущей части "
+            "и не отвечай на это сообщение отдельно:\n" + "\n".join(lines)
+        )
+        return types.Content(role="user", parts=[types.Part(text=text)])
+
+
+class LiveConnection:
+    """
+    Live-сессия, которая переживает обрыв соединения с Gemini
+
+    Повторяет интерфейс AsyncSession (send_client_content, send_realtime_input,
+    send_tool_response, receive), поэтому LivePump и цикл хода работают с ней как
+    с обычной сессией. При обрыве переподключается с экспоненциальной паузой:
+    сначала по последнему handle возобновления (тогда заново отправляются сообщения,
+    которые сервер не успел принять), иначе открывает новую сессию и передаёт ей
+    журнал разговора. WebSocket клиента всё это время остаётся открытым.
+
+    Вызовы функций идемпотентны: уже выполненный вызов, повторённый моделью после
+    возобновления, получает сохранённый ответ, а выполняющийся не запускается второй раз.
+    Ответы на вызовы прошлой (не возобновлённой) сессии новой не отправляются — они
+    уже попали в журнал.
+    """
+
+    def __init__(
+        self,
+        session_id: str,
+        open_session: OpenSession,
+        attempts: int = RECONNECT_ATTEMPTS,
+        backoff: float = RECONNECT_BACKOFF,
+        max_backoff: float = RECONNECT_MAX_BACKOFF,
+    ):
+        self.session_id = session_id
+        self.open_session = open_session
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.journal = ConversationJournal()
+        self._context: Optional[AsyncContextManager[Any]] = None
+        self._session: Any = None
+        # Меняется при каждом переподключении
+        self._epoch = 0
+        # Меняется, только когда открыта новая сессия без возобновления
+        self._lineage = 0
+        self._lock = asyncio.Lock()
+        self._failed: Optional[BaseException] = None
+        self._handle: Optional[str] = None
+        self._go_away = False
+        # Номер последнего отправленного сообщения и буфер не-аудио сообщений,
+        # отправленных после последнего handle (для повтора после возобновления)
+        self._sent_index = 0
+        self._replay: Deque[Tuple[int, str, Dict[str, Any]]] = deque(maxlen=REPLAY_BUFFER_SIZE)
+        self._last_consumed = 0
+        # id вызова -> (имя, аргументы, lineage) для выполняющихся и id -> ответ для выполненных
+        self._calls: Dict[str, Tuple[str, Dict[str, Any], int]] = {}
+        self._tool_results: "OrderedDict[str, types.FunctionResponse]" = OrderedDict()
+        # id вызова -> epoch, в котором ответ последний раз ушёл в модель
+        self._answered_in: Dict[str, int] = {}
+        self.reconnects = 0
+
+    async def __aenter__(self) -> "LiveConnection":
+        await self._open(None)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._close_current()
+
+    async def _open(self, handle: Optional[str]):
+        context = self.open_session(handle)
+        self._session = await context.__aenter__()
+        self._context = context
+
+    async def _close_current(self):
+        context, self._context, self._session = self._context, None, None
+        if context is not None:
+            try:
+                await context.__aexit__(None, None, None)
+            except Exception:
+                pass  # соединение уже мертво
+
+    async def _reconnect(self, epoch: int, error: BaseException):
+        async with self._lock:
+            if self._failed is not None:
+                raise self._failed
+            if epoch != self._epoch:
+                return  # другая задача уже переподключилась
+            started = time.perf_counter()
+            logger.warning(f"[{self.session_id}] соединение с Live API потеряно ({error!r}), переподключаемся")
+            await manager.send_instruction(self.session_id, "RECONNECTING", "live")
+            await self._close_current()
+
+            delay = self.backoff
+            for attempt in range(1, self.attempts + 1):
+                handle = self._handle
+                try:
+                    await self._open(handle)
+                    if handle is not None:
+                        await self._replay_unconsumed()
+                    else:
+                        await self._restore_from_journal()
+                    break
+                except Exception as e:
+                    await self._close_current()
+                    if handle is not None:
+                        # handle мог устареть — следующая попытка откроет новую сессию с журналом
+                        logger.warning(f"[{self.session_id}] не удалось возобновить сессию: {str(e)}")
+                        self._handle = None
+                    if attempt == self.attempts:
+                        self._failed = error
+                        raise error
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.max_backoff)
+
+            self._epoch += 1
+            self._go_away = False
+            self.reconnects += 1
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            manager.incr(self.session_id, "live_reconnects")
+            manager.incr(self.session_id, "live_reconnect_ms", int(elapsed_ms))
+            LIVE_RECONNECT.observe(elapsed_ms / 1000, "resume" if self._handle else "journal")
+            logger.info(f"[{self.session_id}] Live API переподключён за {elapsed_ms:.0f} мс "
+                        f"({'возобновление' if self._handle else 'новая сессия + журнал'})")
+            await manager.send_instruction(self.session_id, "RECONNECTED", "live")
+
+    async def _replay_unconsumed(self):
+        # В буфере только сообщения, отправленные после последнего handle — их сессия не видела
+        for index, kind, kwargs in list(self._replay):
+            if index > self._last_consumed:
+                await getattr(self._session, kind)(**kwargs)
+                self._mark_answered(kind, kwargs, self._epoch + 1)
+
+    async def _restore_from_journal(self):
+        self._lineage += 1
+        self._replay.clear()
+        self._sent_index = self._last_consumed = 0
+        content = self.journal.to_content()
+        if content is not None:
+            # Если обрыв случился до ответа на последнюю реплику пользователя — просим ответить
+            await self._session.send_client_content(turns=content, turn_complete=self.journal.awaiting_answer)
+
+    def _current_responses(self, responses: List[types.FunctionResponse]) -> List[types.FunctionResponse]:
+        return [r for r in responses if self._calls.get(r.id, (None, None, self._lineage))[2] == self._lineage]
+
+    async def _call(self, kind: str, replay: bool, **kwargs):
+        """Отправляет сообщение в текущую сессию, переподключаясь при обрыве"""
+        while True:
+            if kind == "send_tool_response":
+                kwargs["function_responses"] = self._current_responses(kwargs["function_responses"])
+                if not kwargs["function_responses"]:
+                    return
+            epoch = self._epoch
+            session = self._session
+            try:
+                if session is None:
+                    raise ConnectionError("Live-сессия закрыта")
+                await getattr(session, kind)(**kwargs)
+            except RECONNECTABLE_ERRORS + (ConnectionError,) as e:
+                await self._reconnect(epoch, e)
+                continue
+            self._sent_index += 1
+            self._mark_answered(kind, kwargs, self._epoch)
+            if replay:
+                self._replay.append((self._sent_index, kind, kwargs))
+            return
+
+    def _mark_answered(self, kind: str, kwargs: Dict[str, Any], epoch: int):
+        if kind == "send_tool_response":
+            for response in kwargs["function_responses"]:
+                self._answered_in[response.id] = epoch
+
+    async def send_client_content(self, turns=None, turn_complete: bool = True):
+        await self._call("send_client_content", True, turns=turns, turn_complete=turn_complete)
+        # В журнал — после отправки: реплика, потерянная при обрыве, будет отправлена заново
+        self.journal.add("user", _text_of(turns))
+
+    async def send_realtime_input(self, **kwargs):
+        # Аудио не повторяем: после обрыва важнее живой поток, чем старые кадры
+        await self._call("send_realtime_input", False, **kwargs)
+
+    async def send_tool_response(self, function_responses=None):
+        responses = list(function_responses or [])
+        for response in responses:
+            self._tool_results[response.id] = response
+            while len(self._tool_results) > TOOL_RESULTS_KEPT:
+                evicted, _ = self._tool_results.popitem(last=False)
+                self._answered_in.pop(evicted, None)
+            name, args, _ = self._calls.get(response.id, (response.name, {}, self._lineage))
+            self.journal.add_tool_result(name, args, response.response)
+        await self._call("send_tool_response", True, function_responses=responses)
+        for response in responses:
+            self._calls.pop(response.id, None)
+
+    async def receive(self):
+        while True:
+            epoch, lineage = self._epoch, self._lineage
+            try:
+                if self._session is None:
+                    raise ConnectionError("Live-сессия закрыта")
+                async for message in self._session.receive():
+                    message = await self._observe(message)
+                    if message is not None:
+                        yield message
+            except RECONNECTABLE_ERRORS + (ConnectionError,) as e:
+                await self._reconnect(epoch, e)
+                if self._lineage != lineage and not self.journal.awaiting_answer:
+                    # Новая сессия не продолжит прерванный ход — завершаем его для вызывающего
+                    return
+                continue
+            if self._go_away:
+                # Сервер предупредил о закрытии — переподключаемся между ходами, не дожидаясь обрыва
+                await self._reconnect(epoch, ConnectionError("go_away"))
+            return
+
+    async def _observe(self, message: Any) -> Any:
+        """Обновляет handle, журнал и вызовы функций; None — сообщение не нужно передавать дальше"""
+        update = getattr(message, "session_resumption_update", None)
+        if update is not None and update.resumable and update.new_handle:
+            self._handle = update.new_handle
+            # Индекс сервер присылает только в transparent-режиме (его нет в Gemini API);
+            # без него считаем, что новый handle уже включает всё отправленное до него
+            index = update.last_consumed_client_message_index
+            self._last_consumed = index if index is not None else self._sent_index
+            while self._replay and self._replay[0][0] <= self._last_consumed:
+                self._replay.popleft()
+
+        if getattr(message, "go_away", None) is not None:
+            self._go_away = True
+
+        server_content = getattr(message, "server_content", None)
+        if server_content is not None:
+            for role, field in (("user", "input_transcription"), ("model", "output_transcription")):
+                transcription = getattr(server_content, field, None)
+                if transcription is not None:
+                    self.journal.add(role, transcription.text)
+            model_turn = getattr(server_content, "model_turn", None)
+            if model_turn is not None:
+                self.journal.add("model", _text_of(model_turn))
+
+        cancellation = getattr(message, "tool_call_cancellation", None)
+        if cancellation is not None:
+            # На отменённые моделью вызовы ответа не будет — забываем их
+            for call_id in cancellation.ids or []:
+                self._calls.pop(call_id, None)
+
+        tool_call = getattr(message, "tool_call", None)
+        if tool_call is None or not tool_call.function_calls:
+            return message
+
+        fresh, replayed = [], []
+        for fc in tool_call.function_calls:
+            if fc.id in self._tool_results and self._answered_in.get(fc.id) == self._epoch:
+                manager.incr(self.session_id, "tool_calls_deduplicated")
+            elif fc.id in self._tool_results:
+                # Модель повторила уже выполненный вызов (например, после возобновления)
+                replayed.append(self._tool_results[fc.id])
+                manager.incr(self.session_id, "tool_calls_replayed")
+            elif fc.id in self._calls:
+                manager.incr(self.session_id, "tool_calls_deduplicated")
+            else:
+                self._calls[fc.id] = (fc.name, dict(fc.args or {}), self._lineage)
+                fresh.append(fc)
+        if replayed:
+            await self._call("send_tool_response", True, function_responses=replayed)
+        if not fresh:
+            return None
+        tool_call.function_calls = fresh
+        return message
@@ -0,0 +1,300 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncContextManager, AsyncIterator, Callable, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger("live_pool")
+
+# Сколько открытых (тёплых) Live-сессий держать на одну конфигурацию (0 — пул выключен)
+LIVE_POOL_SIZE = int(os.getenv("LIVE_POOL_SIZE", "0"))
+# Для скольких разных конфигураций (system_prompt, voice_name) держать тёплые сессии
+LIVE_POOL_MAX_KEYS = int(os.getenv("LIVE_POOL_MAX_KEYS", "4"))
+# Тёплая сессия закрывается, если её никто не взял за это время (секунды)
+LIVE_POOL_IDLE_TTL = float(os.getenv("LIVE_POOL_IDLE_TTL", "300"))
+# Как часто проверять тёплые сессии (ping) и вытеснять простаивающие
+LIVE_POOL_CHECK_INTERVAL = float(os.getenv("LIVE_POOL_CHECK_INTERVAL", "15"))
+LIVE_POOL_PING_TIMEOUT = float(os.getenv("LIVE_POOL_PING_TIMEOUT", "5"))
+# Конфигурации, которые прогреваются при старте: JSON-список [{"system_prompt": ..., "voice_name": ...}]
+LIVE_POOL_PREWARM = os.getenv("LIVE_POOL_PREWARM", "")
+
+Connect = Callable[[Hashable], AsyncContextManager[Any]]
+
+
+def _no_generation() -> Hashable:
+    return None
+
+
+class WarmSession:
+    """Открытая Live-сессия вместе с контекстным менеджером, который её закроет"""
+
+    def __init__(self, key: Hashable, context: AsyncContextManager[Any], session: Any, generation: Hashable = None):
+        self.key = key
+        self.generation = generation
+        self.context = context
+        self.session = session
+        self.created_at = time.monotonic()
+
+    async def close(self):
+        try:
+            await self.context.__aexit__(None, None, None)
+        except Exception as e:
+            logger.warning(f"Ошибка при закрытии Live-сессии: {str(e)}")
+
+    async def ping(self, timeout: float) -> bool:
+        # У AsyncSession google-genai нет публичного health check — пингуем её WebSocket
+        ws = getattr(self.session, "_ws", None)
+        if ws is None or not hasattr(ws, "ping"):
+            return True
+        try:
+            pong = await ws.ping()
+            await asyncio.wait_for(pong, timeout)
+            return True
+        except Exception:
+            return False
+
+
+class LiveSessionPool:
+    """
+    Пул заранее открытых Live-сессий Gemini
+
+    Клиент с уже встречавшейся конфигурацией сразу получает открытую сессию, а пул
+    в фоне открывает ей замену. Сессии не переиспользуются: после клиента она
+    закрывается, потому что хранит историю разговора. Фоновая задача пингует
+    тёплые сессии, закрывает упавшие и простаивавшие дольше idle_ttl, а конфигурации,
+    которые никто не запрашивал дольше idle_ttl, перестаёт прогревать.
+
+    generation() — версия всего, что входит в конфиг помимо ключа (например, набора
+    функций); сессии, открытые со старой версией, клиентам не выдаются.
+    """
+
+    def __init__(
+        self,
+        connect: Connect,
+        generation: Callable[[], Hashable] = _no_generation,
+        size: int = LIVE_POOL_SIZE,
+        max_keys: int = LIVE_POOL_MAX_KEYS,
+        idle_ttl: float = LIVE_POOL_IDLE_TTL,
+        check_interval: float = LIVE_POOL_CHECK_INTERVAL,
+        ping_timeout: float = LIVE_POOL_PING_TIMEOUT,
+    ):
+        self.connect = connect
+        self.generation = generation
+        self.size = size
+        self.max_keys = max_keys
+        self.idle_ttl = idle_ttl
+        self.check_interval = check_interval
+        self.ping_timeout = ping_timeout
+        # key -> тёплые сессии; порядок ключей — от давно использованных к недавним
+        self._warm: "OrderedDict[Hashable, List[WarmSession]]" = OrderedDict()
+        self._opening: Dict[Hashable, int] = {}
+        # Сессии, которые сейчас проверяет _maintain (сняты с пула, но ещё могут вернуться)
+        self._checking: Dict[Hashable, int] = {}
+        self._used_at: Dict[Hashable, float] = {}
+        # Конфигурации из LIVE_POOL_PREWARM прогреваются всегда
+        self._pinned = set()
+        self._tasks = set()
+        self._maintenance: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.health_failures = 0
+        self.open_errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    async def start(self, prewarm: List[Hashable] = ()):
+        if not self.enabled:
+            return
+        for key in prewarm:
+            self._pinned.add(key)
+            self._touch(key)
+            self._refill(key)
+        self._maintenance = asyncio.create_task(self._maintain(), name="live-pool")
+
+    async def _open(self, key: Hashable) -> WarmSession:
+        generation = self.generation()
+        context = self.connect(key)
+        session = await context.__aenter__()
+        return WarmSession(key, context, session, generation)
+
+    @asynccontextmanager
+    async def session(self, key: Hashable) -> AsyncIterator[Any]:
+        """Live-сессия для конфигурации key: тёплая из пула или открытая сейчас"""
+        warm = await self._take(key) if self.enabled else None
+        if warm is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            warm = await self._open(key)
+        if self.enabled:
+            self._touch(key)
+            self._refill(key)
+        try:
+            yield warm.session
+        finally:
+            await warm.close()
+
+    async def _take(self, key: Hashable) -> Optional[WarmSession]:
+        sessions = self._warm.get(key)
+        while sessions:
+            warm = sessions.pop()
+            if warm.generation != self.generation():
+                await warm.close()
+                continue
+            # Сервер мог закрыть сессию с момента последней проверки
+            if await warm.ping(self.ping_timeout):
+                return warm
+            self.health_failures += 1
+            await warm.close()
+        return None
+
+    def _touch(self, key: Hashable):
+        self._warm.setdefault(key, [])
+        self._warm.move_to_end(key)
+        self._used_at[key] = time.monotonic()
+        while len(self._warm) > self.max_keys:
+            victim = next((k for k in self._warm if k not in self._pinned), None)
+            if victim is None:
+                break
+            self._evict_key(victim)
+
+    def _evict_key(self, key: Hashable):
+        self._used_at.pop(key, None)
+        for warm in self._warm.pop(key, []):
+            self.evictions += 1
+            self._spawn(warm.close())
+
+    def _refill(self, key: Hashable):
+        missing = (self.size - len(self._warm.get(key, ())) - self._opening.get(key, 0)
+                   - self._checking.get(key, 0))
+        for _ in range(max(0, missing)):
+            self._opening[key] = self._opening.get(key, 0) + 1
+            self._spawn(self._prewarm(key))
+
+    async def _prewarm(self, key: Hashable):
+        try:
+            warm = await self._open(key)
+        except Exception as e:
+            self.open_errors += 1
+            logger.warning(f"Не удалось прогреть Live-сессию: {str(e)}")
+            return
+        finally:
+            self._opening[key] -= 1
+            if not self._opening[key]:
+                del self._opening[key]
+        if key in self._warm and len(self._warm[key]) < self.size:
+            self._warm[key].append(warm)
+        else:
+            # Ключ вытеснили, пока сессия открывалась
+            await warm.close()
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _maintain(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            now = time.monotonic()
+            generation = self.generation()
+            for key in list(self._warm):
+                if key not in self._warm:
+                    continue  # вытеснен, пока проверялись предыдущие ключи
+                if key not in self._pinned and now - self._used_at.get(key, now) > self.idle_ttl:
+                    self._evict_key(key)
+                    continue
+                for warm in list(self._warm[key]):
+                    pool = self._warm.get(key)
+                    if pool is None or warm not in pool:
+                        continue  # уже выдана клиенту или ключ вытеснен
+                    # Снимаем сессию с пула до await: иначе _take мог бы выдать её клиенту,
+                    # а мы потом вернули бы её в пул
+                    pool.remove(warm)
+                    if await self._check(key, warm, now, generation):
+                        pool = self._warm.get(key)
+                        if pool is not None and len(pool) < self.size:
+                            pool.append(warm)
+                        else:
+                            self.evictions += 1
+                            await warm.close()
+                if key in self._warm:
+                    self._refill(key)
+
+    async def _check(self, key: Hashable, warm: WarmSession, now: float, generation: Hashable) -> bool:
+        """Проверяет снятую с пула сессию; False — сессия закрыта"""
+        self._checking[key] = self._checking.get(key, 0) + 1
+        try:
+            if now - warm.created_at > self.idle_ttl or warm.generation != generation:
+                self.evictions += 1
+            elif await warm.ping(self.ping_timeout):
+                return True
+            else:
+                self.health_failures += 1
+        except BaseException:
+            # Пул закрывается — закрыть сессию уже некому
+            self._spawn(warm.close())
+            raise
+        finally:
+            self._checking[key] -= 1
+            if not self._checking[key]:
+                del self._checking[key]
+        await warm.close()
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "size": self.size,
+            "warm": sum(len(sessions) for sessions in self._warm.values()),
+            "opening": sum(self._opening.values()),
+            "keys": len(self._warm),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "health_failures": self.health_failures,
+            "open_errors": self.open_errors,
+        }
+
+    async def close(self):
+        if self._maintenance is not None:
+            self._maintenance.cancel()
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, *(t for t in [self._maintenance] if t), return_exceptions=True)
+        self._maintenance = None
+        warm, self._warm = [w for sessions in self._warm.values() for w in sessions], OrderedDict()
+        await asyncio.gather(*(w.close() for w in warm), return_exceptions=True)
+
+
+def prewarm_configs(raw: str = LIVE_POOL_PREWARM) -> List[Tuple[str, str]]:
+    """
+    Ключи (system_prompt, voice_name) из LIVE_POOL_PREWARM
+
+    Поля обязательны, как в SessionConfig клиента: записи без строковых system_prompt
+    и voice_name пропускаются с ошибкой в логе, чтобы не уронить старт сервера.
+    """
+    if not raw:
+        return []
+    try:
+        entries = json.loads(raw)
+    except json.JSONDecodeError as e:
+        logger.error(f"Некорректный LIVE_POOL_PREWARM: {str(e)}")
+        return []
+    if not isinstance(entries, list):
+        logger.error("Некорректный LIVE_POOL_PREWARM: ожидается JSON-список конфигураций")
+        return []
+    keys = []
+    for index, entry in enumerate(entries):
+        if (not isinstance(entry, dict) or not isinstance(entry.get("system_prompt"), str)
+                or not isinstance(entry.get("voice_name"), str)):
+            logger.error(f"LIVE_POOL_PREWARM[{index}] пропущена: нужны строковые system_prompt и voice_name")
+            continue
+        keys.append((entry["system_prompt"], entry["voice_name"]))
+    return keys
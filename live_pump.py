@@ -0,0 +1,215 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Optional
+from fastapi import WebSocket
+from google.genai import types
+from audio_input import AudioFramer, AUDIO_MIME_TYPE
+from connection_manager import manager
+from metrics import AUDIO_BYTES_RECEIVED, AUDIO_BYTES_SENT, TIME_TO_FIRST_AUDIO, TURNS
+from tool_scheduler import ToolScheduler
+
+logger = logging.getLogger("live_pump")
+
+# Размеры очередей между задачами (ограничены, чтобы медленная сторона создавала backpressure)
+UPSTREAM_QUEUE_SIZE = int(os.getenv("LIVE_UPSTREAM_QUEUE", "32"))
+DOWNSTREAM_QUEUE_SIZE = int(os.getenv("LIVE_DOWNSTREAM_QUEUE", "256"))
+
+
+class LivePump:
+    """
+    Полнодуплексный обмен между клиентским WebSocket и Live-сессией Gemini
+
+    Четыре независимые задачи:
+        client -> upstream queue -> model (чтение клиента и отправка в модель)
+        model -> downstream queue -> client (приём ответов модели и запись клиенту)
+
+    Поэтому новые реплики, function_response и прерывания (barge-in) от клиента
+    обрабатываются сразу, даже пока модель ещё говорит.
+
+    Бинарные сообщения клиента считаются PCM-аудио и уходят в модель как realtime input;
+    текстовые — как обычные реплики (или служебные JSON-сообщения).
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        session: Any,
+        session_id: str,
+        scheduler: ToolScheduler,
+        upstream_size: int = UPSTREAM_QUEUE_SIZE,
+        downstream_size: int = DOWNSTREAM_QUEUE_SIZE,
+    ):
+        self.websocket = websocket
+        self.session = session
+        self.session_id = session_id
+        self.scheduler = scheduler
+        self.upstream: asyncio.Queue = asyncio.Queue(maxsize=upstream_size)
+        self.downstream: asyncio.Queue = asyncio.Queue(maxsize=downstream_size)
+        self.framer = AudioFramer()
+        # Номер текущего хода: аудио от прерванных ходов, уже стоящее в очереди, отбрасывается
+        self.generation = 0
+        # Модель отвечает (или вот-вот начнёт) — до turn_complete/interrupted
+        self._turn_active = False
+        # Ход прерван клиентом: аудио модели отбрасывается до конца этого хода
+        self._discarding = False
+        # Когда закончилась последняя реплика пользователя (для времени до первого аудио)
+        self._turn_started: Optional[float] = None
+
+    async def run(self):
+        tasks = [
+            asyncio.create_task(self._read_client(), name=f"{self.session_id}:client-reader"),
+            asyncio.create_task(self._send_to_model(), name=f"{self.session_id}:model-sender"),
+            asyncio.create_task(self._receive_from_model(), name=f"{self.session_id}:model-receiver"),
+            asyncio.create_task(self._write_client(), name=f"{self.session_id}:client-writer"),
+        ]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled() and task.exception():
+                    raise task.exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def barge_in(self, notify_client: bool = False, cancel_tools: bool = False, notify_model: bool = False):
+        """
+        Прерывает текущий ход: сбрасывает ещё не отправленное клиенту аудио
+
+        Аудио, которое модель ещё досылает по прерванному ходу, отбрасывается до его
+        turn_complete/interrupted. notify_model — попросить модель остановить генерацию
+        (для прерывания клиентом; новая реплика останавливает её сама).
+        """
+        self.generation += 1
+        self._discarding = self._turn_active
+        if notify_model:
+            await self.upstream.put(("interrupt", None))
+        if cancel_tools:
+            self.scheduler.cancel_all()
+        dropped = 0
+        while not self.downstream.empty():
+            self.downstream.get_nowait()
+            dropped += 1
+        logger.info(f"[{self.session_id}] barge-in, отброшено аудио-чанков: {dropped}")
+        if notify_client:
+            await manager.send_instruction(
+                session_id=self.session_id,
+                instruction_type="INTERRUPT",
+                function_name="audio",
+            )
+
+    async def _read_client(self):
+        while True:
+            message = await self.websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+
+            audio = message.get("bytes")
+            if audio is not None:
+                manager.incr(self.session_id, "audio_bytes_received", len(audio))
+                AUDIO_BYTES_RECEIVED.inc(amount=len(audio))
+                for frame in self.framer.feed(audio):
+                    await self.upstream.put(("audio", frame))
+                continue
+
+            user_text = message.get("text")
+            if user_text is None:
+                continue
+            manager.incr(self.session_id, "messages_received")
+            if user_text.strip().lower() == "exit":
+                await self.websocket.close()
+                return
+
+            try:
+                data = json.loads(user_text)
+                if isinstance(data, dict) and data.get("type") == "function_response":
+                    await manager.handle_function_response(data, self.session_id)
+                    continue
+                if isinstance(data, dict) and data.get("type") == "interrupt":
+                    await self.barge_in(cancel_tools=True, notify_model=True)
+                    continue
+                if isinstance(data, dict) and data.get("type") == "audio_end":
+                    tail = self.framer.flush()
+                    if tail is not None:
+                        await self.upstream.put(("audio", tail))
+                    await self.upstream.put(("audio_end", None))
+                    continue
+            except json.JSONDecodeError:
+                pass  # Это не JSON — отправим как обычный текст модели
+
+            await self.upstream.put(("text", user_text))
+
+    async def _send_to_model(self):
+        while True:
+            kind, payload = await self.upstream.get()
+            if kind == "audio":
+                # Единственная копия кадра — на границе SDK, которому нужны bytes
+                await self.session.send_realtime_input(
+                    audio=types.Blob(data=bytes(payload), mime_type=AUDIO_MIME_TYPE)
+                )
+                continue
+            if kind == "audio_end":
+                await self.session.send_realtime_input(audio_stream_end=True)
+                self._start_turn()
+                continue
+            if kind == "interrupt":
+                # Любой client_content останавливает текущую генерацию; без turn_complete
+                # модель не начинает новый ответ, а ждёт следующей реплики
+                await self.session.send_client_content(turn_complete=False)
+                continue
+
+            # Новая реплика пользователя прерывает ответ модели на предыдущую
+            await self.barge_in()
+            manager.incr(self.session_id, "turns")
+            await self.session.send_client_content(
+                turns={"role": "user", "parts": [{"text": payload}]},
+                turn_complete=True
+            )
+            self._start_turn()
+
+    def _start_turn(self):
+        TURNS.inc()
+        self._turn_active = True
+        self._turn_started = time.perf_counter()
+
+    async def _receive_from_model(self):
+        while True:
+            # session.receive() завершается на turn_complete, поэтому оборачиваем в цикл
+            async for response in self.session.receive():
+                if response.data is not None:
+                    if self._discarding:
+                        manager.incr(self.session_id, "audio_chunks_discarded")
+                    else:
+                        self._turn_active = True
+                        await self.downstream.put((self.generation, response.data))
+
+                if response.tool_call:
+                    function_calls = response.tool_call.function_calls or []
+                    manager.incr(self.session_id, "function_calls", len(function_calls))
+                    self.scheduler.submit_all(function_calls)
+
+                if response.tool_call_cancellation:
+                    self.scheduler.cancel(response.tool_call_cancellation.ids or [])
+
+                server_content = getattr(response, "server_content", None)
+                if server_content is not None and server_content.interrupted:
+                    await self.barge_in(notify_client=True)
+                if server_content is not None and (server_content.interrupted or server_content.turn_complete):
+                    # Прерванный ход закончился — следующий ход играем как обычно
+                    self._turn_active = self._discarding = False
+
+    async def _write_client(self):
+        while True:
+            generation, data = await self.downstream.get()
+            if generation != self.generation:
+                continue
+            await self.websocket.send_bytes(data)
+            if self._turn_started is not None:
+                TIME_TO_FIRST_AUDIO.observe(time.perf_counter() - self._turn_started)
+                self._turn_started = None
+            manager.incr(self.session_id, "audio_chunks_sent")
+            manager.incr(self.session_id, "audio_bytes_sent", len(data))
+            AUDIO_BYTES_SENT.inc(amount=len(data))
@@ -0,0 +1,245 @@
+import asyncio
+import bisect
+import logging
+import os
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger("metrics")
+
+# Как часто (секунды) измерять задержку event loop
+LOOP_LAG_INTERVAL = float(os.getenv("METRICS_LOOP_LAG_INTERVAL", "0.5"))
+
+# Границы корзин гистограмм по умолчанию (секунды)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _labels(self, values: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.labelnames, values))
+
+    def samples(self) -> Iterable[Sample]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """
+    Монотонный счётчик (имя по соглашению Prometheus заканчивается на _total)
+
+    Изменяется только из event loop, поэтому обходится без блокировок: inc — это
+    одно сложение в словаре.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> Iterable[Sample]:
+        for labels, value in self._values.items():
+            yield self.name, self._labels(labels), value
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, *labels: str):
+        self._values[labels] = value
+
+    def samples(self) -> Iterable[Sample]:
+        for labels, value in self._values.items():
+            yield self.name, self._labels(labels), value
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными корзинами; observe — бинарный поиск и два сложения"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [счётчики корзин (последняя — +Inf), сумма]
+        self._values: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, *labels: str):
+        state = self._values.get(labels)
+        if state is None:
+            state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    def samples(self) -> Iterable[Sample]:
+        for labels, (counts, total) in self._values.items():
+            base = self._labels(labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", {**base, "le": _format_value(bound)}, cumulative
+            yield f"{self.name}_sum", base, total
+            yield f"{self.name}_count", base, cumulative
+
+
+class MetricsRegistry:
+    """
+    Метрики процесса в текстовом формате Prometheus
+
+    Горячие пути только увеличивают счётчики; всё, что можно посчитать из уже
+    существующего состояния (сессии, очереди, кэш), собирают коллекторы в момент
+    запроса /metrics.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[_Metric]]] = []
+        self._lag_task: Optional[asyncio.Task] = None
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def collector(self, func: Callable[[], Iterable[_Metric]]):
+        """Регистрирует функцию, которая при каждом запросе возвращает свежие метрики"""
+        self._collectors.append(func)
+        return func
+
+    def render(self) -> str:
+        metrics = list(self._metrics.values())
+        for collect in self._collectors:
+            try:
+                metrics.extend(collect())
+            except Exception as e:
+                logger.error(f"Ошибка коллектора метрик {collect.__name__}: {str(e)}")
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def start_loop_monitor(self, interval: float = LOOP_LAG_INTERVAL):
+        if self._lag_task is None:
+            self._lag_task = asyncio.create_task(self._monitor_loop(interval), name="loop-lag-monitor")
+
+    async def _monitor_loop(self, interval: float):
+        # Задержка = насколько позже запланированного проснулся sleep
+        while True:
+            expected = time.monotonic() + interval
+            await asyncio.sleep(interval)
+            lag = max(0.0, time.monotonic() - expected)
+            LOOP_LAG.observe(lag)
+            LOOP_LAG_LAST.set(lag)
+
+    async def stop_loop_monitor(self):
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            await asyncio.gather(self._lag_task, return_exceptions=True)
+            self._lag_task = None
+
+
+# глобальный экземпляр
+metrics = MetricsRegistry()
+
+TIME_TO_FIRST_AUDIO = metrics.histogram(
+    "sparkai_time_to_first_audio_seconds",
+    "Время от отправки реплики пользователя в модель до первого аудио-чанка клиенту",
+)
+TURNS = metrics.counter("sparkai_turns_total", "Реплики пользователя, отправленные в модель")
+AUDIO_BYTES_SENT = metrics.counter("sparkai_audio_bytes_sent_total", "Байты аудио, отправленные клиентам")
+AUDIO_BYTES_RECEIVED = metrics.counter("sparkai_audio_bytes_received_total", "Байты аудио, полученные от клиентов")
+TOOL_LATENCY = metrics.histogram(
+    "sparkai_tool_call_duration_seconds",
+    "Длительность вызова функции агента (без ожидания в очереди)",
+    ("function", "status"),
+)
+TOOL_QUEUE_WAIT = metrics.histogram(
+    "sparkai_tool_queue_wait_seconds",
+    "Время ожидания вызова функции в очереди планировщика",
+    ("function",),
+)
+LOOP_LAG = metrics.histogram(
+    "sparkai_event_loop_lag_seconds",
+    "Задержка event loop",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+LOOP_LAG_LAST = metrics.gauge("sparkai_event_loop_lag_last_seconds", "Последнее измерение задержки event loop")
+LIVE_RECONNECT = metrics.histogram(
+    "sparkai_live_reconnect_seconds",
+    "Длительность переподключения к Live API",
+    ("mode",),
+)
+TOOL_OUTPUT_SIZE = metrics.histogram(
+    "sparkai_tool_output_chars",
+    "Размер результата функции в символах: raw — как вернула функция, sent — отправлено модели",
+    ("function", "stage"),
+    buckets=(256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072),
+)
+TOOL_OUTPUT_TRIMMED = metrics.counter(
+    "sparkai_tool_output_trimmed_total",
+    "Результаты функций, сокращённые до бюджета модели",
+    ("function",),
+)
+TOOL_CALLS_COALESCED = metrics.counter(
+    "sparkai_tool_calls_coalesced_total",
+    "Вызовы функций, получившие результат уже выполнявшегося одинакового вызова",
+    ("function",),
+)
+BUS_FRAMES_DROPPED = metrics.counter(
+    "sparkai_bus_frames_dropped_total",
+    "Сообщения шины между воркерами, отброшенные из переполненной очереди, пока брокер недоступен",
+)
+BACKEND_CALLS = metrics.counter(
+    "sparkai_backend_calls_total",
+    "Запросы функций к внешним сервисам через governor",
+    ("backend", "status"),
+)
+BACKEND_REJECTED = metrics.counter(
+    "sparkai_backend_rejected_total",
+    "Запросы к внешним сервисам, отклонённые без обращения к ним (open — предохранитель, rate — лимит)",
+    ("backend", "reason"),
+)
@@ -0,0 +1,193 @@
+import json
+import math
+import os
+import re
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from metrics import TOOL_OUTPUT_SIZE, TOOL_OUTPUT_TRIMMED
+
+# Сколько символов результата функции отправлять модели по умолчанию (0 — без ограничения).
+# Модуль функции может задать свой лимит через OUTPUT_BUDGET
+OUTPUT_BUDGET = int(os.getenv("TOOL_OUTPUT_BUDGET", "4000"))
+# В каком виде отдавать модели структурированный результат: text — читаемый текст, json — компактный JSON.
+# Модуль функции может задать свой через OUTPUT_FORMAT
+OUTPUT_FORMAT = os.getenv("TOOL_OUTPUT_FORMAT", "text")
+# Строковые поля короче этого не урезаются (заголовки, ссылки)
+MIN_FIELD_CHARS = 200
+
+# Предложение: до знака конца предложения перед пробелом, до перевода строки или до конца текста
+_SENTENCE = re.compile(r".+?(?:[.!?…]+(?=\s|$)|\n|$)\s*", re.S)
+_WORD = re.compile(r"\w{3,}")
+# Пропуск между выбранными предложениями
+GAP = " … "
+
+
+def _stems(text: str) -> Iterable[str]:
+    # Грубый стемминг префиксом: «погода»/«погоды»/«погоде» совпадают без морфологии
+    return (word[:5] for word in _WORD.findall(text.lower()))
+
+
+def query_terms(args: Dict[str, Any]) -> Set[str]:
+    """Термины запроса: все строковые аргументы вызова, кроме служебных"""
+    return set(_stems(" ".join(str(v) for k, v in args.items() if k != "session_id" and isinstance(v, str))))
+
+
+def score_sentences(text: str, terms: Set[str]) -> Tuple[List[str], List[int]]:
+    """Предложения текста и их номера от самого релевантного запросу к наименее"""
+    sentences = _SENTENCE.findall(text)
+    scored = []
+    for index, sentence in enumerate(sentences):
+        stems = [word[:5] for word in _WORD.findall(sentence.lower())]
+        matched = terms.intersection(stems)
+        hits = sum(map(terms.__contains__, stems)) if matched else 0
+        # Разные термины запроса важнее повторов; первые предложения обычно самые информативные
+        score = len(matched) + hits / (1 + math.sqrt(len(stems))) + (0.3 if index < 2 else 0)
+        scored.append((-score, index))
+    scored.sort()
+    return sentences, [index for _, index in scored]
+
+
+def select_sentences(sentences: List[str], ranking: List[int], budget: int) -> str:
+    """Лучшие по ranking предложения, влезающие в budget, в исходном порядке; пропуски помечаются « … »"""
+    if sum(map(len, sentences)) <= budget:
+        return "".join(sentences)
+    chosen = []
+    used = 0
+    for index in ranking:
+        size = len(sentences[index]) + len(GAP)
+        if used + size <= budget:
+            chosen.append(index)
+            used += size
+    if not chosen:
+        if not ranking:
+            return ""
+        # Даже лучшее предложение не влезает — режем его по границе слова
+        cut = sentences[ranking[0]][:max(0, budget - 1)]
+        return (cut.rsplit(" ", 1)[0] if " " in cut else cut) + "…"
+
+    chosen.sort()
+    parts = []
+    previous = -1
+    for index in chosen:
+        if parts and index != previous + 1:
+            parts.append(GAP)
+        parts.append(sentences[index])
+        previous = index
+    if chosen[-1] != len(sentences) - 1:
+        parts.append(GAP)
+    return "".join(parts).strip()
+
+
+def trim_text(text: str, budget: int, terms: Set[str]) -> str:
+    """Экстрактивное сокращение: оставляет предложения, больше всего совпадающие с запросом"""
+    if len(text) <= budget:
+        return text
+    return select_sentences(*score_sentences(text, terms), budget)
+
+
+def _records(data: Any) -> Optional[List[Dict[str, Any]]]:
+    if isinstance(data, dict):
+        return [data]
+    if isinstance(data, list) and data and all(isinstance(item, dict) for item in data):
+        return data
+    return None
+
+
+def render(data: Any, output_format: str = OUTPUT_FORMAT) -> str:
+    """Результат функции в строку для модели"""
+    if isinstance(data, str):
+        return data
+    if output_format == "json" or _records(data) is None:
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str)
+    records = _records(data)
+    parts = []
+    for i, record in enumerate(records, 1):
+        if len(records) > 1:
+            parts.append(f"[{i}]")
+        parts.extend(f"{key}: {value}" for key, value in record.items())
+        parts.append("")
+    return "\n".join(parts).strip()
+
+
+def _allocate(sizes: List[int], available: int) -> List[int]:
+    """Делит available символов между полями поровну; короткие поля отдают остаток длинным"""
+    limits = [0] * len(sizes)
+    order = sorted(range(len(sizes)), key=lambda i: sizes[i])
+    left = available
+    for position, i in enumerate(order):
+        share = left // (len(order) - position)
+        limits[i] = min(sizes[i], share)
+        left -= limits[i]
+    return limits
+
+
+def _trim_records(records: List[Dict[str, Any]], budget: int, terms: Set[str], output_format: str) -> List[Dict[str, Any]]:
+    fields = [(r, key) for r, record in enumerate(records) for key, value in record.items()
+              if isinstance(value, str) and len(value) > MIN_FIELD_CHARS]
+    if not fields:
+        return records
+    sizes = [len(records[r][key]) for r, key in fields]
+    overhead = len(render(records, output_format)) - sum(sizes)
+    available = max(0, budget - overhead)
+    # Оценка предложений не зависит от лимита — считаем её один раз на оба прохода
+    scored = [score_sentences(records[r][key], terms) for r, key in fields]
+    trimmed = records
+    # Экранирование JSON и пометки пропусков могут чуть превысить бюджет — тогда второй проход с запасом
+    for _ in range(2):
+        limits = _allocate(sizes, available)
+        trimmed = [dict(record) for record in records]
+        for (r, key), size, limit, (sentences, ranking) in zip(fields, sizes, limits, scored):
+            if limit < size:
+                trimmed[r][key] = select_sentences(sentences, ranking, limit)
+        excess = len(render(trimmed, output_format)) - budget
+        if excess <= 0:
+            break
+        available = max(0, available - excess)
+    return trimmed
+
+
+def _shed_records(records: List[Dict[str, Any]], trimmed: List[Dict[str, Any]], budget: int, terms: Set[str],
+                  output_format: str) -> List[Dict[str, Any]]:
+    """Последняя мера для JSON: отбрасывает записи с конца, затем самые длинные поля, пока результат не влезет"""
+    count = len(trimmed)
+    while count > 1 and len(render(trimmed[:count], output_format)) > budget:
+        count -= 1
+    if count < len(records):
+        # Оставшимся записям достаётся место отброшенных — сокращаем их заново
+        trimmed = _trim_records(records[:count], budget, terms, output_format)
+    if count > 1 or len(render(trimmed, output_format)) <= budget:
+        return trimmed
+    record = dict(trimmed[0])
+    while record and len(render([record], output_format)) > budget:
+        del record[max(record, key=lambda key: len(render(record[key], "json")))]
+    return [record]
+
+
+def fit(function_name: str, data: Any, args: Dict[str, Any], budget: int = OUTPUT_BUDGET,
+        output_format: str = OUTPUT_FORMAT) -> Any:
+    """
+    Приводит результат функции к бюджету модели и записывает размеры до и после
+
+    Результат, влезающий в бюджет, возвращается как есть. Превышающие его строки и списки
+    записей рендерятся в строку и сокращаются; в формате json записи остаются валидным
+    JSON — лишние записи и поля отбрасываются. Числа и None возвращаются как есть.
+    """
+    if data is None or isinstance(data, (bool, int, float)):
+        return data
+    rendered = render(data, output_format)
+    TOOL_OUTPUT_SIZE.observe(len(rendered), function_name, "raw")
+    if not budget or len(rendered) <= budget:
+        TOOL_OUTPUT_SIZE.observe(len(rendered), function_name, "sent")
+        return data
+    terms = query_terms(args)
+    records = _records(data)
+    if records is not None:
+        trimmed = _trim_records(records, budget, terms, output_format)
+        if output_format == "json" and len(render(trimmed, output_format)) > budget:
+            trimmed = _shed_records(records, trimmed, budget, terms, output_format)
+        # Одиночная запись остаётся объектом, а не списком из одного элемента
+        rendered = render(trimmed if isinstance(data, list) else trimmed[0], output_format)
+    if len(rendered) > budget and (records is None or output_format != "json"):
+        rendered = trim_text(rendered, budget, terms)
+    TOOL_OUTPUT_TRIMMED.inc(function_name)
+    TOOL_OUTPUT_SIZE.observe(len(rendered), function_name, "sent")
+    return rendered
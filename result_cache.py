@@ -0,0 +1,200 @@
+import functools
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger("result_cache")
+
+# Ограничения кэша в памяти (LRU): число записей и примерный объём в байтах
+CACHE_MAX_ENTRIES = int(os.getenv("TOOL_CACHE_MAX_ENTRIES", "1024"))
+CACHE_MAX_BYTES = int(os.getenv("TOOL_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+# Путь к sqlite-файлу, чтобы кэш переживал перезапуск (пусто — только память)
+CACHE_DB_PATH = os.getenv("TOOL_CACHE_DB", "")
+
+MISSING = object()
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_query(text: Any) -> str:
+    """Приводит запрос к каноничному виду: регистр, пробелы, знаки в конце"""
+    if not isinstance(text, str):
+        return json.dumps(text, sort_keys=True, ensure_ascii=False)
+    return _SPACES.sub(" ", text.casefold()).strip().rstrip("?!.").strip()
+
+
+def make_key(args: Dict[str, Any]) -> str:
+    """Ключ по аргументам функции (без session_id, строки нормализуются)"""
+    normalized = {
+        name: normalize_query(value) if isinstance(value, str) else value
+        for name, value in args.items()
+        if name != "session_id"
+    }
+    return json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+
+
+class ResultCache:
+    """
+    TTL + LRU кэш результатов функций агентов
+
+    Записи разделены по namespace (обычно — имя функции), у каждой своя TTL.
+    Память ограничена числом записей и суммарным размером; при переполнении
+    вытесняются давно не использованные. Опционально записи дублируются в sqlite.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        max_bytes: int = CACHE_MAX_BYTES,
+        db_path: str = CACHE_DB_PATH,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.db_path = db_path
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, Any, int]]" = OrderedDict()
+        self._bytes = 0
+        self._db: Optional[sqlite3.Connection] = None
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+        self.evictions = 0
+
+    def _open_db(self) -> Optional[sqlite3.Connection]:
+        if not self.db_path:
+            return None
+        if self._db is None:
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "namespace TEXT, key TEXT, expires_at REAL, value TEXT, "
+                "PRIMARY KEY (namespace, key))"
+            )
+            self._db.execute("DELETE FROM cache WHERE expires_at < ?", (time.time(),))
+            self._db.commit()
+        return self._db
+
+    def get(self, namespace: str, key: str) -> Any:
+        """Возвращает значение или MISSING"""
+        item = self._entries.get((namespace, key))
+        now = time.time()
+        if item is not None:
+            expires_at, value, _ = item
+            if expires_at > now:
+                self._entries.move_to_end((namespace, key))
+                self.hits[namespace] = self.hits.get(namespace, 0) + 1
+                return value
+            self._remove((namespace, key))
+
+        db = self._open_db()
+        if db is not None:
+            row = db.execute(
+                "SELECT expires_at, value FROM cache WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()
+            if row is not None and row[0] > now:
+                value = json.loads(row[1])
+                self._store(namespace, key, value, row[0], len(row[1]))
+                self.hits[namespace] = self.hits.get(namespace, 0) + 1
+                return value
+
+        self.misses[namespace] = self.misses.get(namespace, 0) + 1
+        return MISSING
+
+    def set(self, namespace: str, key: str, value: Any, ttl: float):
+        if ttl <= 0:
+            return
+        serialized = json.dumps(value, ensure_ascii=False)
+        expires_at = time.time() + ttl
+        self._store(namespace, key, value, expires_at, len(serialized))
+
+        db = self._open_db()
+        if db is not None:
+            db.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, expires_at, value) VALUES (?, ?, ?, ?)",
+                (namespace, key, expires_at, serialized),
+            )
+            db.commit()
+
+    def _store(self, namespace: str, key: str, value: Any, expires_at: float, size: int):
+        if size > self.max_bytes:
+            return
+        self._remove((namespace, key))
+        self._entries[(namespace, key)] = (expires_at, value, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, cache_key: Tuple[str, str]):
+        item = self._entries.pop(cache_key, None)
+        if item is not None:
+            self._bytes -= item[2]
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+        db = self._open_db()
+        if db is not None:
+            db.execute("DELETE FROM cache")
+            db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        namespaces = set(self.hits) | set(self.misses)
+        per_namespace = {}
+        for namespace in namespaces:
+            hits = self.hits.get(namespace, 0)
+            misses = self.misses.get(namespace, 0)
+            per_namespace[namespace] = {
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            }
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "evictions": self.evictions,
+            "persistent": bool(self.db_path),
+            "functions": per_namespace,
+        }
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def cached(namespace: str, ttl: float, key: Callable[..., str] = None,
+           should_cache: Callable[[Any], bool] = bool):
+    """
+    Декоратор для async-функций: кэширует результат в result_cache
+
+    Args:
+        namespace: Пространство имён (обычно имя функции агента)
+        ttl: Время жизни записи в секундах
+        key: Функция построения ключа из аргументов (по умолчанию — нормализованный первый аргумент)
+        should_cache: Какие результаты сохранять (по умолчанию — непустые)
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            cache_key = key(*args, **kwargs) if key else normalize_query(args[0] if args else kwargs)
+            value = result_cache.get(namespace, cache_key)
+            if value is not MISSING:
+                return value
+            value = await func(*args, **kwargs)
+            if should_cache(value):
+                result_cache.set(namespace, cache_key, value, ttl)
+            return value
+        return wrapper
+    return decorator
+
+
+# глобальный экземпляр
+result_cache = ResultCache()
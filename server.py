@@ -1,15 +1,52 @@
-from fastapi import FastAPI, WebSocket
+from fastapi import FastAPI, Header, WebSocket, HTTPException
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from google import genai
 from google.genai import types
 from pydantic import BaseModel
-from dynamic_function_caller import handle_function_call
+from dynamic_function_caller import registry
 import json
 from connection_manager import manager
+from executor_pool import executor_pool
+from governor import governor
+from http_pool import http_pool
+from result_cache import result_cache
+from single_flight import single_flight
+from knowledge_index import knowledge_index
+from context_preload import PRELOAD_ENABLED, build_context, compose_system_prompt
+from live_pool import LiveSessionPool, prewarm_configs
+from live_connection import LiveConnection
+from metrics import AUDIO_BYTES_SENT, TIME_TO_FIRST_AUDIO, TURNS, Counter, Gauge, metrics
+from live_pump import LivePump
+from tool_scheduler import ToolScheduler, scheduler_stats
+from contextlib import asynccontextmanager
+import functools
+from typing import Optional
 import asyncio
 import os
+import time
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Импортируем все функции агентов заранее, а не на первом вызове
+    registry.scan()
+    await manager.start()
+    await http_pool.start()
+    knowledge_index.open()
+    await live_pool.start(prewarm_configs())
+    metrics.start_loop_monitor()
+    yield
+    await metrics.stop_loop_monitor()
+    await live_pool.close()
+    knowledge_index.close()
+    await http_pool.close()
+    await manager.close()
+    executor_pool.shutdown()
+    result_cache.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -22,146 +59,293 @@ app.add_middleware(
 client = genai.Client(api_key=os.getenv("GENAI_API_KEY"))
 model = "gemini-2.0-flash-live-001"
 
-# Define function declarations
-FUNCTION_DECLARATIONS = [
-    {
-        "name": "text_display",
-        "description": "Вы говорите с пользователем голосом, и всё, что вы скажете прозвучит только один раз, если вы не будите нарошно повторять. Для того, чтобы отметить какую-то ВАЖНУЮ ИНФОРМАЦИЮ, текстом, которую нужно читать несколько раз, используйте эту функцию. Например, вас просят сказать определение, рецепт, погоду, ответ в дз и т.п. Функция поддерживает markdown",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "text": {
-                    "type": "string"
-                }
-            },
-            "required": [
-                "text"
-            ]
-        }
-    },
-    {
-    "name": "wolfram",
-    "description": "Это llm api Wolfram alpha. Используйте его для всего точного: как калькулятор сложных примеров (уравнений, химических уравнений и всё точное математическое), погоды, исторических фактов, праздников, всего. Например, когда У ВАС СПРАШИВАЮТ: \"Реши это квадратное уравнение\" или \"Какая погода завтра в краснодаре?\". В query пишите ЧЁТКИЕ ИНСТРУКЦИИ В ФОРМАТЕ WOLFRAM ALPHA НА АНГЛИЙСКОМ",
-    "parameters": {
-      "type": "object",
-      "properties": {
-        "query": {
-          "type": "string"
-        }
-      },
-      "required": [
-        "query"
-      ]
-    }
-    },
-    {
-    "name": "web_search",
-    "description": "Асинхронно ищет по вашему запросу в “большом” интернете (через DuckDuckGo), извлекает заголовки и основной текст страниц.  **Когда использовать:**  * **Сложные или редкие запросы**, где ни Википедия, ни Wolfram Alpha, ни локальная БД не дают полного ответа. * **Неоднозначные темы** или глубокие статьи, которые могут отсутствовать в узкоспециализированных источниках. * **Проверка фактов** из разных сайтов, когда нужна свежая информация, не попавшая ещё в базы.  **Когда не использовать:**  * Если нужен **краткий факт** или формула — сначала обращайтесь к Wolfram Alpha. * Если вопрос охватывается **статьёй в Википедии** — используйте wikipedia\\_search. * Если информация строго **персональная** — берите из локальной БД пользователя.  **Поведение в диалоге:**  1. Голос ИИ: «Сейчас я поищу в интернете…» 2. Вызывается `web_search` и возвращаются заголовки + ключевые выдержки. 3. ИИ озвучивает и формирует ответ на основе свежих данных.",
-    "parameters": {
-      "type": "object",
-      "properties": {
-        "query": {
-          "type": "string"
-        }
-      },
-      "required": [
-        "query"
-      ]
-    }
-    }
-]
+# Полнодуплексный режим: чтение клиента и приём ответов модели в отдельных задачах
+DUPLEX_MODE = os.getenv("LIVE_DUPLEX", "0") == "1"
+# Сколько реплик клиента может ждать окончания текущего хода в пошаговом режиме
+TURN_QUEUE_SIZE = int(os.getenv("TURN_QUEUE_SIZE", "8"))
+# Возобновление Live-сессии по handle после обрыва соединения
+LIVE_RESUMPTION = os.getenv("LIVE_RESUMPTION", "1") == "1"
+# Транскрипция речи пользователя и модели — попадает в журнал разговора для восстановления
+LIVE_TRANSCRIPTION = os.getenv("LIVE_TRANSCRIPTION", "0") == "1"
+
+# Сколько собранных LiveConnectConfig держать в кэше (ключ — system_prompt, voice_name и версия реестра функций)
+LIVE_CONFIG_CACHE_SIZE = int(os.getenv("LIVE_CONFIG_CACHE_SIZE", "64"))
+# Токен для изменяющих админских запросов (заголовок X-Admin-Token); пусто — без проверки
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
 
 class SessionConfig(BaseModel):
     system_prompt: str
     voice_name: str
+    # Для подгрузки контекста из локальной базы (CONTEXT_PRELOAD=1)
+    user: Optional[str] = None
+    context_query: Optional[str] = None
+
+async def resolve_system_prompt(config: SessionConfig) -> str:
+    if not PRELOAD_ENABLED:
+        return config.system_prompt
+    try:
+        context = await build_context(config.user, config.context_query)
+    except Exception as e:
+        print(f"Не удалось подгрузить контекст: {e}")
+        return config.system_prompt
+    return compose_system_prompt(config.system_prompt, context)
 
-def create_genai_config(config: SessionConfig):
+@functools.lru_cache(maxsize=LIVE_CONFIG_CACHE_SIZE)
+def _build_live_config(system_prompt: str, voice_name: str, tools_version: int) -> types.LiveConnectConfig:
     return types.LiveConnectConfig(
         system_instruction=types.Content(
-            parts=[types.Part(text=config.system_prompt)]
+            parts=[types.Part(text=system_prompt)]
         ),
         response_modalities=["AUDIO"],
         speech_config=types.SpeechConfig(
             voice_config=types.VoiceConfig(
                 prebuilt_voice_config=types.PrebuiltVoiceConfig(
-                    voice_name=config.voice_name
+                    voice_name=voice_name
                 )
             )
         ),
-        tools=[types.Tool(
-            function_declarations=[
-                types.FunctionDeclaration(**fd) for fd in FUNCTION_DECLARATIONS
-            ]
-        )]
+        # Декларации собираются реестром из DECLARATION в модулях functions/
+        tools=[registry.tool()],
+        session_resumption=types.SessionResumptionConfig() if LIVE_RESUMPTION else None,
+        input_audio_transcription=types.AudioTranscriptionConfig() if LIVE_TRANSCRIPTION else None,
+        output_audio_transcription=types.AudioTranscriptionConfig() if LIVE_TRANSCRIPTION else None,
+    )
+
+def _tools_version() -> int:
+    # registry.tool() подхватывает изменённые модули и при этом меняет registry.version
+    registry.tool()
+    return registry.version
+
+def _live_config_for(key) -> types.LiveConnectConfig:
+    system_prompt, voice_name = key
+    return _build_live_config(system_prompt, voice_name, _tools_version())
+
+# Тёплые Live-сессии по (system_prompt, voice_name); LIVE_POOL_SIZE=0 — каждый раз новое подключение
+live_pool = LiveSessionPool(
+    connect=lambda key: client.aio.live.connect(model=model, config=_live_config_for(key)),
+    generation=_tools_version,
+)
+
+def _open_live(key, handle: Optional[str] = None, pooled: bool = True):
+    """Первое подключение — из пула (если pooled); после обрыва — возобновление по handle"""
+    if handle is None and pooled:
+        return live_pool.session(key)
+    config = _live_config_for(key)
+    if handle is not None:
+        config = config.model_copy(update={"session_resumption": types.SessionResumptionConfig(handle=handle)})
+    return client.aio.live.connect(model=model, config=config)
+
+def _tool_responder(session):
+    async def respond(results):
+        # Отправляем результаты обратно в модель одним сообщением
+        await session.send_tool_response(function_responses=[
+            types.FunctionResponse(
+                id=fc.id,
+                name=fc.name,
+                response=result
+            )
+            for fc, result in results
+        ])
+    return respond
+
+async def _read_turns(websocket: WebSocket, session_id: str, turns: asyncio.Queue):
+    """
+    Читает клиента параллельно с ходом модели (пошаговый режим)
+
+    function_response обрабатываются сразу — иначе функция, ждущая ответа клиента
+    через manager.request, не дождалась бы его до конца хода. Реплики ждут в turns.
+    """
+    binary_warned = False
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
+        user_text = message.get("text")
+        if user_text is None:
+            # PCM-аудио принимает только полнодуплексный режим (LIVE_DUPLEX=1) — бинарные кадры пропускаем
+            manager.incr(session_id, "binary_frames_ignored")
+            if not binary_warned:
+                binary_warned = True
+                print(f"[{session_id}] бинарный кадр в пошаговом режиме пропущен (аудио — только с LIVE_DUPLEX=1)")
+            continue
+        manager.incr(session_id, "messages_received")
+        if user_text.strip().lower() == "exit":
+            await websocket.close()
+            return
+
+        try:
+            data = json.loads(user_text)
+            if isinstance(data, dict) and data.get("type") == "function_response":
+                # Ответ клиента на инструкцию: разрешает ожидающий future по requestId
+                await manager.handle_function_response(data, session_id)
+                continue  # Пропускаем отправку в модель
+        except json.JSONDecodeError:
+            pass  # Это не JSON — отправим как обычный текст модели
+        await turns.put(user_text)
+
+async def _run_turn_based(websocket: WebSocket, session, session_id: str, scheduler: ToolScheduler):
+    turns: asyncio.Queue = asyncio.Queue(maxsize=TURN_QUEUE_SIZE)
+    reader = asyncio.create_task(_read_turns(websocket, session_id, turns), name=f"{session_id}:client-reader")
+    try:
+        while True:
+            next_turn = asyncio.ensure_future(turns.get())
+            await asyncio.wait({next_turn, reader}, return_when=asyncio.FIRST_COMPLETED)
+            if not next_turn.done():
+                # Клиент отключился или прислал exit
+                next_turn.cancel()
+                reader.result()
+                return
+            user_text = next_turn.result()
+            await _model_turn(websocket, session, session_id, scheduler, user_text)
+    finally:
+        reader.cancel()
+        await asyncio.gather(reader, return_exceptions=True)
+
+async def _model_turn(websocket: WebSocket, session, session_id: str, scheduler: ToolScheduler, user_text: str):
+    # Отправка обычного пользовательского текста в модель
+    manager.incr(session_id, "turns")
+    await session.send_client_content(
+        turns={"role": "user", "parts": [{"text": user_text}]},
+        turn_complete=True
     )
+    TURNS.inc()
+    turn_started = time.perf_counter()
+
+    async for response in session.receive():
+        # Обрабатываем аудио-чанки
+        if response.data is not None:
+            await websocket.send_bytes(response.data)
+            if turn_started is not None:
+                TIME_TO_FIRST_AUDIO.observe(time.perf_counter() - turn_started)
+                turn_started = None
+            manager.incr(session_id, "audio_chunks_sent")
+            manager.incr(session_id, "audio_bytes_sent", len(response.data))
+            AUDIO_BYTES_SENT.inc(amount=len(response.data))
+
+        # Обрабатываем вызовы функций: планировщик выполняет их в фоне, не блокируя аудио-стрим
+        if response.tool_call:
+            function_calls = response.tool_call.function_calls or []
+            manager.incr(session_id, "function_calls", len(function_calls))
+            scheduler.submit_all(function_calls)
+
+        if response.tool_call_cancellation:
+            scheduler.cancel(response.tool_call_cancellation.ids or [])
+
+@app.get("/sessions")
+async def list_sessions():
+    return manager.stats()
+
+@app.get("/sessions/{session_id}")
+async def get_session(session_id: str):
+    session = manager.get_session(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return session.to_dict()
+
+@app.get("/executors")
+async def executor_stats():
+    return executor_pool.stats()
+
+@app.get("/http-pool")
+async def http_pool_stats():
+    return http_pool.stats()
+
+@app.get("/live-pool")
+async def live_pool_stats():
+    return live_pool.stats()
 
-async def _process_function_call(fc, session_id, session):
-    # Выполняем функцию в фоне
-    result = await handle_function_call(fc, session_id)
-    # Отправляем результат обратно в модель
-    await session.send_tool_response(function_responses=[
-        types.FunctionResponse(
-            id=fc.id,
-            name=fc.name,
-            response=result
-        )
-    ])
+@app.get("/cache")
+async def cache_stats():
+    return result_cache.stats()
+
+@app.get("/governor")
+async def governor_stats():
+    return governor.stats()
+
+@app.post("/governor/{backend}/reset")
+async def governor_reset(backend: str, x_admin_token: Optional[str] = Header(default=None)):
+    # Ручное замыкание предохранителя (например, после смены ключа): только с ADMIN_TOKEN, если он задан
+    if ADMIN_TOKEN and x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    if not governor.reset(backend):
+        raise HTTPException(status_code=404, detail="Backend not found")
+    return governor.backends[backend].stats()
+
+@metrics.collector
+def runtime_metrics():
+    """Метрики, которые считаются из текущего состояния в момент запроса /metrics"""
+    sessions = list(manager.sessions.values())
+    active = Gauge("sparkai_active_sessions", "Подключённые клиенты")
+    active.set(len(sessions))
+    audio_rate = Gauge("sparkai_session_audio_bytes_per_second", "Средний поток аудио клиенту за сессию", ("session",))
+    outbound = Gauge("sparkai_outbound_queue_depth", "Инструкции в очереди отправки клиенту", ("session",))
+    now = time.time()
+    for s in sessions:
+        audio_rate.set(s.counters.get("audio_bytes_sent", 0) / max(now - s.created_at, 1e-3), s.session_id)
+        outbound.set(s.outbox.depth(), s.session_id)
+
+    tools = scheduler_stats()
+    tool_queue = Gauge("sparkai_tool_queue_depth", "Вызовы функций в очередях планировщиков")
+    tool_queue.set(tools["queued"])
+    tool_running = Gauge("sparkai_tool_running", "Выполняющиеся вызовы функций")
+    tool_running.set(tools["running"])
+    shared = Gauge("sparkai_tool_shared_executions", "Выполняющиеся функции, результат которых ждут несколько вызовов")
+    shared.set(single_flight.stats()["shared"])
+    executor_queue = Gauge("sparkai_executor_queue_depth", "Задачи, ждущие свободного исполнителя", ("pool",))
+    for pool, stats in executor_pool.stats()["pools"].items():
+        executor_queue.set(stats["queue_depth"], pool)
+
+    cache = result_cache.stats()
+    hits = Counter("sparkai_cache_hits_total", "Попадания в кэш результатов", ("namespace",))
+    misses = Counter("sparkai_cache_misses_total", "Промахи кэша результатов", ("namespace",))
+    hit_ratio = Gauge("sparkai_cache_hit_ratio", "Доля попаданий в кэш результатов", ("namespace",))
+    for namespace, stats in cache["functions"].items():
+        hits.inc(namespace, amount=stats["hits"])
+        misses.inc(namespace, amount=stats["misses"])
+        hit_ratio.set(stats["hit_rate"], namespace)
+
+    circuit = Gauge("sparkai_backend_circuit_open", "Состояние предохранителя внешнего сервиса: 0 — замкнут, 0.5 — пробные вызовы, 1 — разомкнут", ("backend",))
+    for name, stats in governor.stats().items():
+        circuit.set({"closed": 0, "half_open": 0.5, "open": 1}[stats["state"]], name)
+
+    pool = live_pool.stats()
+    warm = Gauge("sparkai_live_pool_warm_sessions", "Тёплые Live-сессии в пуле")
+    warm.set(pool["warm"])
+    pool_hits = Counter("sparkai_live_pool_hits_total", "Клиенты, получившие тёплую Live-сессию")
+    pool_hits.inc(amount=pool["hits"])
+    http_requests = Counter("sparkai_http_pool_requests_total", "HTTP-запросы функций через общий пул")
+    http_requests.inc(amount=http_pool.requests)
+    return [active, audio_rate, outbound, tool_queue, tool_running, shared, executor_queue,
+            hits, misses, hit_ratio, circuit, warm, pool_hits, http_requests]
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    session_id = "SESSION_ID_HERE"
+    session_id = manager.new_session_id()
     await manager.connect(session_id, websocket)
     try:
         config_data = await websocket.receive_text()
         config = SessionConfig(**json.loads(config_data))
 
-        async with client.aio.live.connect(
-                model=model,
-                config=create_genai_config(config)
-        ) as session:
-            while True:
-                user_text = await websocket.receive_text()
-                if user_text.strip().lower() == "exit":
-                    await websocket.close()
-                    break
-
-                try:
-                    data = json.loads(user_text)
-                    if isinstance(data, dict) and data.get("type") == "function_response":
-                        # Здесь ваша логика обработки function_response
-                        print("Получен function_response, обрабатываем отдельно...")
-                        # Пример: можно вызвать какую-то функцию
-                        manager.handle_function_response(data, session_id)
-                        continue  # Пропускаем отправку в модель
-                except json.JSONDecodeError:
-                    pass  # Это не JSON — отправим как обычный текст модели
-
-                # Отправка обычного пользовательского текста в модель
-                await session.send_client_content(
-                    turns={"role": "user", "parts": [{"text": user_text}]},
-                    turn_complete=True
-                )
-
-                function_responses = []
-                async for response in session.receive():
-                    # Обрабатываем аудио-чанки
-                    if response.data is not None:
-                        await websocket.send_bytes(response.data)
-
-                    # Обрабатываем вызовы функций
-                    if response.tool_call:
-                        for fc in response.tool_call.function_calls:  # Запускаем фоновый таск, чтобы не блокировать аудио-стрим
-                            asyncio.create_task(_process_function_call(fc, session_id, session))
-
-                    # Отправляем ответы на вызовы функций
-                    if function_responses:
-                        await session.send_tool_response(
-                            function_responses=function_responses
-                        )
-                        function_responses = []
-
-                    if getattr(response, "event", None) and response.event.type == "turn_end":
-                        break
+        system_prompt = await resolve_system_prompt(config)
+        key = (system_prompt, config.voice_name)
+        # Промпт с подгруженным контекстом у каждого пользователя свой: тёплая сессия под него
+        # не пригодится, а ключ вытеснил бы из пула общие конфигурации
+        pooled = system_prompt == config.system_prompt
+        # При обрыве соединения с Gemini LiveConnection переподключается, не закрывая клиента
+        async with LiveConnection(session_id, lambda handle: _open_live(key, handle, pooled)) as session:
+            scheduler = ToolScheduler(session_id, respond=_tool_responder(session))
+            try:
+                if DUPLEX_MODE:
+                    await LivePump(websocket, session, session_id, scheduler).run()
+                else:
+                    await _run_turn_based(websocket, session, session_id, scheduler)
+            finally:
+                # Незавершённые функции не должны отвечать в уже закрытую сессию
+                await scheduler.close()
 
     except Exception as e:
         print(f"Error: {e}")
@@ -0,0 +1,314 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Set
+from urllib.parse import urlparse
+from metrics import BUS_FRAMES_DROPPED
+
+logger = logging.getLogger("session_bus")
+
+# Шина между воркерами: "local" — один процесс, "broker" — через брокер session_bus.py
+SESSION_BUS = os.getenv("SESSION_BUS", "local")
+# Адрес брокера: unix:///path/to.sock или tcp://host:port
+SESSION_BUS_URL = os.getenv("SESSION_BUS_URL", "unix:///tmp/sparkai-bus.sock")
+# Максимальная пауза между попытками переподключения к брокеру (секунды)
+SESSION_BUS_MAX_BACKOFF = float(os.getenv("SESSION_BUS_MAX_BACKOFF", "5"))
+# Сколько сообщений копить для брокера, пока он недоступен (старые отбрасываются)
+SESSION_BUS_QUEUE_SIZE = int(os.getenv("SESSION_BUS_QUEUE_SIZE", "10000"))
+# Лимит длины одного кадра (строки JSON) в байтах
+FRAME_LIMIT = 8 * 1024 * 1024
+
+Deliver = Callable[[str, Dict[str, Any]], Awaitable[None]]
+
+
+def session_key(session_id: str) -> str:
+    return f"session:{session_id}"
+
+
+def request_key(request_id: str) -> str:
+    return f"request:{request_id}"
+
+
+class SessionBus:
+    """
+    Шина сообщений между процессами сервера
+
+    Каждый процесс регистрирует ключи маршрутизации, которыми владеет (session:<id> —
+    WebSocket клиента, request:<id> — ожидающий ответа future), и получает в deliver
+    всё, что другие процессы публикуют на эти ключи (session affinity). Эта реализация
+    работает внутри одного процесса: владельцы всех ключей локальны, публиковать некуда.
+    """
+
+    distributed = False
+
+    def __init__(self):
+        self.worker_id = uuid.uuid4().hex[:8]
+        self._deliver: Optional[Deliver] = None
+
+    async def start(self, deliver: Deliver):
+        self._deliver = deliver
+
+    def register(self, key: str):
+        pass
+
+    def unregister(self, key: str):
+        pass
+
+    def publish(self, key: str, message: Dict[str, Any]) -> bool:
+        """
+        Отправляет сообщение владельцу ключа в другом процессе; False, если отправить некуда
+
+        Если владельца не окажется, deliver получит {"undeliverable": True, "message": ...}.
+        """
+        return False
+
+    async def close(self):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "local", "worker_id": self.worker_id}
+
+
+class BrokerBus(SessionBus):
+    """
+    Шина через брокер (run_broker) на Unix- или TCP-сокете
+
+    Протокол — JSON-кадры по строке: register/unregister/publish от воркера и
+    deliver от брокера. При обрыве связи воркер переподключается с экспоненциальной
+    паузой и заново регистрирует свои ключи. Без связи publish возвращает False, чтобы
+    запросы к чужим сессиям сразу завершались ошибкой; очередь на отправку ограничена
+    queue_size сообщений — при переполнении старые отбрасываются. Сообщение на ключ без
+    владельца брокер возвращает отправителю как undeliverable.
+    """
+
+    distributed = True
+
+    def __init__(self, url: str = SESSION_BUS_URL, max_backoff: float = SESSION_BUS_MAX_BACKOFF,
+                 queue_size: int = SESSION_BUS_QUEUE_SIZE):
+        super().__init__()
+        self.url = url
+        self.max_backoff = max_backoff
+        self.queue_size = queue_size
+        self._keys: Set[str] = set()
+        self._outgoing: Deque[Dict[str, Any]] = deque(maxlen=queue_size)
+        self._wakeup = asyncio.Event()
+        self._connected = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.reconnects = 0
+
+    async def start(self, deliver: Deliver):
+        await super().start(deliver)
+        self._task = asyncio.create_task(self._run(), name="session-bus")
+
+    def register(self, key: str):
+        self._keys.add(key)
+        # Без связи не копим: при переподключении все ключи регистрируются заново
+        if self._connected.is_set():
+            self._enqueue({"op": "register", "key": key})
+
+    def unregister(self, key: str):
+        if key in self._keys:
+            self._keys.discard(key)
+            if self._connected.is_set():
+                self._enqueue({"op": "unregister", "key": key})
+
+    def publish(self, key: str, message: Dict[str, Any]) -> bool:
+        if not self._connected.is_set():
+            return False
+        self._enqueue({"op": "publish", "key": key, "message": message})
+        self.published += 1
+        return True
+
+    def _enqueue(self, frame: Dict[str, Any]):
+        if len(self._outgoing) == self._outgoing.maxlen:
+            self._dropped(1)
+        self._outgoing.append(frame)
+        self._wakeup.set()
+
+    async def _run(self):
+        backoff = 0.1
+        while True:
+            try:
+                reader, writer = await open_connection(self.url)
+            except OSError as e:
+                logger.warning(f"Брокер {self.url} недоступен ({str(e)}), повтор через {backoff:g} с")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+
+            backoff = 0.1
+            logger.info(f"Воркер {self.worker_id} подключён к брокеру {self.url}")
+            # Брокер ничего не помнит о воркере после обрыва — регистрируемся заново
+            registrations = [{"op": "register", "key": key} for key in self._keys]
+            published = [frame for frame in self._outgoing if frame["op"] == "publish"]
+            # Регистрации важнее накопленных сообщений: им отдаётся место в очереди в первую очередь
+            room = max(0, self.queue_size - len(registrations))
+            if len(published) > room:
+                self._dropped(len(published) - room)
+                published = published[len(published) - room:]
+            self._outgoing = deque(registrations + published, maxlen=max(self.queue_size, len(registrations)))
+            self._connected.set()
+            self._wakeup.set()
+            sender = asyncio.create_task(self._send_loop(writer))
+            try:
+                await self._receive_loop(reader)
+            finally:
+                self._connected.clear()
+                sender.cancel()
+                await asyncio.gather(sender, return_exceptions=True)
+                writer.close()
+            self.reconnects += 1
+            logger.warning(f"Связь с брокером {self.url} потеряна, переподключаемся")
+
+    def _dropped(self, count: int):
+        if not self.dropped:
+            logger.warning(f"Очередь шины переполнена ({self.queue_size}), старые сообщения отбрасываются")
+        self.dropped += count
+        BUS_FRAMES_DROPPED.inc(amount=count)
+
+    async def _send_loop(self, writer: asyncio.StreamWriter):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._outgoing:
+                frame = self._outgoing[0]
+                writer.write(encode_frame(frame))
+                await writer.drain()
+                self._outgoing.popleft()
+
+    async def _receive_loop(self, reader: asyncio.StreamReader):
+        while True:
+            try:
+                frame = await read_frame(reader)
+            except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+                return
+            if frame is None:
+                return
+            op = frame.get("op")
+            if op == "undeliverable":
+                message = {"undeliverable": True, "message": frame.get("message")}
+            elif op == "deliver":
+                self.delivered += 1
+                message = frame["message"]
+            else:
+                continue
+            try:
+                await self._deliver(frame["key"], message)
+            except Exception as e:
+                logger.error(f"Ошибка обработки сообщения шины для {frame.get('key')}: {str(e)}")
+
+    async def wait_connected(self, timeout: float = None):
+        await asyncio.wait_for(self._connected.wait(), timeout)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "broker",
+            "worker_id": self.worker_id,
+            "url": self.url,
+            "connected": self._connected.is_set(),
+            "keys": len(self._keys),
+            "outgoing": len(self._outgoing),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "reconnects": self.reconnects,
+        }
+
+
+def encode_frame(frame: Dict[str, Any]) -> bytes:
+    return json.dumps(frame, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Optional[Dict[str, Any]]:
+    line = await reader.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+
+async def open_connection(url: str):
+    parsed = urlparse(url)
+    if parsed.scheme == "unix":
+        return await asyncio.open_unix_connection(parsed.path, limit=FRAME_LIMIT)
+    return await asyncio.open_connection(parsed.hostname, parsed.port, limit=FRAME_LIMIT)
+
+
+async def run_broker(url: str = SESSION_BUS_URL):
+    """
+    Брокер шины: помнит, какой воркер владеет каким ключом, и пересылает ему сообщения
+
+    Один на машину (или один на кластер, если слушает TCP). Сообщения на ключи без
+    владельца возвращаются отправителю кадром undeliverable.
+    """
+    routes: Dict[str, asyncio.StreamWriter] = {}
+    stats = {"routed": 0, "undeliverable": 0}
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        owned: Set[str] = set()
+        try:
+            while True:
+                frame = await read_frame(reader)
+                if frame is None:
+                    break
+                op, key = frame.get("op"), frame.get("key")
+                if op == "register":
+                    routes[key] = writer
+                    owned.add(key)
+                elif op == "unregister":
+                    if routes.get(key) is writer:
+                        del routes[key]
+                    owned.discard(key)
+                elif op == "publish":
+                    target = routes.get(key)
+                    if target is None or target.is_closing():
+                        stats["undeliverable"] += 1
+                        # Отправитель ждёт ответа на запрос — пусть узнает об этом сразу, а не по таймауту
+                        writer.write(encode_frame({"op": "undeliverable", "key": key, "message": frame.get("message")}))
+                        await writer.drain()
+                        continue
+                    target.write(encode_frame({"op": "deliver", "key": key, "message": frame.get("message")}))
+                    stats["routed"] += 1
+                    await target.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+            logger.warning(f"Воркер отключился с ошибкой: {str(e)}")
+        finally:
+            for key in owned:
+                if routes.get(key) is writer:
+                    del routes[key]
+            writer.close()
+
+    parsed = urlparse(url)
+    if parsed.scheme == "unix":
+        if os.path.exists(parsed.path):
+            os.unlink(parsed.path)
+        server = await asyncio.start_unix_server(handle, parsed.path, limit=FRAME_LIMIT)
+    else:
+        server = await asyncio.start_server(handle, parsed.hostname, parsed.port, limit=FRAME_LIMIT)
+    logger.info(f"Брокер шины слушает {url}")
+    async with server:
+        await server.serve_forever()
+
+
+def create_bus(backend: str = SESSION_BUS) -> SessionBus:
+    if backend == "broker":
+        return BrokerBus()
+    if backend != "local":
+        raise ValueError(f"Неизвестная шина SESSION_BUS={backend}")
+    return SessionBus()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(run_broker())
@@ -0,0 +1,125 @@
+import asyncio
+import contextvars
+import logging
+import os
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+from metrics import TOOL_CALLS_COALESCED
+
+logger = logging.getLogger("single_flight")
+
+# Объединять одновременные одинаковые вызовы функций в одно выполнение (0 — выключено везде).
+# Только для модулей, объявивших SINGLE_FLIGHT = True: результат не должен зависеть от сессии
+SINGLE_FLIGHT = os.getenv("TOOL_SINGLE_FLIGHT", "1") == "1"
+
+
+class Flight:
+    """
+    Одно выполнение функции, которого ждут несколько вызовов
+
+    origin — сессия, от имени которой функция выполняется (её session_id в args);
+    sessions — все сессии, ждущие результат. Инструкции, которые функция отправляет
+    origin, дублируются каждой из них, а последние из них запоминаются, чтобы
+    показать присоединившемуся позже вызову текущее состояние.
+    """
+
+    def __init__(self, key: Tuple[str, str], origin: str):
+        self.key = key
+        self.origin = origin
+        # session_id -> сколько вызовов этой сессии ждут результат
+        self.sessions: Dict[str, int] = {origin: 1}
+        self.task: Optional[asyncio.Task] = None
+        # (instruction_type, function) -> последняя отправленная инструкция
+        self._last: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+
+    @property
+    def waiters(self) -> int:
+        return sum(self.sessions.values())
+
+    def join(self, session_id: str):
+        self.sessions[session_id] = self.sessions.get(session_id, 0) + 1
+
+    def leave(self, session_id: str):
+        left = self.sessions.get(session_id, 0) - 1
+        if left > 0:
+            self.sessions[session_id] = left
+        else:
+            self.sessions.pop(session_id, None)
+
+    def remember(self, payload: Dict[str, Any]):
+        key = (payload["type"], payload["function"])
+        self._last.pop(key, None)
+        self._last[key] = payload
+
+    def replay(self) -> Iterable[Dict[str, Any]]:
+        return list(self._last.values())
+
+
+# Flight, внутри которого сейчас выполняется функция (читает connection_manager.send_instruction)
+current_flight: contextvars.ContextVar[Optional[Flight]] = contextvars.ContextVar("current_flight", default=None)
+
+
+class SingleFlight:
+    """
+    Объединение одновременных вызовов с одинаковым ключом (функция, аргументы без session_id)
+
+    Первый вызов запускает выполнение отдельной задачей, остальные ждут её результат.
+    Выполнение не привязано к задаче первого вызова: если тот отменён (прерывание хода,
+    отключение клиента), остальные всё равно получат результат. Задача отменяется,
+    только когда её больше никто не ждёт. Объединяются только вызовы внутри процесса.
+    """
+
+    def __init__(self):
+        self._flights: Dict[Tuple[str, str], Flight] = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    async def run(self, function_name: str, key: str, session_id: str,
+                  call: Callable[[], Awaitable[Any]],
+                  on_join: Callable[[Flight, str], Awaitable[None]] = None) -> Any:
+        flight_key = (function_name, key)
+        flight = self._flights.get(flight_key)
+        if flight is None:
+            flight = Flight(flight_key, session_id)
+            self._flights[flight_key] = flight
+            flight.task = asyncio.create_task(self._execute(flight, call), name=f"single-flight:{function_name}")
+            self.executions += 1
+        else:
+            flight.join(session_id)
+            self.coalesced += 1
+            TOOL_CALLS_COALESCED.inc(function_name)
+            logger.info(f"Вызов {function_name} присоединён к уже выполняющемуся ({flight.waiters} ожидающих)")
+
+        try:
+            if flight.origin != session_id and on_join is not None:
+                await on_join(flight, session_id)
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.task.done():
+                raise
+            flight.leave(session_id)
+            if not flight.sessions:
+                flight.task.cancel()
+            raise
+
+    async def _execute(self, flight: Flight, call: Callable[[], Awaitable[Any]]) -> Any:
+        # Значение видно только внутри этой задачи: инструкции функции уходят всем ожидающим
+        current_flight.set(flight)
+        try:
+            return await call()
+        finally:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._flights),
+            "waiters": sum(flight.waiters for flight in self._flights.values()),
+            "shared": sum(1 for flight in self._flights.values() if flight.waiters > 1),
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+        }
+
+
+# глобальный экземпляр
+single_flight = SingleFlight()
@@ -0,0 +1,281 @@
+import asyncio
+import itertools
+import logging
+import os
+import time
+import weakref
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from dynamic_function_caller import FunctionResult, handle_function_call, is_valid_function_name, registry
+from connection_manager import manager
+from metrics import TOOL_LATENCY, TOOL_QUEUE_WAIT
+
+logger = logging.getLogger("tool_scheduler")
+
+# Сколько функций одной сессии выполняются одновременно
+SCHEDULER_CONCURRENCY = int(os.getenv("TOOL_SCHEDULER_CONCURRENCY", "4"))
+# Сколько вызовов может ждать в очереди, прежде чем новые будут отклоняться
+SCHEDULER_QUEUE_SIZE = int(os.getenv("TOOL_QUEUE_SIZE", "32"))
+# Дедлайн по умолчанию (секунды); модуль функции может задать свой через TIMEOUT
+DEFAULT_TIMEOUT = float(os.getenv("TOOL_TIMEOUT", "30"))
+# Приоритет по умолчанию (меньше — раньше); модуль функции может задать свой через PRIORITY
+DEFAULT_PRIORITY = 10
+# Окно (мс) для объединения ответов на параллельные вызовы в один send_tool_response (0 — не объединять)
+BATCH_WINDOW_MS = float(os.getenv("TOOL_BATCH_WINDOW_MS", "0"))
+
+# Все живые планировщики (для метрик очередей)
+_schedulers: "weakref.WeakSet[ToolScheduler]" = weakref.WeakSet()
+
+
+def scheduler_stats() -> Dict[str, int]:
+    """Суммарная глубина очередей и число выполняющихся вызовов по всем сессиям процесса"""
+    totals = {"queued": 0, "running": 0}
+    for scheduler in list(_schedulers):
+        for key, value in scheduler.stats().items():
+            totals[key] += value
+    return totals
+
+
+class ToolScheduler:
+    """
+    Планировщик вызовов функций одной сессии
+
+    Держит ссылки на все свои задачи, ограничивает параллелизм, применяет дедлайны
+    и приоритеты (например, text_display обгоняет web_search) и отменяет всё
+    при отключении клиента или прерывании хода.
+
+    Если задано batch_window, ответы на вызовы из одного tool_call собираются и
+    отправляются одним списком: сразу, как только готовы все, либо по истечении окна
+    с момента первого готового ответа — тогда медленные вызовы уйдут следующей пачкой.
+    """
+
+    def __init__(
+        self,
+        session_id: str,
+        respond: Callable[[List[Tuple[Any, Dict[str, Any]]]], Awaitable[None]],
+        concurrency: int = SCHEDULER_CONCURRENCY,
+        queue_size: int = SCHEDULER_QUEUE_SIZE,
+        default_timeout: float = DEFAULT_TIMEOUT,
+        batch_window: float = BATCH_WINDOW_MS / 1000,
+    ):
+        self.session_id = session_id
+        self.respond = respond
+        self.concurrency = concurrency
+        self.default_timeout = default_timeout
+        self.batch_window = batch_window
+        self._groups: Dict[str, Set[str]] = {}
+        self._ready: List[Tuple[Any, Dict[str, Any]]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue(maxsize=queue_size)
+        self._seq = itertools.count()
+        self._workers = []
+        self._running: Dict[str, asyncio.Task] = {}
+        # id выполняющегося вызова -> сам вызов (чтобы ответить модели при отмене)
+        self._executing: Dict[str, Any] = {}
+        self._queued_ids = set()
+        self._cancelled_ids = set()
+        self._closed = False
+        _schedulers.add(self)
+
+    def _start(self):
+        if not self._workers:
+            self._workers = [
+                asyncio.create_task(self._worker(), name=f"{self.session_id}:tool-worker-{i}")
+                for i in range(self.concurrency)
+            ]
+
+    def _metadata(self, name: str):
+        # Имя приходит от модели: до проверки его нельзя превращать в путь к модулю
+        if not is_valid_function_name(name):
+            return DEFAULT_PRIORITY, self.default_timeout
+        entry = registry.get(name) if registry.exists(name) else None
+        priority = getattr(entry.module, "PRIORITY", DEFAULT_PRIORITY) if entry else DEFAULT_PRIORITY
+        timeout = getattr(entry.module, "TIMEOUT", self.default_timeout) if entry else self.default_timeout
+        return priority, timeout
+
+    def submit_all(self, fcs: Iterable[Any]):
+        """Ставит в очередь все вызовы из одного tool_call"""
+        fcs = list(fcs)
+        if self.batch_window > 0 and len(fcs) > 1:
+            group = {fc.id for fc in fcs}
+            for fc in fcs:
+                self._groups[fc.id] = group
+        for fc in fcs:
+            self.submit(fc)
+
+    def submit(self, fc: Any):
+        """Ставит вызов функции в очередь (без ожидания)"""
+        if self._closed:
+            return
+        self._start()
+        try:
+            priority, timeout = self._metadata(fc.name)
+        except Exception:
+            priority, timeout = DEFAULT_PRIORITY, self.default_timeout
+        try:
+            self._queue.put_nowait((priority, next(self._seq), fc, timeout, time.perf_counter()))
+            self._queued_ids.add(fc.id)
+        except asyncio.QueueFull:
+            logger.warning(f"[{self.session_id}] очередь функций переполнена, {fc.name} отклонена")
+            manager.incr(self.session_id, "tool_rejected")
+            self._spawn_response(fc, FunctionResult(
+                success=False,
+                error="Слишком много одновременных вызовов функций, попробуйте позже"
+            ).to_dict())
+
+    def _spawn_response(self, fc: Any, result: Dict[str, Any]):
+        task = asyncio.create_task(self._respond(fc, result))
+        self._running[f"respond:{fc.id}"] = task
+        task.add_done_callback(lambda _: self._running.pop(f"respond:{fc.id}", None))
+
+    async def _respond(self, fc: Any, result: Dict[str, Any]):
+        if self._closed:
+            return
+        if fc.id not in self._groups:
+            await self._send([(fc, result)])
+            return
+
+        self._ready.append((fc, result))
+        if self._complete(fc.id):
+            await self._flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    def _complete(self, call_id: str) -> bool:
+        """Отмечает вызов завершённым; True, если готова вся его группа"""
+        group = self._groups.pop(call_id, None)
+        if group is None:
+            return False
+        group.discard(call_id)
+        return not group
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.batch_window)
+        self._flush_task = None
+        await self._flush()
+
+    async def _flush(self):
+        if self._flush_task is not None and self._flush_task is not asyncio.current_task():
+            self._flush_task.cancel()
+        self._flush_task = None
+        batch, self._ready = self._ready, []
+        if batch:
+            await self._send(batch)
+
+    async def _send(self, batch: List[Tuple[Any, Dict[str, Any]]]):
+        if self._closed:
+            return
+        try:
+            await self.respond(batch)
+            manager.incr(self.session_id, "tool_response_batches")
+        except Exception as e:
+            names = ", ".join(fc.name for fc, _ in batch)
+            logger.error(f"[{self.session_id}] не удалось отправить ответ функций {names}: {str(e)}")
+
+    async def _worker(self):
+        while True:
+            _, _, fc, timeout, enqueued_at = await self._queue.get()
+            self._queued_ids.discard(fc.id)
+            TOOL_QUEUE_WAIT.observe(time.perf_counter() - enqueued_at, fc.name)
+            try:
+                if fc.id in self._cancelled_ids:
+                    self._cancelled_ids.discard(fc.id)
+                    if self._complete(fc.id) and self._ready:
+                        await self._flush()
+                    continue
+                task = asyncio.create_task(self._execute(fc, timeout))
+                self._running[fc.id] = task
+                self._executing[fc.id] = fc
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    if not task.cancelled():
+                        raise  # отменили сам воркер
+                    manager.incr(self.session_id, "tool_cancelled")
+                    if self._complete(fc.id) and self._ready:
+                        await self._flush()
+                finally:
+                    self._running.pop(fc.id, None)
+                    self._executing.pop(fc.id, None)
+            finally:
+                self._queue.task_done()
+
+    async def _execute(self, fc: Any, timeout: float):
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(handle_function_call(fc, self.session_id), timeout)
+            status = "ok" if result.get("success") else "error"
+        except asyncio.TimeoutError:
+            status = "timeout"
+            logger.warning(f"[{self.session_id}] функция {fc.name} превысила дедлайн {timeout} с")
+            manager.incr(self.session_id, "tool_timeouts")
+            result = FunctionResult(
+                success=False,
+                error=f"Функция '{fc.name}' не уложилась в {timeout:g} с"
+            ).to_dict()
+        except asyncio.CancelledError:
+            TOOL_LATENCY.observe(time.perf_counter() - started, fc.name, "cancelled")
+            raise
+        TOOL_LATENCY.observe(time.perf_counter() - started, fc.name, status)
+        await self._respond(fc, result)
+
+    def cancel(self, ids: Iterable[str]):
+        """Отменяет выполняющиеся и ещё не начатые вызовы с указанными id"""
+        for call_id in ids:
+            task = self._running.get(call_id)
+            if task:
+                task.cancel()
+                self._executing.pop(call_id, None)
+            elif call_id in self._queued_ids:
+                self._cancelled_ids.add(call_id)
+
+    def cancel_all(self):
+        """
+        Сбрасывает очередь и отменяет все выполняющиеся вызовы (barge-in)
+
+        Live-сессия ждёт ответа на каждый вызов, поэтому на все сброшенные вызовы
+        модели уходит ответ об отмене — одной пачкой вместе с уже готовыми ответами.
+        """
+        dropped = []
+        while not self._queue.empty():
+            _, _, fc, _, _ = self._queue.get_nowait()
+            self._queue.task_done()
+            manager.incr(self.session_id, "tool_cancelled")
+            # Вызовы, отменённые самой моделью (tool_call_cancellation), ответа не ждут
+            if fc.id not in self._cancelled_ids:
+                dropped.append(fc)
+        self._queued_ids.clear()
+        self._cancelled_ids.clear()
+        self._groups.clear()
+        for call_id, fc in list(self._executing.items()):
+            self._running[call_id].cancel()
+            dropped.append(fc)
+        self._executing.clear()
+
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        batch, self._ready = self._ready, []
+        batch.extend(
+            (fc, FunctionResult(success=False, error=f"Вызов '{fc.name}' отменён: пользователь прервал ответ").to_dict())
+            for fc in dropped
+        )
+        if batch and not self._closed:
+            key = f"respond:cancelled:{next(self._seq)}"
+            task = asyncio.create_task(self._send(batch))
+            self._running[key] = task
+            task.add_done_callback(lambda _: self._running.pop(key, None))
+
+    def stats(self) -> Dict[str, int]:
+        return {"queued": self._queue.qsize(), "running": len(self._running)}
+
+    async def close(self):
+        """Отменяет все задачи сессии; после этого ответы в модель больше не отправляются"""
+        self._closed = True
+        self.cancel_all()
+        for task in self._running.values():
+            task.cancel()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, *self._running.values(), return_exceptions=True)
+        self._workers = []
+        self._running.clear()